@@ -0,0 +1,275 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    import resource # POSIX only; used for peak RSS
+except ImportError:
+    resource = None
+
+from dead_sector_killer import (scan_disk, fill_free_space, check_file_integrity, get_human_readable_size,
+                                FaultInjectingBackend, FillerPattern)
+
+
+BENCHMARK_FILE_FORMAT = "dsk-benchmark"
+BENCHMARK_SEED = 20240611 # Fixed so every run writes the same image content
+COMMANDS = ("run", "compare")
+
+def create_benchmark_image(directory, size_mb, sparse=False, seed=BENCHMARK_SEED):
+    """Creates an image file of size_mb megabytes.
+
+    Dense images are fully allocated and filled with seeded pseudo-random data
+    (the same bytes on every run); sparse images are a single hole, read in
+    full (skip_holes=False), which measures the per-block overhead of the scan
+    loop rather than the media.
+    """
+    image_path = os.path.join(directory, f"bench_{size_mb}mb{'_sparse' if sparse else ''}.img")
+    with open(image_path, 'wb') as f:
+        if sparse:
+            f.truncate(size_mb * 1024**2)
+            return image_path
+        rng = random.Random(seed)
+        chunk = rng.randbytes(1024 * 1024)
+        for _ in range(size_mb):
+            f.write(chunk)
+    return image_path
+
+def drop_page_cache(path):
+    """Evicts a file from the page cache so each run reads from the media."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def get_peak_rss_mb():
+    """Returns this process's peak resident set size in MB, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != "darwin" else peak / 1024**2 # KB on Linux, bytes on macOS
+
+def parse_fault_range(spec):
+    """Parses START_MB:END_MB[:MS] into (start_byte, end_byte[, seconds])."""
+    parts = spec.split(":")
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError(f"expected START_MB:END_MB[:MS], got '{spec}'")
+    try:
+        start, end = (int(float(part) * 1024**2) for part in parts[:2])
+        return (start, end) if len(parts) == 2 else (start, end, float(parts[2]) / 1000)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected numbers in '{spec}'")
+
+def measure(func):
+    """Runs func() with output suppressed; returns (result, wall_seconds, cpu_seconds)."""
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+    return result, time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+def make_result(name, processed_bytes, wall, cpu, **extra):
+    processed_mb = processed_bytes / (1024**2)
+    return {
+        "name": name,
+        "seconds": wall,
+        "mb_s": processed_mb / wall if wall > 0 else 0,
+        "cpu_s_per_mb": cpu / processed_mb if processed_mb else 0,
+        **extra,
+    }
+
+def benchmark_scan_jobs(image_path, job_counts, block_size_kb, direct_io, make_backend=None, label="scan"):
+    """Runs scan_disk once per job count and returns a list of result dicts.
+
+    make_backend, if given, is called once per run for a fresh device backend
+    (e.g. a FaultInjectingBackend simulating a failing disk).
+    """
+    results = []
+    for jobs in job_counts:
+        drop_page_cache(image_path)
+        summary, wall, cpu = measure(lambda: scan_disk(image_path, block_size_kb=block_size_kb, direct_io=direct_io, jobs=jobs,
+                                                        checkpoint=False, backend=make_backend() if make_backend else None,
+                                                        skip_holes=False))
+        results.append(make_result(f"{label}/bs={block_size_kb}k/jobs={jobs}", summary["bytes_scanned"], wall, cpu,
+                                   jobs=jobs, errors_found=summary["errors_found"]))
+    return results
+
+def benchmark_fill_and_check(work_dir, filler_size_mb, total_mb, writers=1):
+    """Fills total_mb with filler files of filler_size_mb using `writers` writers, then integrity-checks them.
+
+    The files carry a FillerPattern and the check compares it, as --isolate-sectors does.
+
+    Returns [fill_result, check_result]. The files are removed afterwards.
+    """
+    fill_dir = tempfile.mkdtemp(dir=work_dir, prefix="fill_")
+    pattern = FillerPattern(0)
+    try:
+        (created_files, write_errors), wall, cpu = measure(
+            lambda: fill_free_space(work_dir, fill_dir, filler_size_mb, 100, max_bytes=total_mb * 1024**2, writers=writers,
+                                    pattern=pattern))
+        written = sum(os.path.getsize(path) for path in created_files)
+        fill_result = make_result(f"fill/filler={filler_size_mb}m{f'/writers={writers}' if writers > 1 else ''}", written, wall, cpu,
+                                  files=len(created_files), errors_found=len(write_errors))
+        for path in created_files:
+            drop_page_cache(path)
+        checks, wall, cpu = measure(lambda: [check_file_integrity(path, pattern=pattern) for path in created_files])
+        check_result = make_result(f"check/filler={filler_size_mb}m{f'/writers={writers}' if writers > 1 else ''}", written, wall, cpu,
+                                   files=len(created_files), errors_found=sum(1 for is_ok, _ in checks if not is_ok))
+        return [fill_result, check_result]
+    finally:
+        for name in os.listdir(fill_dir):
+            os.remove(os.path.join(fill_dir, name))
+        os.rmdir(fill_dir)
+
+def _run_case(case):
+    """Child-process entry point: runs one benchmark case and adds its peak RSS."""
+    kind, kwargs = case
+    if kind == "scan":
+        faults = kwargs.pop("faults")
+        make_backend = (lambda: FaultInjectingBackend(**faults)) if faults else None
+        results = benchmark_scan_jobs(make_backend=make_backend, **kwargs)
+    else:
+        results = benchmark_fill_and_check(**kwargs)
+    peak_rss_mb = get_peak_rss_mb()
+    for result in results:
+        result["peak_rss_mb"] = peak_rss_mb
+    return results
+
+def run_case_isolated(case):
+    """Runs a benchmark case in a fresh process so peak RSS is measured per case."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_run_case, (case,))
+
+def run_suite(work_dir, size_mb, block_sizes, job_counts, filler_sizes, repeat=3, direct_io=False, faults=None,
+              writer_counts=(1,)):
+    """Runs every benchmark case `repeat` times and keeps the median of each metric.
+
+    Returns the list of result dicts, ordered by case.
+    """
+    images = {"dense": create_benchmark_image(work_dir, size_mb), "sparse": create_benchmark_image(work_dir, size_mb, sparse=True)}
+    cases = []
+    for image_kind, image_path in images.items():
+        for block_size_kb in block_sizes:
+            for jobs in job_counts:
+                cases.append(("scan", dict(image_path=image_path, job_counts=[jobs], block_size_kb=block_size_kb,
+                                           direct_io=direct_io, label=f"scan-{image_kind}", faults=faults)))
+    for filler_size_mb in filler_sizes:
+        for writers in writer_counts:
+            cases.append(("fill", dict(work_dir=work_dir, filler_size_mb=filler_size_mb, total_mb=size_mb, writers=writers)))
+
+    results = []
+    for case in cases:
+        runs = [run_case_isolated((case[0], dict(case[1]))) for _ in range(repeat)]
+        for index, first in enumerate(runs[0]):
+            samples = [run[index] for run in runs]
+            merged = dict(first, runs=len(samples))
+            for metric in ("seconds", "mb_s", "cpu_s_per_mb", "peak_rss_mb"):
+                values = [sample[metric] for sample in samples if sample.get(metric) is not None]
+                merged[metric] = statistics.median(values) if values else None
+            results.append(merged)
+            print(f"  {merged['name']:<36} {merged['mb_s']:10.2f} MB/s  {merged['cpu_s_per_mb'] * 1000:8.3f} ms CPU/MB  "
+                  f"{merged['peak_rss_mb'] or 0:8.1f} MB RSS  {merged['errors_found']} errors")
+    return results
+
+def compare_results(baseline, current, threshold_percent=10.0):
+    """Compares two benchmark result files.
+
+    A case regresses when its throughput drops, or its CPU time per MB or peak
+    RSS grows, by more than threshold_percent. Returns a list of
+    (name, metric, baseline_value, current_value, change_percent) regressions.
+    """
+    baseline_by_name = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        reference = baseline_by_name.get(result["name"])
+        if not reference:
+            continue
+        for metric, higher_is_better in (("mb_s", True), ("cpu_s_per_mb", False), ("peak_rss_mb", False)):
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change_percent = (new - old) / old * 100
+            if (-change_percent if higher_is_better else change_percent) > threshold_percent:
+                regressions.append((result["name"], metric, old, new, change_percent))
+    return regressions
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv.insert(0, "run") # Plain option lists keep working as "run"
+    parser = argparse.ArgumentParser(description="Benchmarks for DeadSectorKiller. Runs locally on image files; no root required.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark suite.")
+    run_parser.add_argument("--dir", metavar="DIRECTORY", type=str, default=None,
+                            help="Directory for benchmark images (e.g. an ext4 or tmpfs mount). Default: system temp dir.")
+    run_parser.add_argument("--size-mb", type=int, default=1024,
+                            help="Size of the benchmark images and of the data written by fill benchmarks, in MB. Default: 1024.")
+    run_parser.add_argument("--block-size", "-bs", dest="block_sizes", type=int, nargs="+", default=[64, 1024],
+                            help="Scan block sizes in KB to compare. Default: 64 1024.")
+    run_parser.add_argument("--jobs", type=int, nargs="+", default=[1, 4], help="Job counts to compare. Default: 1 4.")
+    run_parser.add_argument("--filler-size-mb", dest="filler_sizes", type=int, nargs="*", default=[16, 128],
+                            help="Filler file sizes in MB for the fill and check benchmarks (none to skip them). Default: 16 128.")
+    run_parser.add_argument("--writers", dest="writer_counts", type=int, nargs="+", default=[1],
+                            help="Concurrent filler writer counts to compare. Default: 1.")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is reported. Default: 3.")
+    run_parser.add_argument("--direct-io", action="store_true", help="Scan with O_DIRECT reads.")
+    run_parser.add_argument("--fault-bad", metavar="START_MB:END_MB", type=parse_fault_range, action="append", default=[],
+                            help="Simulate unreadable data in this range of the scanned images (repeatable).")
+    run_parser.add_argument("--fault-slow", metavar="START_MB:END_MB:MS", type=parse_fault_range, action="append", default=[],
+                            help="Delay every scan read touching this range by MS milliseconds (repeatable).")
+    run_parser.add_argument("--output", "-o", metavar="RESULTS_JSON", type=str, default=None,
+                            help="Save the results as JSON (for a later 'compare').")
+
+    compare_parser = commands.add_parser("compare", help="Compare results against a saved baseline and flag regressions.")
+    compare_parser.add_argument("baseline", metavar="BASELINE_JSON")
+    compare_parser.add_argument("current", metavar="CURRENT_JSON")
+    compare_parser.add_argument("--threshold", metavar="PERCENT", type=float, default=10.0,
+                                help="Flag changes worse than PERCENT. Default: 10.")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        print(f"\n--- Benchmark Comparison ({args.current} vs. baseline {args.baseline}, threshold {args.threshold:g}%) ---")
+        if not regressions:
+            print("  No regressions.")
+            return 0
+        for name, metric, old, new, change_percent in regressions:
+            print(f"  REGRESSION {name}: {metric} {old:.4g} -> {new:.4g} ({change_percent:+.1f}%)")
+        return 1
+
+    faults = None
+    if args.fault_bad or args.fault_slow:
+        faults = {"bad_ranges": args.fault_bad, "slow_ranges": args.fault_slow}
+    with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+        print(f"\n--- Benchmark Suite ({get_human_readable_size(args.size_mb * 1024**2)} images in {work_dir}, "
+              f"median of {args.repeat} runs) ---")
+        results = run_suite(work_dir, args.size_mb, args.block_sizes, args.jobs, args.filler_sizes,
+                            repeat=args.repeat, direct_io=args.direct_io, faults=faults, writer_counts=args.writer_counts)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"format": BENCHMARK_FILE_FORMAT, "version": 1, "created_at": time.time(),
+                       "host": platform.node(), "platform": platform.platform(), "python": platform.python_version(),
+                       "size_mb": args.size_mb, "direct_io": args.direct_io, "results": results}, f, indent=2)
+        print(f"  Results saved to '{args.output}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
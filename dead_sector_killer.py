@@ -6,9 +6,132 @@ import time # For progress reporting delay
 import argparse
 import sys # For sys.stdout.reconfigure and sys.exit
 import uuid
+import errno
+import mmap
+import stat
+import struct
+import threading
+import concurrent.futures
+import contextlib
+import io
+import json
+import array
+import bisect
+import heapq
+import itertools
+import math
+import random
+import multiprocessing
+import sqlite3
+import hashlib
+import queue
+import ctypes
+import abc
+
+try:
+    import fcntl # POSIX only; used for block device ioctls
+except ImportError:
+    fcntl = None
 
 
 QUARANTINE_DIR_NAME = ".quarantine_files"
+QUARANTINE_MANIFEST_NAME = "quarantine_manifest.jsonl" # Physical extents of the quarantined files, one JSON line each
+
+DEFAULT_LOGICAL_SECTOR_SIZE = 512
+BLKSSZGET = 0x1268 # ioctl: logical sector size of a block device
+
+class Reporter(abc.ABC):
+    """Single sink for the operator-facing output of scans and of the isolate pipeline.
+
+    Code reports events rather than printing: start, progress, message, error,
+    file-created, file-checked, file-deleted, file-quarantined and summary, each
+    with structured fields and an optional human-readable `text`. "detail" events
+    carry text only (per-item chatter that structured consumers do not need).
+    Renderers decide how events are written; progress events are rate-limited to
+    one per progress_interval_s unless reported with final=True. Thread-safe.
+    """
+
+    def __init__(self, progress_interval_s=1.0):
+        self.progress_interval_s = progress_interval_s
+        self._last_progress_time = 0.0
+        self._lock = threading.RLock()
+
+    def emit(self, event, text=None, end="\n", final=False, **fields):
+        with self._lock:
+            if event == "progress" and not final:
+                now = time.monotonic()
+                if now - self._last_progress_time < self.progress_interval_s:
+                    return
+                self._last_progress_time = now
+            self.render(event, text, end, fields)
+
+    @abc.abstractmethod
+    def render(self, event, text, end, fields):
+        """Writes one event; subclasses decide the format."""
+
+    def flush(self):
+        pass
+
+class TextReporter(Reporter):
+    """Renders events as the traditional human-readable console output."""
+
+    def render(self, event, text, end, fields):
+        if text is not None:
+            print(text, end=end, flush=event == "progress")
+
+class JsonlReporter(Reporter):
+    """Renders events as JSON lines ({"event": ..., "time": ..., **fields}) on a buffered stream.
+
+    Lines are collected in memory and written in batches: when max_buffered
+    events are pending, at most flush_interval_s after the last write, and
+    immediately for error and summary events.
+    """
+
+    def __init__(self, stream=None, progress_interval_s=1.0, max_buffered=512, flush_interval_s=1.0):
+        super().__init__(progress_interval_s)
+        self.stream = stream or sys.stdout
+        self.max_buffered = max_buffered
+        self.flush_interval_s = flush_interval_s
+        self._buffer = []
+        self._last_flush_time = time.monotonic()
+
+    def render(self, event, text, end, fields):
+        if event == "detail":
+            return
+        self._buffer.append(json.dumps({"event": event, "time": round(time.time(), 3), **fields}, default=str))
+        if (event in ("error", "summary") or len(self._buffer) >= self.max_buffered
+                or time.monotonic() - self._last_flush_time >= self.flush_interval_s):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                self.stream.write("\n".join(self._buffer) + "\n")
+                self._buffer.clear()
+            self.stream.flush()
+            self._last_flush_time = time.monotonic()
+
+_active_reporter = TextReporter()
+
+def get_reporter():
+    """Returns the reporter that all output currently goes to."""
+    return _active_reporter
+
+def set_reporter(reporter):
+    """Makes reporter the active one and returns the previous reporter."""
+    global _active_reporter
+    previous, _active_reporter = _active_reporter, reporter
+    return previous
+
+def report(event, text=None, **fields):
+    """Sends one event to the active reporter (see Reporter.emit)."""
+    _active_reporter.emit(event, text, **fields)
+
+def report_message(level, message, newline=False, **fields):
+    """Reports an "  Info:"/"  Warning:"/"  Error:" line; errors are sent as "error" events."""
+    text = ("\n" if newline else "") + f"  {level.capitalize()}: {message}"
+    report("error" if level == "error" else "message", text, level=level, message=message, **fields)
+
 
 def get_filesystem_info(target_path):
     """Gets filesystem information for the given target path."""
@@ -40,11 +163,183 @@ def prepare_quarantine_directory(target_path):
         print(f"  Info: Quarantine directory already exists at '{quarantine_path}'.")
     return quarantine_path
 
-def fill_free_space(filesystem_path, quarantine_dir_path, filler_file_size_mb, fill_percentage):
-    """Fills a percentage of free space with temporary files."""
-    print(f"\n--- Filling Free Space on '{filesystem_path}' ---")
-    print(f"  Targeting {fill_percentage}% of free space.")
-    print(f"  Individual filler file size: {filler_file_size_mb} MB.")
+FILL_WRITE_CHUNK_BYTES = 1024 * 1024 # Size of the reused write buffer; fill targets are whole multiples of it
+FILLER_PATTERN_SECTOR_BYTES = 512 # Granularity of the offset stamps in patterned filler files
+
+class FillerPattern:
+    """Reproducible filler file content derived from a seed, the file index and the offset.
+
+    The data is a seeded pseudo-random 1 MB background, repeated, with the first
+    16 bytes of every 512-byte sector replaced by the sector's offset in the
+    file and a tag built from the seed and the file index (little-endian). Any
+    block can therefore be regenerated for verification without storing it,
+    and zeroed sectors, stale data from another run or file, and writes that
+    landed at the wrong offset all compare unequal. Generating a block takes a
+    buffer copy and two strided array assignments, far faster than any disk.
+    Instances are safe to share between threads.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self._background = random.Random(seed).randbytes(FILL_WRITE_CHUNK_BYTES)
+        self._scratch = threading.local()
+
+    def _tag(self, file_index):
+        return (self.seed * 1_000_003 + file_index) & 0xFFFFFFFFFFFFFFFF
+
+    def fill(self, buffer, file_index, offset):
+        """Writes the pattern for [offset, offset + len(buffer)) of file file_index into buffer."""
+        view = memoryview(buffer).cast('B')
+        length = len(view)
+        sector = FILLER_PATTERN_SECTOR_BYTES
+        if offset % sector or length % sector:
+            start = align_down(offset, sector)
+            aligned = bytearray(align_up(offset + length, sector) - start)
+            self.fill(aligned, file_index, start)
+            view[:] = aligned[offset - start:offset - start + length]
+            return
+        position = 0
+        while position < length: # Tile the background, starting at the right phase
+            phase = (offset + position) % FILL_WRITE_CHUNK_BYTES
+            piece = min(length - position, FILL_WRITE_CHUNK_BYTES - phase)
+            view[position:position + piece] = self._background[phase:phase + piece]
+            position += piece
+        if not length:
+            return
+        words = view.cast('Q')
+        stride = sector // 8
+        offsets = array.array('Q', range(offset, offset + length, sector))
+        tags = array.array('Q', (self._tag(file_index),)) * len(offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            tags.byteswap()
+        words[0::stride] = offsets
+        words[1::stride] = tags
+
+    def find_mismatches(self, data, file_index, offset):
+        """Compares data read from [offset, offset + len(data)) with the pattern.
+
+        The whole block is compared in one memcmp; only a block that differs is
+        narrowed down to 512-byte sectors. Returns a list of merged (start, end)
+        file offset ranges that differ (empty if the data matches).
+        """
+        length = len(data)
+        expected = getattr(self._scratch, "buffer", None)
+        if expected is None or len(expected) != length:
+            expected = self._scratch.buffer = bytearray(length)
+        self.fill(expected, file_index, offset)
+        if expected == data:
+            return []
+        ranges = []
+        sector = FILLER_PATTERN_SECTOR_BYTES
+        first = -offset % sector or sector # Sector boundaries are file offsets, not block offsets
+        boundaries = [0] + list(range(min(first, length), length, sector)) + [length]
+        for start, end in zip(boundaries, boundaries[1:]):
+            if start < end and expected[start:end] != data[start:end]:
+                if ranges and ranges[-1][1] == offset + start:
+                    ranges[-1] = (ranges[-1][0], offset + end)
+                else:
+                    ranges.append((offset + start, offset + end))
+        return ranges
+
+def filler_file_index(file_path):
+    """Returns the index in a filler file name (filler_0007.tmp, or its quarantined name), or None."""
+    match = re.match(r"filler_(\d+)\.", os.path.basename(file_path))
+    return int(match.group(1)) if match else None
+
+def open_filler_file(file_path, direct_io=False):
+    """Creates (or truncates) a filler file for writing. Returns (fd, direct_active).
+
+    With direct_io the file is opened with O_DIRECT so writes bypass the page
+    cache; if the file system rejects O_DIRECT, the file is opened normally.
+    """
+    open_flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    if direct_io and hasattr(os, 'O_DIRECT'):
+        try:
+            return os.open(file_path, open_flags | os.O_DIRECT, 0o644), True
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+    return os.open(file_path, open_flags, 0o644), False
+
+def write_filler_file(file_path, size_bytes, write_buffer, direct_io=False, sync_interval_bytes=None, preallocate=True,
+                      fill_chunk=None):
+    """Writes one filler file of size_bytes from a reused buffer.
+
+    The file's space is reserved up front with posix_fallocate (so a full disk
+    fails fast, before any data is written, and the file is laid out
+    contiguously where possible), then the whole buffer is written over and over
+    without allocating new data objects. With direct_io the writes go straight
+    to the media (write_buffer must then be page-aligned, e.g. from
+    allocate_aligned_buffer). With sync_interval_bytes, fdatasync is called every
+    that many bytes and once at the end. Either way a completed write means the
+    data reached the disk, not just the page cache.
+    fill_chunk(view, file_offset), if given, fills the buffer with the data
+    for each chunk before it is written (see FillerPattern); otherwise the
+    buffer's contents are written unchanged.
+
+    Returns (bytes_written, seconds, direct_active). Raises OSError on failure;
+    the partial file is left in place.
+    """
+    started = time.perf_counter()
+    fd, direct_active = open_filler_file(file_path, direct_io)
+    try:
+        if preallocate and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size_bytes)
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise # ENOSPC and real I/O errors
+        sync = getattr(os, 'fdatasync', os.fsync) # No fdatasync on macOS
+        buffer_view = memoryview(write_buffer)
+        bytes_written = bytes_since_sync = 0
+        while bytes_written < size_bytes:
+            chunk = min(len(buffer_view), size_bytes - bytes_written)
+            if fill_chunk:
+                fill_chunk(buffer_view[:chunk], bytes_written)
+            written = os.write(fd, buffer_view[:chunk])
+            if written <= 0:
+                raise OSError(errno.EIO, f"Write returned {written} at offset {bytes_written}")
+            bytes_written += written
+            bytes_since_sync += written
+            if sync_interval_bytes and bytes_since_sync >= sync_interval_bytes:
+                sync(fd)
+                bytes_since_sync = 0
+        if sync_interval_bytes or direct_active:
+            sync(fd) # Also flushes the metadata of the preallocated extents
+    finally:
+        os.close(fd)
+    return bytes_written, time.perf_counter() - started, direct_active
+
+def fill_free_space(filesystem_path, quarantine_dir_path, filler_file_size_mb, fill_percentage, max_bytes=None,
+                    direct_io=False, sync_interval_mb=None, preallocate=True, writers=1, on_file_created=None,
+                    pattern=None):
+    """Fills a percentage of free space with temporary files, writing at most max_bytes if given.
+
+    The fill target is rounded down to whole megabytes and split into files of
+    filler_file_size_mb (the last one may be smaller); every planned file is
+    attempted once. A write error marks that file bad and the fill moves on;
+    running out of space stops it. See write_filler_file for direct_io,
+    sync_interval_mb and preallocate. Per-file and overall write throughput
+    are reported. Filler files hold null bytes unless a FillerPattern is given
+    as pattern.
+
+    With writers > 1 that many files are written concurrently by a thread pool
+    (for RAID arrays and NVMe drives that one sequential writer cannot
+    saturate). The planned files stay the same, so the total never exceeds the
+    target; after ENOSPC no further files are started and the ones in flight
+    finish or fail on their own. The returned lists are in file order.
+
+    on_file_created(file_path, size_bytes), if given, is called as soon as each
+    filler file is complete, on the thread running the fill; it may block to
+    hold back the fill (see fill_and_verify).
+
+    Returns (created_files, write_errors) where write_errors is a list of
+    (file_path, message) tuples.
+    """
+    report("start", f"\n--- Filling Free Space on '{filesystem_path}' ---\n  Targeting {fill_percentage}% of free space.\n"
+                    f"  Individual filler file size: {filler_file_size_mb} MB.",
+           operation="fill", path=filesystem_path, fill_percentage=fill_percentage, filler_file_size_mb=filler_file_size_mb)
 
     fs_info = get_filesystem_info(filesystem_path)
     if not fs_info:
@@ -52,94 +347,226 @@ def fill_free_space(filesystem_path, quarantine_dir_path, filler_file_size_mb, f
 
     free_space_bytes = fs_info['free_space']
     target_bytes_to_fill = int(free_space_bytes * (fill_percentage / 100.0))
+    if max_bytes is not None:
+        target_bytes_to_fill = min(target_bytes_to_fill, max_bytes)
+    target_bytes_to_fill = align_down(target_bytes_to_fill, FILL_WRITE_CHUNK_BYTES)
     filler_file_size_bytes = filler_file_size_mb * 1024 * 1024
 
     if target_bytes_to_fill == 0:
-        print("  Info: No space to fill (target fill amount is 0 bytes, possibly due to low free space or low percentage).")
+        report_message("info", "No space to fill (target fill amount is 0 bytes, possibly due to low free space or low percentage).")
         return [], []
     if filler_file_size_bytes == 0:
-        print("  Error: Filler file size cannot be 0 MB.")
+        report_message("error", "Filler file size cannot be 0 MB.")
         return [], [("Configuration Error", "Filler file size is 0 MB.")]
 
 
-    print(f"  Current free space: {get_human_readable_size(free_space_bytes)}")
-    print(f"  Target space to fill: {get_human_readable_size(target_bytes_to_fill)}")
+    report("message", f"  Current free space: {get_human_readable_size(free_space_bytes)}\n"
+                      f"  Target space to fill: {get_human_readable_size(target_bytes_to_fill)}",
+           level="info", free_space=free_space_bytes, target_bytes=target_bytes_to_fill)
+    fill_started = time.perf_counter()
 
     total_bytes_written_overall = 0
-    created_files_list = []
-    write_errors = []
-    file_index = 0
-    # Use a reasonably sized chunk, e.g., 1MB, to avoid excessive memory usage for very large filler files
-    # but also not too small to cause too many write calls.
-    write_chunk_size = 1 * 1024 * 1024 # 1MB
-
-    while total_bytes_written_overall < target_bytes_to_fill:
-        file_index += 1
-        filename = f"filler_{file_index:04d}.tmp"
-        file_path = os.path.join(quarantine_dir_path, filename)
-        
-        # Determine how much to write for *this* file
-        bytes_remaining_for_target = target_bytes_to_fill - total_bytes_written_overall
-        current_file_target_size = min(filler_file_size_bytes, bytes_remaining_for_target)
-
-        if current_file_target_size == 0: # No more space needed to reach overall target
-            break
+    write_seconds = 0.0
+    direct_used = False
+    sync_interval_bytes = int(sync_interval_mb * 1024 * 1024) if sync_interval_mb else None
+    file_sizes = [min(filler_file_size_bytes, target_bytes_to_fill - offset)
+                  for offset in range(0, target_bytes_to_fill, filler_file_size_bytes)]
+    writers = max(1, min(writers, len(file_sizes)))
+    # Each writer thread reuses one zero-filled, page-aligned buffer for all its writes.
+    writer_state = threading.local()
+    stop_requested = threading.Event()
+    outcomes = {} # file index -> (file_path, bytes_written or None, error message or None)
 
-        print(f"  Creating filler file: {filename} (Size: {get_human_readable_size(current_file_target_size)})")
-        
-        bytes_written_for_this_file = 0
+    def write_planned_file(file_index, size_bytes):
+        file_path = os.path.join(quarantine_dir_path, f"filler_{file_index:04d}.tmp")
+        if stop_requested.is_set():
+            return file_index, file_path, None
+        if not hasattr(writer_state, "buffer"):
+            writer_state.buffer = allocate_aligned_buffer(FILL_WRITE_CHUNK_BYTES)
+        fill_chunk = (lambda view, offset: pattern.fill(view, file_index, offset)) if pattern else None
         try:
-            with open(file_path, 'wb') as f:
-                while bytes_written_for_this_file < current_file_target_size:
-                    # Ensure we don't write more than needed for this file, or more than overall target
-                    bytes_to_write_this_chunk = min(write_chunk_size, 
-                                                    current_file_target_size - bytes_written_for_this_file)
-                    
-                    # This check is crucial to ensure we don't exceed the *overall* target_bytes_to_fill
-                    # if the last chunk of the last file would make it go over.
-                    if total_bytes_written_overall + bytes_written_for_this_file + bytes_to_write_this_chunk > target_bytes_to_fill:
-                        bytes_to_write_this_chunk = target_bytes_to_fill - (total_bytes_written_overall + bytes_written_for_this_file)
-
-                    if bytes_to_write_this_chunk <= 0: # Should not happen if outer loop condition is correct
-                        break
-                        
-                    f.write(b'\0' * bytes_to_write_this_chunk) # Write null bytes for simplicity
-                    bytes_written_for_this_file += bytes_to_write_this_chunk
-            
-            created_files_list.append(file_path)
-            total_bytes_written_overall += bytes_written_for_this_file
-            print(f"  Successfully wrote {filename}. Total space filled: {get_human_readable_size(total_bytes_written_overall)} / {get_human_readable_size(target_bytes_to_fill)}")
-
-        except IOError as e:
-            err_msg = f"IOError writing to {file_path}: {e}. This file might be on a bad sector or disk is full."
-            print(f"  Error: {err_msg}")
-            write_errors.append((file_path, err_msg))
-            # If it's a "No space left on device" error, we should stop.
-            if e.errno == 28: # ENOSPC
-                print("  Warning: Disk ran out of space. Stopping filler file creation.")
-                break 
-            # For other IOErrors, we still try to continue with the next file, assuming it might be a localized bad sector.
-        except OSError as e:
-            err_msg = f"OSError creating/writing to {file_path}: {e}. This file might be on a bad sector or disk is full."
-            print(f"  Error: {err_msg}")
-            write_errors.append((file_path, err_msg))
-            if e.errno == 28: # ENOSPC
-                print("  Warning: Disk ran out of space. Stopping filler file creation.")
+            return file_index, file_path, write_filler_file(file_path, size_bytes, writer_state.buffer, direct_io=direct_io,
+                                                            sync_interval_bytes=sync_interval_bytes, preallocate=preallocate,
+                                                            fill_chunk=fill_chunk)
+        except Exception as e:
+            return file_index, file_path, e
+
+    if writers > 1:
+        report_message("info", f"Writing up to {writers} filler files concurrently.")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=writers) as executor:
+        planned = iter(enumerate(file_sizes, start=1))
+        pending = set()
+        while True:
+            # Keep at most `writers` files in flight; stop handing out new ones once the fill is stopping.
+            while len(pending) < writers and not stop_requested.is_set():
+                file_index, current_file_target_size = next(planned, (None, None))
+                if file_index is None:
+                    break
+                report("detail", f"  Creating filler file: filler_{file_index:04d}.tmp (Size: {get_human_readable_size(current_file_target_size)})")
+                pending.add(executor.submit(write_planned_file, file_index, current_file_target_size))
+            if not pending:
                 break
-            # For other OSErrors, attempt to continue
-        except Exception as e: # Catch any other unexpected errors during file write
-            err_msg = f"Unexpected error writing to {file_path}: {type(e).__name__} - {e}."
-            print(f"  Error: {err_msg}")
-            write_errors.append((file_path, err_msg))
-            break # For unexpected errors, it's safer to stop the filling process.
-
-    print("--- Fill Summary ---")
-    print(f"  Targeted {fill_percentage}% of free space ({get_human_readable_size(target_bytes_to_fill)}).")
-    print(f"  Actually filled: {get_human_readable_size(total_bytes_written_overall)} across {len(created_files_list)} files.")
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in sorted(done, key=lambda done_future: done_future.result()[0]):
+                file_index, file_path, result = future.result()
+                filename = os.path.basename(file_path)
+                if result is None:
+                    continue # Never started: the fill was stopped first
+                if isinstance(result, OSError):
+                    err_msg = f"IOError writing to {file_path}: {result}. This file might be on a bad sector or disk is full."
+                    report_message("error", err_msg, path=file_path)
+                    outcomes[file_index] = (file_path, None, err_msg)
+                    if result.errno == errno.ENOSPC and not stop_requested.is_set():
+                        report_message("warning", "Disk ran out of space. Stopping filler file creation.")
+                        stop_requested.set()
+                    # For other I/O errors, continue with the next file, assuming a localized bad sector.
+                    continue
+                if isinstance(result, Exception): # Any other unexpected error during file write
+                    err_msg = f"Unexpected error writing to {file_path}: {type(result).__name__} - {result}."
+                    report_message("error", err_msg, path=file_path)
+                    outcomes[file_index] = (file_path, None, err_msg)
+                    stop_requested.set() # For unexpected errors, it's safer to stop the filling process.
+                    continue
+                bytes_written_for_this_file, seconds, direct_active = result
+                direct_used = direct_used or direct_active
+                write_seconds += seconds
+                total_bytes_written_overall += bytes_written_for_this_file
+                outcomes[file_index] = (file_path, bytes_written_for_this_file, None)
+                mb_s = bytes_written_for_this_file / 1024**2 / seconds if seconds > 0 else 0.0
+                report("file-created", f"  Successfully wrote {filename} at {mb_s:.2f} MB/s. Total space filled: "
+                                       f"{get_human_readable_size(total_bytes_written_overall)} / {get_human_readable_size(target_bytes_to_fill)}",
+                       path=file_path, size=bytes_written_for_this_file, seconds=round(seconds, 3), mb_s=round(mb_s, 2),
+                       bytes_done=total_bytes_written_overall, bytes_total=target_bytes_to_fill)
+                if on_file_created:
+                    on_file_created(file_path, bytes_written_for_this_file)
+
+    # Results in file order, independent of which writer finished first.
+    created_files_list = [outcomes[index][0] for index in sorted(outcomes) if outcomes[index][2] is None]
+    write_errors = [(outcomes[index][0], outcomes[index][2]) for index in sorted(outcomes) if outcomes[index][2] is not None]
+    # With several writers the per-file times overlap; the overall rate is based on wall time instead.
+    if writers > 1:
+        write_seconds = time.perf_counter() - fill_started
+    overall_mb_s = total_bytes_written_overall / 1024**2 / write_seconds if write_seconds > 0 else 0.0
+    write_mode = "direct I/O" if direct_used else ("synced to disk" if sync_interval_bytes else "through the page cache")
+    summary_lines = ["--- Fill Summary ---",
+                     f"  Targeted {fill_percentage}% of free space ({get_human_readable_size(target_bytes_to_fill)}).",
+                     f"  Actually filled: {get_human_readable_size(total_bytes_written_overall)} across {len(created_files_list)} files.",
+                     f"  Write throughput: {overall_mb_s:.2f} MB/s ({write_mode})."]
     if write_errors:
-        print(f"  Encountered {len(write_errors)} errors during file creation/writing.")
+        summary_lines.append(f"  Encountered {len(write_errors)} errors during file creation/writing.")
+    report("summary", "\n".join(summary_lines), operation="fill", target_bytes=target_bytes_to_fill,
+           bytes_written=total_bytes_written_overall, files_created=len(created_files_list), errors=len(write_errors),
+           mb_s=round(overall_mb_s, 2), direct_io=direct_used)
     return created_files_list, write_errors
 
+class VerificationPipeline:
+    """Verifies filler files on a background thread while the fill is still writing more.
+
+    submit() queues a finished file and blocks while more than
+    max_unverified_bytes of written files are waiting for verification, which
+    holds back the fill instead of letting it run ahead of the reads. With
+    release_healthy, files that verify are deleted right away, returning
+    their space to the file system. finish() waits for the queue to drain.
+    """
+
+    def __init__(self, max_unverified_bytes, release_healthy=True, check=None):
+        self.max_unverified_bytes = max_unverified_bytes
+        self.release_healthy = release_healthy
+        self.check = check or check_file_integrity
+        self.results = {} # file path -> (is_ok, message, released)
+        self.unverified_bytes = self.held_bytes = 0
+        self.peak_unverified_bytes = self.peak_held_bytes = 0
+        self._condition = threading.Condition()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._verify_files, name="dsk-verify", daemon=True)
+        self._thread.start()
+
+    def submit(self, file_path, size_bytes):
+        with self._condition:
+            while self.unverified_bytes and self.unverified_bytes + size_bytes > self.max_unverified_bytes:
+                self._condition.wait()
+            self.unverified_bytes += size_bytes
+            self.held_bytes += size_bytes
+            self.peak_unverified_bytes = max(self.peak_unverified_bytes, self.unverified_bytes)
+            self.peak_held_bytes = max(self.peak_held_bytes, self.held_bytes)
+        self._queue.put((file_path, size_bytes))
+
+    def _verify_files(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            file_path, size_bytes = item
+            try:
+                is_ok, message = self.check(file_path)
+            except Exception as e:
+                is_ok, message = False, f"Verification failed: {type(e).__name__} - {e}"
+            released = is_ok and self.release_healthy and delete_healthy_file(file_path)
+            with self._condition:
+                self.results[file_path] = (is_ok, message, released)
+                self.unverified_bytes -= size_bytes
+                if released:
+                    self.held_bytes -= size_bytes
+                self._condition.notify_all()
+
+    def finish(self):
+        """Waits until every submitted file is verified. Returns the results dict."""
+        self._queue.put(None)
+        self._thread.join()
+        return self.results
+
+def fill_and_verify(filesystem_path, quarantine_dir_path, filler_file_size_mb, fill_percentage,
+                    max_unverified_mb=1024, release_healthy=True, cold_read=False, pattern_seed=None, check=None,
+                    **fill_kwargs):
+    """Fills free space and verifies every filler file as soon as it is written.
+
+    The fill (fill_free_space, with fill_kwargs) and the read-back run as a
+    producer/consumer pipeline (see VerificationPipeline), so the disk is read
+    while later files are still being written, and at most max_unverified_mb
+    of written files wait for verification. Healthy files are deleted as soon
+    as they verify unless release_healthy=False. The file system may then reuse
+    that space for later filler files, so hold them (release_healthy=False) when
+    every written byte must land on a different part of the free space.
+    The files are written with a FillerPattern from pattern_seed (a new random
+    seed per run if None, so data left over from an earlier run never matches)
+    and checked against it with check_file_integrity (cold=cold_read) unless
+    another check(file_path) -> (is_ok, message) is given.
+
+    Returns (healthy_files, bad_files_with_errors, released_files), in file
+    order. bad_files_with_errors includes files that failed while being
+    written; released_files are the healthy files already deleted.
+    """
+    if pattern_seed is None:
+        pattern_seed = random.getrandbits(32)
+    pattern = FillerPattern(pattern_seed)
+    report("detail", f"  Filler content pattern seed: {pattern_seed}")
+    if check is None:
+        check = lambda file_path: check_file_integrity(file_path, cold=cold_read, pattern=pattern)
+    pipeline = VerificationPipeline(max(int(max_unverified_mb * 1024 * 1024), 1), release_healthy=release_healthy, check=check)
+    report("start", "\n--- Starting Integrity Check for Filler Files (runs alongside the fill) ---", operation="check")
+    report("detail", f"  Verifying filler files while filling (up to {get_human_readable_size(pipeline.max_unverified_bytes)} unverified"
+                     f"{', releasing healthy files as they pass' if release_healthy else ''}).")
+    try:
+        created_files, write_errors = fill_free_space(filesystem_path, quarantine_dir_path, filler_file_size_mb,
+                                                      fill_percentage, on_file_created=pipeline.submit, pattern=pattern,
+                                                      **fill_kwargs)
+    finally:
+        results = pipeline.finish()
+
+    healthy_files, released_files = [], []
+    bad_files_with_errors = [(file_path, f"Failed during creation: {message}") for file_path, message in write_errors]
+    for file_path in created_files:
+        is_ok, message, released = results[file_path]
+        if is_ok:
+            healthy_files.append(file_path)
+            if released:
+                released_files.append(file_path)
+        else:
+            bad_files_with_errors.append((file_path, message))
+    report("detail", f"  Pipeline: peak {get_human_readable_size(pipeline.peak_unverified_bytes)} unverified, "
+                     f"peak {get_human_readable_size(pipeline.peak_held_bytes)} of filler files on disk.")
+    return healthy_files, bad_files_with_errors, released_files
+
 def list_quarantine_files(quarantine_dir_path):
     """Lists files currently in the quarantine directory."""
     print(f"\n--- Quarantined Files in {quarantine_dir_path} ---")
@@ -148,15 +575,20 @@ def list_quarantine_files(quarantine_dir_path):
         return
 
     try:
-        files = [f for f in os.listdir(quarantine_dir_path) if os.path.isfile(os.path.join(quarantine_dir_path, f))]
+        files = [f for f in os.listdir(quarantine_dir_path)
+                 if os.path.isfile(os.path.join(quarantine_dir_path, f)) and f != QUARANTINE_MANIFEST_NAME]
         if not files:
             print("  No files found in the quarantine directory.")
             return
 
+        manifest = load_quarantine_manifest(quarantine_dir_path)
         for filename in files:
-            print(f"  - {filename}")
-            # Optional: Add logic here to parse filename for error reasons if they are encoded.
-            # For now, just listing names.
+            record = manifest.get(filename)
+            if record and record.get("lbas"):
+                lbas = ", ".join(f"{start}-{end - 1}" for start, end in record["lbas"][:3])
+                print(f"  - {filename} (LBAs {lbas}{' ...' if len(record['lbas']) > 3 else ''} of {record['disk']})")
+            else:
+                print(f"  - {filename}")
     except OSError as e:
         print(f"  Error: Could not list files in quarantine directory '{quarantine_dir_path}'. {type(e).__name__}: {e}")
 
@@ -174,7 +606,8 @@ def delete_quarantine_files(quarantine_dir_path, filename_to_delete=None, delete
     files_to_delete = []
     if delete_all:
         try:
-            files_to_delete = [f for f in os.listdir(quarantine_dir_path) if os.path.isfile(os.path.join(quarantine_dir_path, f))]
+            files_to_delete = [f for f in os.listdir(quarantine_dir_path)
+                               if os.path.isfile(os.path.join(quarantine_dir_path, f)) and f != QUARANTINE_MANIFEST_NAME]
             if not files_to_delete:
                 print("  No files found to delete in the quarantine directory.")
                 return
@@ -208,25 +641,154 @@ def delete_quarantine_files(quarantine_dir_path, filename_to_delete=None, delete
         except OSError as e:
             print(f"  Error deleting file {filename}: {e}")
 
-def process_filler_files(quarantine_dir_path, healthy_files, bad_files_with_errors):
-    """Processes filler files: deletes healthy ones, renames and retains bad ones."""
-    print("\n--- Processing Filler Files (Retention/Deletion) ---")
+def delete_healthy_file(file_path):
+    """Deletes a filler file that passed verification. Returns True if it was deleted."""
+    report("detail", f"  Deleting healthy file: {file_path}")
+    try:
+        os.remove(file_path)
+    except OSError as e:
+        report("error", f"  Error deleting healthy file {file_path}: {e}", message=str(e), path=file_path)
+        return False
+    report("file-deleted", path=file_path)
+    return True
+
+QUARANTINE_MARGIN_BYTES = 1024 * 1024 # Kept allocated around each bad range of a shrunk quarantined file
+REFINE_READ_CHUNK_BYTES = 64 * 1024
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+_libc_fallocate = None
+
+def punch_hole(fd, offset, length):
+    """Deallocates [offset, offset + length) of an open file, keeping its size (FALLOC_FL_PUNCH_HOLE).
+
+    The rest of the file keeps its blocks where they are. Raises OSError
+    (EOPNOTSUPP where the platform or file system cannot punch holes).
+    """
+    global _libc_fallocate
+    if _libc_fallocate is None:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            _libc_fallocate = getattr(libc, 'fallocate64', None) or libc.fallocate
+            _libc_fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+        except (OSError, AttributeError, TypeError):
+            _libc_fallocate = False
+    if not _libc_fallocate:
+        raise OSError(errno.EOPNOTSUPP, "fallocate() is not available on this platform")
+    if _libc_fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+def find_bad_file_ranges(file_path, chunk_bytes=REFINE_READ_CHUNK_BYTES, backend=None, pattern=None):
+    """Re-reads a file in small chunks and returns a BadRegionMap of the byte ranges that fail.
+
+    A chunk that cannot be read is bisected to sectors (locate_bad_sectors).
+    With a FillerPattern, ranges that read back with the wrong data count as
+    bad too. The file is read with O_DIRECT where possible, so the page cache
+    cannot hide failing sectors.
+    """
+    backend = backend or FileDeviceBackend()
+    bad_regions = BadRegionMap()
+    fd, direct_active = backend.open(file_path, direct_io=True)
+    try:
+        file_size = os.fstat(fd).st_size
+        sector_size = get_logical_sector_size(fd)
+        chunk_bytes = max(align_down(chunk_bytes, sector_size), sector_size)
+        read_block = backend.make_reader(fd, direct_active, sector_size, chunk_bytes, return_data=pattern is not None)
+        count_block = (lambda offset, length: len(read_block(offset, length))) if pattern is not None else read_block
+        file_index = filler_file_index(file_path) or 0
+        for offset in range(0, file_size, chunk_bytes):
+            length = min(chunk_bytes, file_size - offset)
+            try:
+                data = read_block(offset, length)
+            except (IOError, OSError):
+                _, bad_sector_offsets = locate_bad_sectors(count_block, offset, length, sector_size)
+                for sector_offset in bad_sector_offsets:
+                    bad_regions.add(sector_offset, min(sector_size, file_size - sector_offset))
+                continue
+            if pattern is not None:
+                for start, end in pattern.find_mismatches(data, file_index, offset):
+                    bad_regions.add(start, end - start)
+    finally:
+        os.close(fd)
+    return bad_regions
+
+def shrink_quarantined_file(file_path, bad_regions, margin_bytes=QUARANTINE_MARGIN_BYTES):
+    """Releases the healthy parts of a quarantined file, keeping its bad ranges allocated.
+
+    Everything further than margin_bytes (rounded out to file system blocks)
+    from a range in bad_regions is deallocated with punch_hole; the bad blocks
+    stay allocated in place, so the file system still cannot hand them out.
+    Where holes cannot be punched, the file is truncated after its last kept
+    range instead. Copying the kept ranges into smaller files would move the
+    data to fresh blocks and give the bad ones back, so it is not done. A file
+    without known bad ranges is left whole.
+
+    Returns (reclaimed_bytes, method) with method "punch-hole", "truncate" or None.
+    """
+    if not bad_regions:
+        return 0, None
+    fd = os.open(file_path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        st = os.fstat(fd)
+        block = max(getattr(st, 'st_blksize', 0), DEFAULT_LOGICAL_SECTOR_SIZE)
+        allocated_before = getattr(st, 'st_blocks', 0) * 512
+        kept = BadRegionMap((max(align_down(start - margin_bytes, block), 0), min(align_up(end + margin_bytes, block), st.st_size))
+                            for start, end in bad_regions)
+        releasable, position = [], 0
+        for start, end in kept:
+            if start > position:
+                releasable.append((position, start))
+            position = end
+        if position < st.st_size:
+            releasable.append((position, st.st_size))
+        if not releasable:
+            return 0, None
+        method = "punch-hole"
+        try:
+            for start, end in releasable:
+                punch_hole(fd, start, end - start)
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                raise
+            method = "truncate"
+            os.ftruncate(fd, position)
+        if method == "truncate" and position == st.st_size:
+            return 0, None
+        os.fsync(fd)
+        allocated_after = getattr(os.fstat(fd), 'st_blocks', 0) * 512
+        if not allocated_before: # st_blocks unavailable (Windows): count the released ranges
+            return (st.st_size - position if method == "truncate" else sum(end - start for start, end in releasable)), method
+        return max(allocated_before - allocated_after, 0), method
+    finally:
+        os.close(fd)
+
+def process_filler_files(quarantine_dir_path, healthy_files, bad_files_with_errors, shrink=False,
+                         margin_bytes=QUARANTINE_MARGIN_BYTES, pattern=None, backend=None, record_extents=False):
+    """Processes filler files: deletes healthy ones, renames and retains bad ones.
+
+    With shrink, each retained file is re-read in small chunks to find its
+    failing ranges (find_bad_file_ranges, with pattern and backend), and
+    everything but those ranges plus margin_bytes is released
+    (shrink_quarantined_file). The bytes reclaimed are reported. With
+    record_extents, the physical location of every retained file is stored in
+    the quarantine manifest (record_quarantine_extents).
+    """
+    report("start", "\n--- Processing Filler Files (Retention/Deletion) ---", operation="process",
+           path=quarantine_dir_path, healthy_files=len(healthy_files), bad_files=len(bad_files_with_errors))
     retained_files_info = []
     deleted_files_count = 0
 
     # Process Healthy Files
-    print("  Processing healthy files for deletion...")
+    report("detail", "  Processing healthy files for deletion...")
     for file_path in healthy_files:
-        print(f"  Deleting healthy file: {file_path}")
-        try:
-            os.remove(file_path)
+        if delete_healthy_file(file_path):
             deleted_files_count += 1
-        except OSError as e:
-            print(f"  Error deleting healthy file {file_path}: {e}")
 
     # Process Bad Files
-    print("\n  Processing bad files for retention...")
+    report("detail", "\n  Processing bad files for retention...")
     bad_file_rename_counter = 0 # Used if UUID somehow produces a collision, or as a fallback
+    total_reclaimed_bytes = 0
+    quarantined = [] # (quarantined_path, original_path, reason, bad_ranges) for the manifest
     for file_path, error_message in bad_files_with_errors:
         original_basename = os.path.basename(file_path)
         base_name_no_ext, _ = os.path.splitext(original_basename) # Removes .tmp or any other extension
@@ -236,23 +798,27 @@ def process_filler_files(quarantine_dir_path, healthy_files, bad_files_with_erro
         new_file_path = os.path.join(quarantine_dir_path, new_filename)
 
         # Ensure uniqueness in the unlikely event of a hash collision
-        while os.path.exists(new_file_path):
+        collision_attempts = 0
+        while os.path.exists(new_file_path) and collision_attempts <= 100: # Safety limit for the loop
+            collision_attempts += 1
             bad_file_rename_counter += 1
             unique_id_collision = f"{unique_id}_{bad_file_rename_counter}"
             new_filename = f"{base_name_no_ext}.quarantined.{unique_id_collision}.bad"
             new_file_path = os.path.join(quarantine_dir_path, new_filename)
-            if bad_file_rename_counter > 100: # Safety break for the loop
-                print(f"  Critical Error: Could not generate a unique name for {file_path} after multiple attempts. Skipping rename.")
-                # Add original file path with error to retained_info if it couldn't be renamed
-                retained_files_info.append((file_path, f"Original error: {error_message}, Critical: Failed to generate unique rename path."))
-                continue # Skip to next bad file
+        if collision_attempts > 100:
+            report("error", f"  Critical Error: Could not generate a unique name for {file_path} after multiple attempts. Skipping rename.",
+                   message="Could not generate a unique quarantine name", path=file_path)
+            # Add original file path with error to retained_info if it couldn't be renamed
+            retained_files_info.append((file_path, f"Original error: {error_message}, Critical: Failed to generate unique rename path."))
+            continue # Skip to next bad file
 
-        print(f"  Retaining bad file: {file_path} as {new_file_path} due to: {error_message}")
+        report("detail", f"  Retaining bad file: {file_path} as {new_file_path} due to: {error_message}")
         try:
             if not os.path.exists(file_path):
                 # If the original file doesn't exist, it can't be renamed.
                 # This might happen if it was a creation error and the file was never fully created or already cleaned up.
-                print(f"  Warning: Original bad file {file_path} not found for renaming. It might have been an error during creation or already moved/deleted.")
+                report_message("warning", f"Original bad file {file_path} not found for renaming. It might have been an error during creation or already moved/deleted.",
+                               path=file_path)
                 # Log the error for the original path as it's still a "bad" outcome.
                 retained_files_info.append((file_path, f"Original error: {error_message}, File was not found for rename."))
                 continue
@@ -260,16 +826,82 @@ def process_filler_files(quarantine_dir_path, healthy_files, bad_files_with_erro
             os.rename(file_path, new_file_path)
             retained_files_info.append((new_file_path, error_message))
         except OSError as e:
-            print(f"  Error renaming bad file {file_path} to {new_file_path}: {e}. It might still exist with its original name if the error is non-critical.")
+            report("error", f"  Error renaming bad file {file_path} to {new_file_path}: {e}. It might still exist with its original name if the error is non-critical.",
+                   message=str(e), path=file_path)
             # If rename fails, the original file (e.g. filler_xxxx.tmp) is still in the quarantine dir.
             # We should record this fact along with the original error.
             retained_files_info.append((file_path, f"Original error: {error_message}, Rename failed: {e}"))
+            continue
+
+        bad_ranges, reclaimed_bytes = [], 0
+        if shrink:
+            try:
+                bad_regions = find_bad_file_ranges(new_file_path, backend=backend, pattern=pattern)
+                reclaimed_bytes, method = shrink_quarantined_file(new_file_path, bad_regions, margin_bytes)
+                bad_ranges = bad_regions.ranges()
+            except OSError as e:
+                report_message("warning", f"Could not shrink {new_file_path}: {e}. The whole file stays quarantined.", path=new_file_path)
+            else:
+                total_reclaimed_bytes += reclaimed_bytes
+                if not bad_ranges:
+                    report("detail", f"  Could not reproduce the failure in {new_file_path}; keeping the whole file.")
+                elif method:
+                    report("detail", f"  Shrunk {new_file_path} to {len(bad_ranges)} bad range(s) "
+                                     f"({get_human_readable_size(bad_regions.total_bytes())}) plus margin; "
+                                     f"reclaimed {get_human_readable_size(reclaimed_bytes)} ({method}).")
+        report("file-quarantined", path=file_path, quarantined_path=new_file_path, reason=error_message,
+               bad_ranges=[list(r) for r in bad_ranges], reclaimed_bytes=reclaimed_bytes)
+        quarantined.append((new_file_path, file_path, error_message, bad_ranges))
 
+    if shrink and retained_files_info:
+        report("message", f"  Shrinking quarantined files reclaimed {get_human_readable_size(total_reclaimed_bytes)}.",
+               level="info", reclaimed_bytes=total_reclaimed_bytes)
+    if record_extents and quarantined:
+        records = record_quarantine_extents(quarantine_dir_path, quarantined)
+        for record in records:
+            if "lbas" in record:
+                report("detail", f"  {record['file']} lies at LBAs "
+                                 f"{', '.join(f'{start}-{end - 1}' for start, end in record['lbas'][:5])}"
+                                 f"{' ...' if len(record['lbas']) > 5 else ''} of {record['disk']}"
+                                 f"{'; bad LBAs ' + ', '.join(f'{start}-{end - 1}' for start, end in record['bad_lbas'][:5]) if record['bad_lbas'] else ''}.")
+            report("file-located", path=os.path.join(quarantine_dir_path, record["file"]), disk=record["disk"],
+                   lbas=record.get("lbas"), bad_lbas=record.get("bad_lbas"), extents=record["extents"])
+        report("message", f"  Recorded the physical location of {len(records)} quarantined file(s) in "
+                          f"{os.path.join(quarantine_dir_path, QUARANTINE_MANIFEST_NAME)}.", level="info", files=len(records))
     return retained_files_info, deleted_files_count
 
-def check_file_integrity(file_path, read_chunk_size_kb=1024):
-    """Checks the integrity of a file by reading it in chunks."""
-    print(f"\n  Checking integrity of: {file_path}")
+MISMATCH_MESSAGE_PREFIX = "Data mismatch"
+
+def check_file_integrity(file_path, read_chunk_size_kb=1024, backend=None, cold=False, pattern=None, file_index=None):
+    """Checks the integrity of a file by reading it in chunks.
+
+    The file is opened through backend (default: FileDeviceBackend), so a
+    FaultInjectingBackend can simulate read errors. A file read back right
+    after it was written mostly comes from the page cache; cold=True reads it
+    from the media instead (see ColdFile). With a FillerPattern, every chunk
+    is also compared with the data the file was written with (file_index
+    defaults to the one in the file name); a file that reads back without
+    errors but differs fails with a message starting with
+    MISMATCH_MESSAGE_PREFIX. Returns (is_ok, message) and reports a
+    file-checked event with the result, the failure class ("read-error" or
+    "mismatch") and the read throughput.
+    """
+    io_stats = {"bytes_read": 0, "read_mode": "page cache", "mismatched_ranges": []}
+    if pattern is not None and file_index is None:
+        file_index = filler_file_index(file_path) or 0
+    started = time.monotonic()
+    is_ok, message = _check_file_integrity(file_path, read_chunk_size_kb, backend or FileDeviceBackend(), cold,
+                                           pattern, file_index, io_stats)
+    seconds = time.monotonic() - started
+    mb_s = io_stats["bytes_read"] / (1024 * 1024) / seconds if seconds > 0 else 0.0
+    failure = None if is_ok else ("mismatch" if io_stats["mismatched_ranges"] else "read-error")
+    report("file-checked", path=file_path, ok=is_ok, message=message, failure=failure, bytes_read=io_stats["bytes_read"],
+           seconds=round(seconds, 3), mb_s=round(mb_s, 2), read_mode=io_stats["read_mode"],
+           mismatched_ranges=[list(r) for r in io_stats["mismatched_ranges"]])
+    return is_ok, message
+
+def _check_file_integrity(file_path, read_chunk_size_kb, backend, cold, pattern, file_index, io_stats):
+    report("detail", f"\n  Checking integrity of: {file_path}")
     total_bytes_read = 0
     read_chunk_size_bytes = read_chunk_size_kb * 1024
     file_name = os.path.basename(file_path)
@@ -277,71 +909,87 @@ def check_file_integrity(file_path, read_chunk_size_kb=1024):
     try:
         file_size = os.path.getsize(file_path)
         if file_size == 0: # Handle zero-byte files separately
-            print(f"  Integrity check PASSED for: {file_path} (Zero-byte file)")
+            report("detail", f"  Integrity check PASSED for: {file_path} (Zero-byte file)")
             return (True, "File is zero bytes and considered intact.")
     except FileNotFoundError:
-        print(f"  Error: File not found during size check: {file_path}")
+        report_message("error", f"File not found during size check: {file_path}", path=file_path)
         return (False, "File not found")
     except OSError as e:
-        print(f"  Error: Could not get size for {file_path}: {e}")
+        report_message("error", f"Could not get size for {file_path}: {e}", path=file_path)
         return (False, f"Error getting file size: {e}")
 
     f = None  # Initialize f to None
     try:
-        f = open(file_path, 'rb')
-        last_progress_print_time = time.time()
-        
+        started = time.monotonic()
+        f = backend.open_file(file_path, cold=cold)
+        if cold:
+            io_stats["read_mode"] = f.read_mode
+
         while True:
             try:
                 chunk = f.read(read_chunk_size_bytes)
             except (IOError, OSError) as e:
                 error_msg = f"Read error in {file_path} at offset ~{get_human_readable_size(total_bytes_read)}: {e}"
-                print(f"  Error: {error_msg}")
+                report_message("error", error_msg, path=file_path, offset=total_bytes_read)
                 if f: f.close()
                 return (False, f"Read error: {e}")
 
             if not chunk:
                 break # End of file
-            
+
+            if pattern is not None:
+                mismatched_ranges = io_stats["mismatched_ranges"]
+                for start, end in pattern.find_mismatches(chunk, file_index, total_bytes_read):
+                    if mismatched_ranges and mismatched_ranges[-1][1] == start:
+                        mismatched_ranges[-1] = (mismatched_ranges[-1][0], end)
+                    else:
+                        mismatched_ranges.append((start, end))
             total_bytes_read += len(chunk)
+            io_stats["bytes_read"] = total_bytes_read
 
-            current_time = time.time()
-            # Print progress every 2 seconds or if fully read
-            if current_time - last_progress_print_time >= 2 or total_bytes_read == file_size:
-                progress_percent = (total_bytes_read / file_size) * 100 if file_size > 0 else 100
-                read_hr = get_human_readable_size(total_bytes_read)
-                total_hr = get_human_readable_size(file_size)
-                # Use \r for progress, but ensure final messages are on new lines
-                sys.stdout.write(f"\r  Progress: Checked {read_hr} / {total_hr} ({progress_percent:.2f}%) for {file_name}...")
-                sys.stdout.flush()
-                last_progress_print_time = current_time
-        
-        sys.stdout.write("\r" + " " * 80 + "\r") # Clear progress line
-        sys.stdout.flush()
+            # The reporter rate-limits progress; the final update always gets through.
+            progress_percent = (total_bytes_read / file_size) * 100 if file_size > 0 else 100
+            read_hr = get_human_readable_size(total_bytes_read)
+            total_hr = get_human_readable_size(file_size)
+            # Use \r for progress, but ensure final messages are on new lines
+            report("progress", f"\r  Progress: Checked {read_hr} / {total_hr} ({progress_percent:.2f}%) for {file_name}...", end="",
+                   final=total_bytes_read == file_size, operation="check", path=file_path,
+                   bytes_done=total_bytes_read, bytes_total=file_size)
+
+        report("detail", "\r" + " " * 80 + "\r", end="") # Clear progress line
+        mismatched_ranges = io_stats["mismatched_ranges"]
+        if mismatched_ranges:
+            mismatched_bytes = sum(end - start for start, end in mismatched_ranges)
+            error_msg = (f"{MISMATCH_MESSAGE_PREFIX}: {get_human_readable_size(mismatched_bytes)} in {len(mismatched_ranges)} "
+                         f"range(s) read back differently than written, first at offset {mismatched_ranges[0][0]}")
+            report_message("error", f"{error_msg} in {file_path}.", path=file_path, offset=mismatched_ranges[0][0])
+            if f: f.close()
+            return (False, error_msg)
         if total_bytes_read == file_size:
-            print(f"  Integrity check PASSED for: {file_path}")
+            seconds = time.monotonic() - started
+            mb_s = total_bytes_read / (1024 * 1024) / seconds if seconds > 0 else 0.0
+            report("detail", f"  Integrity check PASSED for: {file_path} ({get_human_readable_size(total_bytes_read)} "
+                             f"read at {mb_s:.2f} MB/s, {io_stats['read_mode']})")
             if f: f.close()
             return (True, "File read successfully")
         else:
             # This case should ideally not be reached if EOF handling is correct
             # but is a safeguard.
             warn_msg = f"Unexpected EOF or read mismatch for {file_path}. Read {total_bytes_read}, expected {file_size}."
-            print(f"  Warning: {warn_msg}")
+            report_message("warning", warn_msg, path=file_path)
             if f: f.close()
             return (False, warn_msg)
 
     except FileNotFoundError:
         # This specific check might be redundant if os.path.getsize already caught it, but good for safety.
-        sys.stdout.write("\r" + " " * 80 + "\r") # Clear progress line
-        sys.stdout.flush()
-        print(f"  Error: File not found when trying to open: {file_path}")
+        report("detail", "\r" + " " * 80 + "\r", end="") # Clear progress line
+        report_message("error", f"File not found when trying to open: {file_path}", path=file_path)
         if f: f.close() # Should be None here, but defensive
         return (False, "File not found")
     except Exception as e: # Catch any other unexpected errors during open or loop setup
-        sys.stdout.write("\r" + " " * 80 + "\r") # Clear progress line
-        sys.stdout.flush()
+        report("detail", "\r" + " " * 80 + "\r", end="") # Clear progress line
         error_msg = f"An unexpected error occurred checking {file_path}: {type(e).__name__} - {e}"
-        print(f"  Error: {error_msg}")
+        report_message("error", error_msg, path=file_path)
         if f: f.close()
         return (False, error_msg)
     finally:
@@ -360,39 +1008,11 @@ def get_human_readable_size(size_bytes):
         i += 1
     return f"{size_bytes:.2f}{size_name[i]}"
 
-def list_disk_partitions_and_devices():
-    """
-    Lists detailed partition information and attempts to identify potential raw physical device names
-    that can be used with --smart or --scan.
-    """
-    print("--- Available Disk Partitions and Mountpoints ---")
-    try:
-        partitions = psutil.disk_partitions(all=False) 
-        if not partitions:
-            print("  Info: No disk partitions found or all are filtered (e.g., optical drives).")
-        else:
-            for partition in partitions:
-                print(f"  Device: {partition.device}")
-                print(f"    Mountpoint: {partition.mountpoint}")
-                print(f"    File system type: {partition.fstype}")
-                try:
-                    usage = psutil.disk_usage(partition.mountpoint)
-                    print(f"    Total Size: {get_human_readable_size(usage.total)}")
-                    print(f"    Used: {get_human_readable_size(usage.used)}")
-                    print(f"    Free: {get_human_readable_size(usage.free)}")
-                    print(f"    Percentage Used: {usage.percent}%")
-                except PermissionError:
-                    print("    Usage: Permission denied to access disk usage information.")
-                except FileNotFoundError:
-                    print(f"    Usage: Mountpoint '{partition.mountpoint}' not found or not accessible.")
-                except Exception as e:
-                    print(f"    Usage: Could not retrieve usage info for {partition.mountpoint}. Error: {e}")
-                print("-" * 20)
-    except Exception as e:
-        print(f"  Error: Could not retrieve disk partition list. {type(e).__name__}: {e}")
-
+def identify_raw_devices():
+    """Identifies raw physical devices that can be used with --smart or --scan.
 
-    print("\n--- Potential Raw Physical Devices for --scan or --smart ---")
+    Returns a sorted list of device paths (e.g. /dev/sda, \\\\.\\PhysicalDrive0).
+    """
     raw_devices_identified = set() # Use a different variable name to avoid confusion
     if os.name == 'posix':
         try:
@@ -408,7 +1028,6 @@ def list_disk_partitions_and_devices():
                     raw_devices_identified.add(device_name)
             
             valid_raw_devices = []
-            import stat
             for dev_path in sorted(list(raw_devices_identified)):
                 try:
                     if stat.S_ISBLK(os.stat(dev_path).st_mode):
@@ -445,12 +1064,96 @@ def list_disk_partitions_and_devices():
             print("  Error: WMIC command timed out. Cannot list physical drives automatically on Windows.")
         except Exception as e:
             print(f"  Error: Failed to identify raw devices on Windows using WMIC. {type(e).__name__}: {e}")
+    return sorted(raw_devices_identified)
+
+def identify_virtual_devices():
+    """Identifies device-mapper volumes (LVM, dm-crypt, thin) and attached loop devices.
+
+    These are scanned like any other device; a loop device backed by a sparse
+    image is scanned only where the image has data. Returns a sorted list of
+    (device_path, description) tuples. Linux only; empty elsewhere.
+    """
+    sys_block = "/sys/class/block"
+    devices = []
+    try:
+        names = os.listdir(sys_block)
+    except OSError:
+        return devices
+    for name in names:
+        if name.startswith("dm-"):
+            try:
+                with open(os.path.join(sys_block, name, "dm", "name")) as f:
+                    dm_name = f.read().strip()
+                slaves = sorted(os.listdir(os.path.join(sys_block, name, "slaves")))
+            except OSError:
+                continue
+            device_path = f"/dev/mapper/{dm_name}" if os.path.exists(f"/dev/mapper/{dm_name}") else f"/dev/{name}"
+            description = f"device-mapper volume on {', '.join(f'/dev/{slave}' for slave in slaves) or 'no devices'}"
+        elif name.startswith("loop"):
+            loop = get_loop_backing_file(f"/dev/{name}")
+            if not loop:
+                continue # Not attached
+            device_path = f"/dev/{name}"
+            description = f"loop device backed by {loop[0]}{f' at offset {loop[1]}' if loop[1] else ''}"
+        else:
+            continue
+        try:
+            with open(os.path.join(sys_block, name, "size")) as f:
+                description += f", {get_human_readable_size(int(f.read()) * 512)}"
+        except (OSError, ValueError):
+            pass
+        devices.append((device_path, description))
+    return sorted(devices)
+
+
+def list_disk_partitions_and_devices():
+    """
+    Lists detailed partition information and attempts to identify potential raw physical device names
+    that can be used with --smart or --scan.
+    """
+    print("--- Available Disk Partitions and Mountpoints ---")
+    try:
+        partitions = psutil.disk_partitions(all=False) 
+        if not partitions:
+            print("  Info: No disk partitions found or all are filtered (e.g., optical drives).")
+        else:
+            for partition in partitions:
+                print(f"  Device: {partition.device}")
+                print(f"    Mountpoint: {partition.mountpoint}")
+                print(f"    File system type: {partition.fstype}")
+                try:
+                    usage = psutil.disk_usage(partition.mountpoint)
+                    print(f"    Total Size: {get_human_readable_size(usage.total)}")
+                    print(f"    Used: {get_human_readable_size(usage.used)}")
+                    print(f"    Free: {get_human_readable_size(usage.free)}")
+                    print(f"    Percentage Used: {usage.percent}%")
+                except PermissionError:
+                    print("    Usage: Permission denied to access disk usage information.")
+                except FileNotFoundError:
+                    print(f"    Usage: Mountpoint '{partition.mountpoint}' not found or not accessible.")
+                except Exception as e:
+                    print(f"    Usage: Could not retrieve usage info for {partition.mountpoint}. Error: {e}")
+                print("-" * 20)
+    except Exception as e:
+        print(f"  Error: Could not retrieve disk partition list. {type(e).__name__}: {e}")
+
+
+    print("\n--- Potential Raw Physical Devices for --scan or --smart ---")
+    raw_devices_identified = identify_raw_devices()
 
     if raw_devices_identified:
         for dev in sorted(list(raw_devices_identified)): print(f"  - {dev}")
     else:
         print("  Info: No raw physical devices automatically identified. Specify the device path manually.")
         if os.name == 'posix': print("    Common Linux examples: /dev/sda, /dev/sdb, /dev/nvme0n1.")
+
+    if os.name == 'posix':
+        print("\n--- Volumes and Loop Devices for --scan ---")
+        virtual_devices = identify_virtual_devices()
+        for dev, description in virtual_devices: print(f"  - {dev} ({description})")
+        if not virtual_devices:
+            print("  Info: No device-mapper volumes or attached loop devices found.")
+        print("  Info: Image files can also be scanned directly; holes in sparse images are skipped.")
     print("\nNote: For --scan or --smart, use the raw physical device path (e.g., /dev/sda on Linux).")
 
 
@@ -538,121 +1241,2614 @@ def get_smart_info(device_path):
         print(f"  Info: Failed to retrieve S.M.A.R.T. data for {device_path} after all attempts.")
 
 
-def scan_disk(device_path, block_size_kb=64, scan_limit_gb=None):
-    print(f"\n--- Disk Scan for {device_path} ---")
-    if os.name != 'nt' and os.geteuid() != 0:
-        print("  Error: Disk scanning requires root/administrator privileges. Please run the script using 'sudo'.")
-        return
-
-    block_size_bytes = block_size_kb * 1024
-    fd = None
-    bytes_read_total, errors_found = 0, 0 # Initialize here for summary if open fails
-    error_locations = []
-    total_bytes_to_scan_final = 0 # Initialize for summary
+def get_logical_sector_size(fd):
+    """Returns the logical sector size for an open device or file descriptor.
 
+    Block devices are queried with the BLKSSZGET ioctl. For regular files the
+    filesystem's preferred I/O size is used, which is a safe O_DIRECT alignment.
+    Falls back to DEFAULT_LOGICAL_SECTOR_SIZE when nothing better is known.
+    """
     try:
-        print(f"  Info: Opening device: {device_path} (Block Size: {block_size_kb}KB, Limit: {scan_limit_gb or 'Full Disk'}GB)")
-        open_flags = os.O_RDONLY
-        if hasattr(os, 'O_SYNC'): open_flags |= os.O_SYNC
-        fd = os.open(device_path, open_flags)
-        
-        os.lseek(fd, 0, os.SEEK_SET)
-        disk_size_bytes = os.lseek(fd, 0, os.SEEK_END)
-        os.lseek(fd, 0, os.SEEK_SET)
-        print(f"  Info: Device Size: {get_human_readable_size(disk_size_bytes)}")
+        st = os.fstat(fd)
+        if stat.S_ISBLK(st.st_mode) and fcntl is not None:
+            raw = fcntl.ioctl(fd, BLKSSZGET, struct.pack('I', 0))
+            sector_size = struct.unpack('I', raw)[0]
+            if sector_size > 0:
+                return sector_size
+        elif stat.S_ISREG(st.st_mode) and getattr(st, 'st_blksize', 0) > 0:
+            return max(st.st_blksize, DEFAULT_LOGICAL_SECTOR_SIZE)
+    except (OSError, ValueError):
+        pass
+    return DEFAULT_LOGICAL_SECTOR_SIZE
 
-        total_bytes_to_scan_final = disk_size_bytes
-        if scan_limit_gb is not None and scan_limit_gb > 0:
-            limit_bytes = int(scan_limit_gb * (1024**3))
-            if limit_bytes == 0 and scan_limit_gb > 0: limit_bytes = block_size_bytes
-            total_bytes_to_scan_final = min(disk_size_bytes, limit_bytes)
-            print(f"  Info: Effective Scan Limit: {get_human_readable_size(total_bytes_to_scan_final)}")
-        else:
-            print(f"  Info: Scanning up to: {get_human_readable_size(total_bytes_to_scan_final)}")
-        if total_bytes_to_scan_final == 0 :
-            print("  Info: Nothing to scan (device size or scan limit is zero).")
-            return
+def align_down(value, alignment):
+    """Rounds value down to a multiple of alignment."""
+    return (value // alignment) * alignment
+
+def align_up(value, alignment):
+    """Rounds value up to a multiple of alignment."""
+    return -(-value // alignment) * alignment
 
+def allocate_aligned_buffer(size_bytes):
+    """Allocates a zero-filled, page-aligned buffer suitable for O_DIRECT I/O.
 
-        start_time = last_progress_print_time = time.time()
-        print("  Info: Starting scan...")
+    Anonymous mmap regions always start on a page boundary, which satisfies the
+    alignment requirements of every logical sector size in practice.
+    """
+    return mmap.mmap(-1, max(size_bytes, mmap.PAGESIZE))
+
+def open_scan_device(device_path, direct_io=False):
+    """Opens a device or file read-only for scanning.
 
-        while bytes_read_total < total_bytes_to_scan_final:
-            bytes_to_read_this_iteration = min(block_size_bytes, total_bytes_to_scan_final - bytes_read_total)
+    Returns (fd, direct_io_active). When direct I/O is requested but the target
+    rejects O_DIRECT (e.g. tmpfs, some network filesystems), the device is
+    reopened through the page cache instead of failing the scan.
+    """
+    open_flags = os.O_RDONLY
+    if hasattr(os, 'O_SYNC'): open_flags |= os.O_SYNC
+    if direct_io:
+        if not hasattr(os, 'O_DIRECT') or not hasattr(os, 'preadv'):
+            print("  Warning: O_DIRECT is not supported on this platform. Falling back to buffered reads.")
+        else:
             try:
-                block_data = os.read(fd, bytes_to_read_this_iteration)
-                if not block_data:
-                    if bytes_read_total < total_bytes_to_scan_final:
-                        print(f"\n  Warning: Unexpected EOF at {get_human_readable_size(bytes_read_total)}. Expected {get_human_readable_size(total_bytes_to_scan_final)}.")
-                    break
-                bytes_read_total += len(block_data)
-            except (IOError, OSError) as e:
-                errors_found += 1
-                current_offset_of_error = bytes_read_total 
-                error_locations.append(current_offset_of_error)
-                print(f"\n  Error: Read error at offset ~{get_human_readable_size(current_offset_of_error)}: {e}")
-                try:
-                    next_block_start_offset = current_offset_of_error + bytes_to_read_this_iteration
-                    os.lseek(fd, next_block_start_offset, os.SEEK_SET)
-                    print(f"  Info: Attempting to continue scan from offset {get_human_readable_size(next_block_start_offset)}")
-                    bytes_read_total = next_block_start_offset 
-                except (IOError, OSError) as seek_e:
-                    print(f"  Critical: Seek failed after read error ({seek_e}). Aborting scan for this device.")
-                    break
-            
-            current_time = time.time()
-            if current_time - last_progress_print_time >= 1 or bytes_read_total == total_bytes_to_scan_final :
-                progress_percent = (bytes_read_total / total_bytes_to_scan_final) * 100 if total_bytes_to_scan_final > 0 else 0
-                scanned_hr, total_scan_hr = get_human_readable_size(bytes_read_total), get_human_readable_size(total_bytes_to_scan_final)
-                elapsed_time = current_time - start_time
-                speed_mb_s = (bytes_read_total / (1024**2)) / elapsed_time if elapsed_time > 0 else 0
-                print(f"\r  Progress: {progress_percent:.2f}% ({scanned_hr}/{total_scan_hr}) | Speed: {speed_mb_s:.2f} MB/s | Errors: {errors_found}", end="")
-                last_progress_print_time = current_time
-        
-        print("\n  Info: Scan finished.")
-    except PermissionError: 
-        print(f"  Error: Permission denied when opening or accessing {device_path}. Ensure you are running with sudo/administrator rights.")
-        return 
-    except FileNotFoundError:
-        print(f"  Error: Device {device_path} not found.")
-        return
-    except Exception as e:
-        print(f"\n  Error: An unexpected issue occurred during scan of {device_path}: {type(e).__name__} - {e}")
-    finally:
-        if fd is not None:
-            try: os.close(fd); print(f"  Info: Device {device_path} closed.")
-            except OSError as e: print(f"  Error: Could not close device {device_path}: {e}")
-
-    print("\n--- Scan Summary ---")
-    print(f"  Device Scanned: {device_path}")
-    print(f"  Total Data Processed: {get_human_readable_size(bytes_read_total)} of {get_human_readable_size(total_bytes_to_scan_final)} planned")
-    print(f"  Number of Read Errors Encountered: {errors_found}")
-    if error_locations:
-        print(f"  Approximate Error Locations (offsets from start of scan): {[get_human_readable_size(loc) for loc in error_locations]}")
-    else:
-        print("  Info: No read errors detected during this scan segment.")
-    print("-" * 20)
+                return os.open(device_path, open_flags | os.O_DIRECT), True
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                print(f"  Warning: {device_path} does not support O_DIRECT ({e}). Falling back to buffered reads.")
+    return os.open(device_path, open_flags), False
 
+def get_loop_backing_file(device_path):
+    """Returns (backing_file, offset, size_limit) for a Linux loop device, or None.
 
-def main(argv=None):
-    """Main function to parse arguments and dispatch actions."""
-    parser = argparse.ArgumentParser(
-        description="DeadSectorKiller: A utility to list disks, check S.M.A.R.T. status, and scan for bad sectors.",
-        formatter_class=argparse.RawTextHelpFormatter # Allows for better formatting of help text
-    )
-    parser.add_argument('--version', action='version', version='%(prog)s 0.1.0') # Example version
+    offset is where the device starts within the backing file; size_limit is 0
+    when the device extends to the end of the file.
+    """
+    name = os.path.basename(os.path.realpath(device_path))
+    loop_dir = f"/sys/class/block/{name}/loop"
+    try:
+        with open(os.path.join(loop_dir, "backing_file")) as f:
+            backing_file = f.read().strip()
+        with open(os.path.join(loop_dir, "offset")) as f:
+            offset = int(f.read())
+        with open(os.path.join(loop_dir, "sizelimit")) as f:
+            size_limit = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return backing_file, offset, size_limit
 
-    action_group = parser.add_mutually_exclusive_group()
-    action_group.add_argument("--list-disks", "-l", action="store_true",
-                              help="List available disk partitions and potential raw physical devices.\nProvides an overview of storage devices and their mountpoints.")
+def get_allocated_ranges(fd, end, alignment, base_offset=0):
+    """Returns the allocated (data) ranges of [0, end) of a sparse file, skipping holes.
+
+    Walks the file with lseek(SEEK_DATA)/lseek(SEEK_HOLE); the ranges are
+    widened to `alignment` and merged. base_offset shifts the query into the
+    file (for loop devices that start inside their backing file); the returned
+    ranges are relative to it. Returns None when the file system or device
+    cannot report holes (block devices, platforms without SEEK_DATA).
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        return None
+    allocated = BadRegionMap()
+    position = 0
+    while position < end:
+        try:
+            data_start = os.lseek(fd, base_offset + position, os.SEEK_DATA) - base_offset
+        except OSError as e:
+            if e.errno == errno.ENXIO: # No data after this offset
+                break
+            return None
+        if data_start >= end:
+            break
+        data_end = min(os.lseek(fd, base_offset + data_start, os.SEEK_HOLE) - base_offset, end)
+        start = align_down(data_start, alignment)
+        allocated.add(start, min(align_up(data_end, alignment), end) - start)
+        position = data_end
+    return allocated.ranges()
+
+def find_allocated_scan_ranges(fd, device_path, scan_end, alignment):
+    """Returns the allocated ranges of a scan target within [0, scan_end), or None if unknown.
+
+    Regular (sparse) image files are queried directly; for a loop device the
+    holes of its backing file are used, so a thin image attached with losetup is
+    scanned as fast as the image itself. Other block devices report None.
+    """
+    if stat.S_ISREG(os.fstat(fd).st_mode):
+        return get_allocated_ranges(fd, scan_end, alignment)
+    loop = get_loop_backing_file(device_path)
+    if not loop:
+        return None
+    backing_file, offset, _ = loop
+    try:
+        backing_fd = os.open(backing_file, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return get_allocated_ranges(backing_fd, scan_end, alignment, base_offset=offset)
+    finally:
+        os.close(backing_fd)
+
+
+BAD_REGION_FILE_FORMAT = "dsk-bad-regions"
+
+class BadRegionMap:
+    """A compact set of bad byte ranges, coalesced as they are added.
+
+    Ranges are half-open [start, end) and kept sorted and disjoint in two
+    parallel array('Q') columns (16 bytes per range), so millions of failing
+    blocks cost a few megabytes instead of one Python int per offset. Ranges
+    closer than merge_gap bytes are merged into one. Appending in ascending
+    order (the normal scan order) is O(1); other inserts use binary search.
+    """
+
+    def __init__(self, ranges=(), merge_gap=0):
+        self.merge_gap = merge_gap
+        self._starts = array.array('Q')
+        self._ends = array.array('Q')
+        for start, end in ranges:
+            self.add(start, end - start)
+
+    def add(self, offset, length):
+        """Marks [offset, offset + length) as bad, merging with overlapping or nearby ranges."""
+        if length <= 0:
+            return
+        start, end = offset, offset + length
+        starts, ends = self._starts, self._ends
+        if not starts or start > ends[-1] + self.merge_gap:
+            starts.append(start) # Fast path: ascending scan order
+            ends.append(end)
+            return
+        # First range whose end reaches start, last range whose start reaches end (within merge_gap).
+        first = bisect.bisect_left(ends, max(start - self.merge_gap, 0))
+        last = bisect.bisect_right(starts, end + self.merge_gap)
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+            del starts[first:last]
+            del ends[first:last]
+        starts.insert(first, start)
+        ends.insert(first, end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return zip(self._starts, self._ends)
+
+    def __eq__(self, other):
+        return isinstance(other, BadRegionMap) and self.ranges() == other.ranges()
+
+    def __repr__(self):
+        return f"BadRegionMap({self.ranges()!r})"
+
+    def ranges(self):
+        """Returns the ranges as a list of (start, end) tuples."""
+        return list(self)
+
+    def total_bytes(self):
+        """Returns the number of bytes covered by all ranges."""
+        return sum(self._ends) - sum(self._starts)
+
+    def contains(self, offset):
+        """Returns True if the byte at offset lies in a bad range."""
+        index = bisect.bisect_right(self._starts, offset) - 1
+        return index >= 0 and offset < self._ends[index]
+
+    def query(self, offset, length):
+        """Returns the (start, end) ranges that overlap [offset, offset + length)."""
+        first = bisect.bisect_right(self._ends, offset)
+        last = bisect.bisect_left(self._starts, offset + length)
+        return list(zip(self._starts[first:last], self._ends[first:last]))
+
+    def union(self, other):
+        """Returns a new map covering the ranges of both maps."""
+        merged = BadRegionMap(merge_gap=self.merge_gap)
+        for start, end in heapq.merge(self, other):
+            merged.add(start, end - start)
+        return merged
+
+    def intersection(self, other):
+        """Returns a new map covering only bytes that are bad in both maps."""
+        result = BadRegionMap()
+        a, b = self.ranges(), other.ranges()
+        i = j = 0
+        while i < len(a) and j < len(b):
+            start, end = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+            if start < end:
+                result.add(start, end - start)
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return result
+
+    def save(self, file_path, **metadata):
+        """Writes the map as JSON lines: one header object, then one {"start", "end"} object per range."""
+        with open(file_path, 'w') as f:
+            header = {"format": BAD_REGION_FILE_FORMAT, "version": 1, "ranges": len(self),
+                      "bad_bytes": self.total_bytes(), **metadata}
+            f.write(json.dumps(header) + "\n")
+            for start, end in self:
+                f.write(f'{{"start": {start}, "end": {end}}}\n')
+
+    @classmethod
+    def load(cls, file_path):
+        """Reads a map written by save(). Returns (map, header_dict)."""
+        regions = cls()
+        header = {}
+        with open(file_path, 'r') as f:
+            for line_number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if line_number == 0 and record.get("format") == BAD_REGION_FILE_FORMAT:
+                    header = record
+                    continue
+                regions.add(record["start"], record["end"] - record["start"])
+        return regions, header
+
+    def format_summary(self, limit=10):
+        """Returns a short human-readable list of the first `limit` ranges."""
+        shown = [f"{get_human_readable_size(start)}-{get_human_readable_size(end)} ({get_human_readable_size(end - start)})"
+                 for start, end in itertools.islice(self, limit)]
+        if len(self) > limit:
+            shown.append(f"... and {len(self) - limit} more")
+        return shown
+
+
+class LatencyHistogram:
+    """Fixed-memory histogram of read latencies with log-scale buckets.
+
+    Bucket i covers latencies below 2**((i + 1) / SUBBUCKETS) microseconds, i.e.
+    four buckets per doubling (about 19% relative resolution) from 1us up to
+    ~2**32us (over an hour), in a single array of counters. The exact maximum
+    is tracked separately.
+    """
+    SUBBUCKETS = 4
+    BUCKET_COUNT = 32 * SUBBUCKETS
+
+    def __init__(self, counts=None, max_seconds=0.0):
+        self.counts = array.array('Q', counts or [0] * self.BUCKET_COUNT)
+        self.max_seconds = max_seconds
+
+    def record(self, seconds):
+        """Adds one latency sample (in seconds)."""
+        microseconds = seconds * 1e6
+        index = int(math.log2(microseconds) * self.SUBBUCKETS) if microseconds > 1 else 0
+        self.counts[min(index, self.BUCKET_COUNT - 1)] += 1
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def merge(self, other):
+        """Adds the samples of another histogram into this one."""
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, percent):
+        """Returns the upper bound (in seconds) of the bucket holding the given percentile."""
+        total = self.count()
+        if total == 0:
+            return 0.0
+        threshold = total * percent / 100.0
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= threshold:
+                return min(2 ** ((index + 1) / self.SUBBUCKETS) / 1e6, self.max_seconds)
+        return self.max_seconds
+
+
+FINGERPRINT_FILE_FORMAT = "dsk-fingerprints"
+FINGERPRINT_ALGORITHM = "blake2b-128"
+DEFAULT_FINGERPRINT_REGION_MB = 64
+
+class RegionFingerprints:
+    """BLAKE2b content fingerprints of fixed-size regions of a device.
+
+    Maps each region start to (length, hex digest), or to (length, None) when
+    part of the region could not be read. Only regions read completely and in
+    order from their first byte are fingerprinted; regions cut short by a skip,
+    a resume or an interruption are left out and are not compared. The last
+    region may be shorter than region_size.
+    """
+
+    def __init__(self, region_size, scan_end=None):
+        self.region_size = region_size
+        self.scan_end = scan_end
+        self.regions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.regions)
+
+    def record(self, region_start, length, digest):
+        """Stores a region's fingerprint; a region once marked unreadable stays unreadable."""
+        with self._lock:
+            if digest is not None and self.regions.get(region_start, (0, ""))[1] is None:
+                return
+            self.regions[region_start] = (length, digest)
+
+    def mark_unreadable(self, offset, length):
+        """Marks every region overlapping [offset, offset + length) as unreadable."""
+        first = offset - offset % self.region_size
+        for region_start in range(first, offset + length, self.region_size):
+            region_length = self.region_size
+            if self.scan_end is not None:
+                region_length = min(region_length, self.scan_end - region_start)
+            self.record(region_start, region_length, None)
+
+    def new_segment_hasher(self):
+        """Returns a _SegmentHasher feeding this map; one per scan segment."""
+        return _SegmentHasher(self)
+
+    def save(self, file_path, **metadata):
+        """Writes the fingerprints as JSON lines: one header object, then one {"offset", "length", "digest"} object per region."""
+        with open(file_path, 'w') as f:
+            header = {"format": FINGERPRINT_FILE_FORMAT, "version": 1, "algorithm": FINGERPRINT_ALGORITHM,
+                      "region_size": self.region_size, "scan_end": self.scan_end, "regions": len(self), **metadata}
+            f.write(json.dumps(header) + "\n")
+            for region_start in sorted(self.regions):
+                length, digest = self.regions[region_start]
+                f.write(json.dumps({"offset": region_start, "length": length, "digest": digest}) + "\n")
+
+    @classmethod
+    def load(cls, file_path):
+        """Reads fingerprints written by save(). Returns (fingerprints, header_dict).
+
+        Raises ValueError if the file is not a fingerprint file of a supported algorithm.
+        """
+        with open(file_path, 'r') as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("format") != FINGERPRINT_FILE_FORMAT or header.get("algorithm") != FINGERPRINT_ALGORITHM:
+                raise ValueError(f"'{file_path}' is not a {FINGERPRINT_ALGORITHM} fingerprint file")
+            fingerprints = cls(header["region_size"], header.get("scan_end"))
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    fingerprints.regions[record["offset"]] = (record["length"], record["digest"])
+        return fingerprints, header
+
+    def compare(self, previous):
+        """Compares this scan's fingerprints with an earlier scan of the same device.
+
+        Returns a dict with BadRegionMaps of regions whose content changed and of
+        regions readable before but unreadable now, plus counts of regions
+        compared and of regions present in only one scan or with a different length.
+        """
+        changed, newly_unreadable = BadRegionMap(), BadRegionMap()
+        compared = not_comparable = 0
+        for region_start in sorted(set(self.regions) | set(previous.regions)):
+            current, before = self.regions.get(region_start), previous.regions.get(region_start)
+            if current is None or before is None or current[0] != before[0]:
+                not_comparable += 1
+                continue
+            compared += 1
+            if current[1] is None and before[1] is not None:
+                newly_unreadable.add(region_start, current[0])
+            elif current[1] is not None and before[1] is not None and current[1] != before[1]:
+                changed.add(region_start, current[0])
+        return {"changed": changed, "newly_unreadable": newly_unreadable,
+                "compared": compared, "not_comparable": not_comparable}
+
+class _SegmentHasher:
+    """Hashes the blocks of one scan segment, which are read in ascending order.
+
+    hashlib releases the GIL while hashing large buffers, so with parallel jobs
+    the hashing of one worker overlaps with the reads of the others.
+    """
+
+    def __init__(self, fingerprints):
+        self.fingerprints = fingerprints
+        self.region_start = None
+        self.next_offset = None
+        self.hasher = None
+
+    def update(self, offset, data):
+        """Feeds the bytes read at offset; completed regions are recorded."""
+        region_size = self.fingerprints.region_size
+        position = 0
+        while position < len(data):
+            current = offset + position
+            region_start = current - current % region_size
+            if self.hasher is None or current != self.next_offset or region_start != self.region_start:
+                # Only a region read from its first byte can be fingerprinted.
+                self.hasher = hashlib.blake2b(digest_size=16) if current == region_start else None
+                self.region_start = region_start
+            piece = min(len(data) - position, region_start + region_size - current)
+            if self.hasher is not None:
+                self.hasher.update(data[position:position + piece])
+            position += piece
+            self.next_offset = current + piece
+            if self.next_offset == region_start + region_size or self.next_offset == self.fingerprints.scan_end:
+                self._record()
+
+    def fail(self, offset, length):
+        """Marks the regions overlapping a failed or skipped read as unreadable."""
+        self.hasher = None
+        self.fingerprints.mark_unreadable(offset, length)
+
+    def end_of_data(self):
+        """Records the region in progress when the device ends before the planned scan end."""
+        self._record()
+
+    def _record(self):
+        if self.hasher is not None:
+            self.fingerprints.record(self.region_start, self.next_offset - self.region_start, self.hasher.hexdigest())
+        self.hasher = None
+
+def locate_bad_sectors(read_block, offset, length, sector_size):
+    """Bisects a failed block down to logical-sector granularity.
+
+    read_block(offset, length) must perform a positional read and raise OSError
+    on failure. Halves that read cleanly are not split further, so a block with
+    a single bad sector costs about 2*log2(length/sector_size) extra reads.
+    Returns (readable_bytes, bad_sector_offsets) with offsets in ascending order.
+    """
+    readable_bytes = 0
+    bad_sector_offsets = []
+    pending = [(offset, length)]
+    while pending:
+        chunk_offset, chunk_length = pending.pop()
+        try:
+            readable_bytes += read_block(chunk_offset, chunk_length)
+            continue
+        except (IOError, OSError):
+            pass
+        if chunk_length <= sector_size:
+            bad_sector_offsets.append(chunk_offset)
+            continue
+        half = max(align_down(chunk_length // 2, sector_size), sector_size)
+        # Push the upper half first so the lower half is examined first (ascending order).
+        pending.append((chunk_offset + half, chunk_length - half))
+        pending.append((chunk_offset, half))
+    return readable_bytes, bad_sector_offsets
+
+
+def make_block_reader(fd, direct_active, sector_size, block_size_bytes, return_data=False):
+    """Returns a positional read_block(offset, length) -> bytes_read function for fd.
+
+    Direct readers own a private aligned buffer, so each worker thread must get
+    its own reader. Buffered readers use os.pread where available, which does not
+    touch the shared file position and releases the GIL while blocked.
+
+    With return_data=True read_block returns the data read instead of its length;
+    a direct reader returns a memoryview of its buffer, valid until the next read.
+    """
+    if direct_active:
+        read_view = memoryview(allocate_aligned_buffer(block_size_bytes))
+
+        def read_block(offset, length):
+            # O_DIRECT needs sector-multiple lengths; a short final read past EOF is fine.
+            bytes_read = min(os.preadv(fd, [read_view[:align_up(length, sector_size)]], offset), length)
+            return read_view[:bytes_read] if return_data else bytes_read
+    elif hasattr(os, 'pread'):
+        def read_block(offset, length):
+            data = os.pread(fd, length, offset)
+            return data if return_data else len(data)
+    else:
+        def read_block(offset, length):
+            os.lseek(fd, offset, os.SEEK_SET)
+            data = os.read(fd, length)
+            return data if return_data else len(data)
+    return read_block
+
+class ColdFile:
+    """Sequential reader that fetches a file from the media instead of the page cache.
+
+    The file is opened with O_DIRECT and read into a reused page-aligned
+    buffer (read_mode "O_DIRECT"). If the file system rejects O_DIRECT, the
+    file's dirty pages are written out with fdatasync and its cached pages
+    dropped with POSIX_FADV_DONTNEED before reading ("cache dropped"). Where
+    neither is available the file is read normally ("page cache").
+
+    read() returns a memoryview into the reused buffer, valid until the next
+    call. With O_DIRECT, read sizes must be multiples of the logical sector size.
+    """
+
+    def __init__(self, file_path):
+        open_flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+        self.read_mode = "page cache"
+        self._fd = None
+        if hasattr(os, 'O_DIRECT'):
+            try:
+                self._fd = os.open(file_path, open_flags | os.O_DIRECT)
+                self.read_mode = "O_DIRECT"
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+        if self._fd is None:
+            self._fd = os.open(file_path, open_flags)
+            if hasattr(os, 'posix_fadvise'):
+                try:
+                    os.fdatasync(self._fd)
+                    os.posix_fadvise(self._fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                    self.read_mode = "cache dropped"
+                except OSError:
+                    pass
+        self._buffer = None
+
+    @property
+    def closed(self):
+        return self._fd is None
+
+    def read(self, size):
+        if self._buffer is None or len(self._buffer) < size:
+            self._buffer = allocate_aligned_buffer(align_up(size, mmap.PAGESIZE))
+        view = memoryview(self._buffer)[:size]
+        return view[:os.readv(self._fd, [view])]
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class FileDeviceBackend:
+    """How scan_disk and check_file_integrity reach the medium: plain OS reads.
+
+    scan_disk opens the device with open() and gets its positional block
+    readers from make_reader(); check_file_integrity reads files opened with
+    open_file(). Subclasses can change what those reads do (see
+    FaultInjectingBackend) without touching the scan loop.
+
+    skip_holes is scan_disk's default for reading only the allocated extents
+    of a sparse image file or loop device.
+    """
+
+    skip_holes = True
+
+    def open(self, device_path, direct_io=False):
+        """Returns (fd, direct_active) for device_path (see open_scan_device)."""
+        return open_scan_device(device_path, direct_io)
+
+    def make_reader(self, fd, direct_active, sector_size, block_size_bytes, return_data=False):
+        """Returns a read_block(offset, length) function (see make_block_reader)."""
+        return make_block_reader(fd, direct_active, sector_size, block_size_bytes, return_data)
+
+    def open_file(self, file_path, cold=False):
+        """Opens a file for a sequential integrity check; cold=True bypasses the page cache (see ColdFile)."""
+        return ColdFile(file_path) if cold else open(file_path, 'rb')
+
+class FaultInjectingBackend(FileDeviceBackend):
+    """A FileDeviceBackend that simulates a failing disk on top of a regular or sparse file.
+
+    Any read overlapping one of bad_ranges ((start, end) byte ranges) raises
+    EIO; a read overlapping slow_ranges ((start, end, seconds) tuples) is
+    delayed by that many seconds first; a read overlapping hang_ranges blocks
+    for hang_s seconds or until release() is called. All ranges are in device
+    (or file) byte offsets. Every read is counted in `reads` (a list of
+    (offset, length) tuples, guarded by a lock) so tests can check access patterns.
+
+    The backing file stands for a whole disk, so scans read its holes too
+    (skip_holes is False); pass skip_holes=True to scan_disk to skip them.
+    """
+
+    skip_holes = False
+
+    def __init__(self, bad_ranges=(), slow_ranges=(), hang_ranges=(), hang_s=3600):
+        self.bad_ranges = BadRegionMap(bad_ranges)
+        self.slow_ranges = sorted(slow_ranges)
+        self.hang_ranges = BadRegionMap(hang_ranges)
+        self.hang_s = hang_s
+        self.reads = []
+        self._released = threading.Event()
+        self._lock = threading.Lock()
+
+    def apply_faults(self, offset, length):
+        """Applies the configured faults to a read of [offset, offset + length)."""
+        with self._lock:
+            self.reads.append((offset, length))
+        for start, end, seconds in self.slow_ranges:
+            if start < offset + length and offset < end:
+                time.sleep(seconds)
+        if self.hang_ranges.query(offset, length):
+            self._released.wait(self.hang_s)
+        if self.bad_ranges.query(offset, length):
+            raise OSError(errno.EIO, f"Injected I/O error at offset {offset}")
+
+    def release(self):
+        """Lets reads blocked in a hang range continue."""
+        self._released.set()
+
+    def make_reader(self, fd, direct_active, sector_size, block_size_bytes, return_data=False):
+        read_block = super().make_reader(fd, direct_active, sector_size, block_size_bytes, return_data)
+
+        def faulty_read_block(offset, length):
+            self.apply_faults(offset, length)
+            return read_block(offset, length)
+        return faulty_read_block
+
+    def open_file(self, file_path, cold=False):
+        return _FaultInjectingFile(super().open_file(file_path, cold), self)
+
+class _FaultInjectingFile:
+    """Minimal sequential file wrapper applying a FaultInjectingBackend's faults to read()."""
+
+    def __init__(self, f, backend):
+        self._f = f
+        self._backend = backend
+        self._position = 0
+
+    @property
+    def closed(self):
+        return self._f.closed
+
+    @property
+    def read_mode(self):
+        return getattr(self._f, 'read_mode', "page cache")
+
+    def read(self, size):
+        self._backend.apply_faults(self._position, size)
+        data = self._f.read(size)
+        self._position += len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+class ReadTimeoutError(OSError):
+    """A read that did not complete within the watchdog deadline."""
+
+MAX_STALLED_READERS = 4
+
+class ReadWatchdog:
+    """Wraps a block reader so that reads stalled past a deadline are given up on.
+
+    Reads run on a helper thread; the caller waits at most timeout_s seconds and
+    then gets a ReadTimeoutError. Python cannot cancel a read blocked in the
+    kernel, so the stalled thread is abandoned (it exits once its read finally
+    returns) and a fresh thread with a fresh reader from make_reader() takes
+    over. At most MAX_STALLED_READERS stalled threads are left behind; beyond
+    that the watchdog waits for the oldest one to return before continuing.
+    Call close() when done to stop the helper thread.
+    """
+
+    def __init__(self, make_reader, timeout_s):
+        self.make_reader = make_reader
+        self.timeout_s = timeout_s
+        self.stalled_threads = []
+        self._start_worker()
+
+    def _start_worker(self):
+        requests = self._requests = queue.Queue()
+        read_block = self.make_reader() # Own buffer: a stalled thread may still write into its old one
+
+        def worker():
+            while True:
+                request = requests.get()
+                if request is None:
+                    return
+                offset, length, result, done = request
+                try:
+                    result.append((True, read_block(offset, length)))
+                except BaseException as e:
+                    result.append((False, e))
+                done.set()
+
+        self._thread = threading.Thread(target=worker, name="dsk-read-watchdog", daemon=True)
+        self._thread.start()
+
+    def __call__(self, offset, length):
+        result, done = [], threading.Event()
+        self._requests.put((offset, length, result, done))
+        if not done.wait(self.timeout_s):
+            self._requests.put(None) # The stalled thread exits after its read returns
+            self.stalled_threads = [thread for thread in self.stalled_threads if thread.is_alive()] + [self._thread]
+            if len(self.stalled_threads) > MAX_STALLED_READERS:
+                self.stalled_threads.pop(0).join()
+            self._start_worker()
+            raise ReadTimeoutError(errno.ETIMEDOUT, f"Read stalled for more than {self.timeout_s:g}s")
+        succeeded, value = result[0]
+        if succeeded:
+            return value
+        raise value
+
+    def close(self):
+        self._requests.put(None)
+
+class IOThrottle:
+    """Rate limiter for scan reads, with optional back-off under foreground I/O load.
+
+    max_bytes_per_s and max_iops are enforced as token buckets shared by all
+    worker threads. With adaptive=True the system-wide counters of disk_name
+    (psutil.disk_io_counters) are sampled about once a second; when other
+    processes are doing I/O and the device's average latency exceeds
+    target_latency_ms (or it is >90% busy), a per-read delay is doubled, up to
+    a full pause of max_delay_s per read, and it decays again once the
+    pressure is gone (AIMD-style).
+    """
+
+    def __init__(self, max_bytes_per_s=None, max_iops=None, adaptive=False, disk_name=None,
+                 target_latency_ms=50, min_foreground_iops=5, max_delay_s=2.0):
+        self.max_bytes_per_s = max_bytes_per_s
+        self.max_iops = max_iops
+        self.adaptive = adaptive and disk_name is not None
+        self.disk_name = disk_name
+        self.target_latency_ms = target_latency_ms
+        self.min_foreground_iops = min_foreground_iops
+        self.max_delay_s = max_delay_s
+        self.delay_s = 0.0
+        self.under_pressure = False
+        self._lock = threading.Lock()
+        self._next_byte_time = self._next_io_time = time.monotonic()
+        self._own_ios = 0
+        self._last_sample_time = time.monotonic()
+        self._last_counters = self._read_counters()
+
+    def _read_counters(self):
+        if not self.adaptive:
+            return None
+        try:
+            return psutil.disk_io_counters(perdisk=True).get(self.disk_name)
+        except Exception:
+            return None
+
+    def _update_pressure(self, now):
+        """Samples the device counters and adjusts the per-read delay. Called with the lock held."""
+        counters = self._read_counters()
+        previous, self._last_counters = self._last_counters, counters
+        elapsed_s, own_ios = now - self._last_sample_time, self._own_ios
+        self._last_sample_time, self._own_ios = now, 0
+        if counters is None or previous is None or elapsed_s <= 0:
+            return
+        total_ios = (counters.read_count - previous.read_count) + (counters.write_count - previous.write_count)
+        io_time_ms = (counters.read_time - previous.read_time) + (counters.write_time - previous.write_time)
+        foreground_iops = max(total_ios - own_ios, 0) / elapsed_s
+        average_latency_ms = io_time_ms / total_ios if total_ios else 0.0
+        busy_fraction = (getattr(counters, 'busy_time', 0) - getattr(previous, 'busy_time', 0)) / (elapsed_s * 1000)
+        self.under_pressure = foreground_iops >= self.min_foreground_iops and (
+            average_latency_ms > self.target_latency_ms or busy_fraction > 0.9)
+        if self.under_pressure:
+            self.delay_s = min(max(self.delay_s * 2, 0.001), self.max_delay_s)
+        else:
+            self.delay_s = self.delay_s / 2 if self.delay_s > 0.0005 else 0.0
+
+    def acquire(self, num_bytes):
+        """Blocks until a read of num_bytes is allowed by the configured limits."""
+        with self._lock:
+            now = time.monotonic()
+            if self.adaptive and now - self._last_sample_time >= 1.0:
+                self._update_pressure(now)
+            self._own_ios += 1
+            wait_until = now + self.delay_s
+            if self.max_bytes_per_s:
+                self._next_byte_time = max(self._next_byte_time, now) + num_bytes / self.max_bytes_per_s
+                wait_until = max(wait_until, self._next_byte_time - num_bytes / self.max_bytes_per_s)
+            if self.max_iops:
+                self._next_io_time = max(self._next_io_time, now) + 1.0 / self.max_iops
+                wait_until = max(wait_until, self._next_io_time - 1.0 / self.max_iops)
+        sleep_s = wait_until - time.monotonic()
+        if sleep_s > 0:
+            time.sleep(sleep_s)
+
+def lower_io_priority():
+    """Lowers this process's CPU and I/O priority so foreground work wins.
+
+    Uses the idle I/O scheduling class on Linux (best-effort lowest on other
+    platforms psutil supports) and the lowest CPU nice value. Returns a short
+    description of what was applied.
+    """
+    applied = []
+    try:
+        process = psutil.Process()
+        if hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+            process.ionice(psutil.IOPRIO_CLASS_IDLE)
+            applied.append("I/O class idle")
+        elif hasattr(psutil, 'IOPRIO_VERYLOW'):
+            process.ionice(psutil.IOPRIO_VERYLOW)
+            applied.append("I/O priority very low")
+    except (AttributeError, psutil.Error, OSError) as e:
+        print(f"  Warning: Could not lower I/O priority: {e}")
+    if hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, 19)
+            applied.append("CPU nice 19")
+        except OSError as e:
+            print(f"  Warning: Could not lower CPU priority: {e}")
+    return ", ".join(applied) or "none"
+
+
+DEFAULT_SLOW_THRESHOLD_MS = 200
+SLOWEST_BLOCKS_KEPT = 20
+
+def record_block_latency(stats, offset, length, latency_s):
+    """Records one block read latency; must be called with the stats lock held."""
+    stats["latency"].record(latency_s)
+    if latency_s >= stats["slow_threshold_s"]:
+        stats["slow_regions"].add(offset, length)
+        entry = (latency_s, offset)
+        if len(stats["slowest_blocks"]) < SLOWEST_BLOCKS_KEPT:
+            heapq.heappush(stats["slowest_blocks"], entry)
+        else:
+            heapq.heappushpop(stats["slowest_blocks"], entry)
+
+def new_scan_stats():
+    """Returns an empty statistics dict shared by the workers of one scan."""
+    return {
+        "bytes_done": 0,
+        "errors_found": 0,
+        "bad_regions": BadRegionMap(),
+        "bad_sector_count": 0,
+        "latency": LatencyHistogram(),
+        "slow_regions": BadRegionMap(),
+        "slowest_blocks": [], # min-heap of (latency_s, offset), bounded to SLOWEST_BLOCKS_KEPT
+        "slow_threshold_s": DEFAULT_SLOW_THRESHOLD_MS / 1000.0,
+        "eof_offset": None,
+        "segments": {}, # segment start -> [next offset to read, segment end]
+        "stop_requested": False,
+        "throttle": None, # Optional IOThrottle consulted before every read
+        "retries": 0, # Extra attempts for a failing block before it is recorded as bad
+        "recovered_by_retry": 0,
+        "max_skip_bytes": 0, # Skip-ahead cap after consecutive errors; 0 disables skipping
+        "skipped_regions": BadRegionMap(), # Areas jumped over by skip-ahead, not read yet
+        "timeouts": 0,
+        "timeout_regions": BadRegionMap(),
+        "fingerprints": None, # Optional RegionFingerprints filled from the data read
+    }
+
+def split_scan_range(start, end, block_size_bytes, jobs, max_segment_bytes=1024**3):
+    """Splits [start, end) into block-aligned segments for parallel scanning.
+
+    Produces several segments per job (capped at max_segment_bytes) so that a
+    worker stuck in a slow or failing area does not hold up the whole scan.
+    """
+    total = end - start
+    if total <= 0:
+        return []
+    segment_size = align_up(-(-total // (max(jobs, 1) * 8)), block_size_bytes)
+    segment_size = max(block_size_bytes, min(segment_size, align_down(max_segment_bytes, block_size_bytes) or block_size_bytes))
+    return [(offset, min(offset + segment_size, end)) for offset in range(start, end, segment_size)]
+
+def split_at_region_boundaries(start, end, region_size):
+    """Cuts [start, end) into a partial head region, the whole regions and a partial tail region.
+
+    Every piece after the head starts on a multiple of region_size, so a
+    region is never shared by two pieces. Empty pieces are left out.
+    """
+    if start >= end:
+        return []
+    cuts = sorted({start, end} | {boundary for boundary in (align_up(start, region_size), align_down(end, region_size))
+                                  if start < boundary < end})
+    return list(zip(cuts, cuts[1:]))
+
+def read_block_with_retries(read_block, offset, length, retries):
+    """Reads one block, retrying up to `retries` times after a read error.
+
+    Timeouts are not retried: a read that stalled once is likely to stall again.
+    Returns (bytes_read, attempts); re-raises the last error if every attempt fails.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return read_block(offset, length), attempt + 1
+        except ReadTimeoutError:
+            raise
+        except (IOError, OSError):
+            if attempt == retries:
+                raise
+
+def scan_segment(read_block, start, end, block_size_bytes, sector_size, adaptive, stats, lock, on_progress=None):
+    """Reads [start, end) block by block and records results in the shared stats dict.
+
+    The segment's next offset is tracked in stats["segments"] so an interrupted
+    scan can be checkpointed and resumed. Stops early once stats["stop_requested"] is set.
+
+    A failing block is retried stats["retries"] times. With stats["max_skip_bytes"]
+    set, every further consecutive error skips ahead by a doubling distance (one
+    block, two, four, ... up to the cap) so a dead zone is crossed quickly; the
+    skipped areas are collected in stats["skipped_regions"] for a later pass.
+    Reads given up on by a ReadWatchdog are recorded as timeouts and not bisected.
+
+    With stats["fingerprints"] set (a RegionFingerprints), read_block must return
+    the data it read instead of its length, and the data is hashed per region.
+    """
+    offset = start
+    consecutive_errors = 0
+    hasher = stats["fingerprints"].new_segment_hasher() if stats["fingerprints"] is not None else None
+    count_block = (lambda block_offset, block_length: len(read_block(block_offset, block_length))) if hasher else read_block
+    with lock:
+        segment_state = stats["segments"].setdefault(start, [start, end])
+    while offset < end and not stats["stop_requested"]:
+        length = min(block_size_bytes, end - offset)
+        if stats["throttle"]:
+            stats["throttle"].acquire(length)
+        read_started = time.perf_counter()
+        try:
+            data, attempts = read_block_with_retries(read_block, offset, length, stats["retries"])
+            bytes_read = len(data) if hasher else data
+        except (IOError, OSError) as e:
+            latency_s = time.perf_counter() - read_started
+            timed_out = isinstance(e, ReadTimeoutError)
+            consecutive_errors += 1
+            report_message("error", f"{'Read timeout' if timed_out else 'Read error'} at offset ~{get_human_readable_size(offset)}: {e}",
+                           newline=True, kind="timeout" if timed_out else "read", offset=offset, length=length)
+            block_bad_sectors = []
+            if adaptive and not timed_out:
+                _, block_bad_sectors = locate_bad_sectors(count_block, offset, length, sector_size)
+                report_message("info", f"Bisection found {len(block_bad_sectors)} unreadable sector(s) in this block; the rest of the block is readable.")
+            skip = 0
+            if stats["max_skip_bytes"] and consecutive_errors > 1:
+                skip = min(block_size_bytes * 2 ** (consecutive_errors - 2), stats["max_skip_bytes"], end - offset - length)
+            if hasher:
+                hasher.fail(offset, length)
+            with lock:
+                record_block_latency(stats, offset, length, latency_s)
+                stats["errors_found"] += 1
+                if timed_out:
+                    stats["timeouts"] += 1
+                    stats["timeout_regions"].add(offset, length)
+                if block_bad_sectors:
+                    for bad_sector_offset in block_bad_sectors:
+                        stats["bad_regions"].add(bad_sector_offset, sector_size)
+                    stats["bad_sector_count"] += len(block_bad_sectors)
+                elif not adaptive or timed_out:
+                    stats["bad_regions"].add(offset, length)
+                if skip > 0:
+                    stats["skipped_regions"].add(offset + length, skip)
+                stats["bytes_done"] += length
+                offset += length + skip
+                segment_state[0] = offset
+            if skip > 0:
+                report_message("info", f"{consecutive_errors} consecutive errors; skipping {get_human_readable_size(skip)} ahead "
+                      f"to offset {get_human_readable_size(offset)} (to be read in a later pass).")
+            else:
+                report_message("info", f"Attempting to continue scan from offset {get_human_readable_size(offset)}")
+        else:
+            latency_s = time.perf_counter() - read_started
+            consecutive_errors = 0
+            if hasher:
+                hasher.update(offset, data)
+            if not bytes_read:
+                if hasher:
+                    hasher.end_of_data()
+                with lock:
+                    if stats["eof_offset"] is None or offset < stats["eof_offset"]:
+                        stats["eof_offset"] = offset
+                    segment_state[0] = end
+                break
+            with lock:
+                record_block_latency(stats, offset, bytes_read, latency_s)
+                if attempts > 1:
+                    stats["recovered_by_retry"] += 1
+                stats["bytes_done"] += bytes_read
+                offset += bytes_read
+                segment_state[0] = offset
+        if on_progress:
+            on_progress()
+
+
+def wilson_interval(failures, trials, z=1.96):
+    """Returns the (low, high) Wilson score interval for a failure proportion (95% by default)."""
+    if trials == 0:
+        return 0.0, 1.0
+    p = failures / trials
+    denominator = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+def plan_stratified_sample(scan_end, block_size_bytes, sample_count, rng, already_sampled):
+    """Picks up to sample_count block offsets in [0, scan_end), one per equal-sized zone.
+
+    Every zone of the device is represented and the offsets come out in
+    ascending order, so an HDD only ever seeks forward. Block indices already in
+    already_sampled are avoided (and new ones are added to it).
+    """
+    total_blocks = -(-scan_end // block_size_bytes)
+    sample_count = min(sample_count, total_blocks - len(already_sampled))
+    offsets = []
+    for zone in range(max(sample_count, 0)):
+        first_block = zone * total_blocks // sample_count
+        last_block = (zone + 1) * total_blocks // sample_count
+        block = rng.randrange(first_block, last_block)
+        if block in already_sampled:
+            # Dense late passes: take the next unsampled block of this zone, if any.
+            block = next((candidate for candidate in range(first_block, last_block) if candidate not in already_sampled), None)
+            if block is None:
+                continue
+        already_sampled.add(block)
+        offsets.append(block * block_size_bytes)
+    return offsets
+
+def run_sample_scan(read_block, scan_end, block_size_bytes, sector_size, adaptive, stats, lock,
+                    target_samples=None, max_seconds=None, seed=None, on_progress=None):
+    """Reads a stratified random sample of blocks, refining coverage in rounds.
+
+    Each round is one ascending pass over the whole device; the first pass is
+    coarse and every later one doubles the number of samples, so stopping at any
+    time (max_seconds, Ctrl-C) still leaves an evenly spread sample. Stops when
+    target_samples blocks were read, the time budget is spent or every block
+    has been sampled. Returns a dict with the sample counts.
+    """
+    rng = random.Random(seed)
+    total_blocks = -(-scan_end // block_size_bytes)
+    target_samples = min(target_samples or total_blocks, total_blocks)
+    deadline = time.time() + max_seconds if max_seconds else None
+    already_sampled = set()
+    sampled, rounds, round_size = 0, 0, min(target_samples, 256)
+    while sampled < target_samples and not stats["stop_requested"]:
+        offsets = plan_stratified_sample(scan_end, block_size_bytes, min(round_size, target_samples - sampled), rng, already_sampled)
+        if not offsets:
+            break
+        rounds += 1
+        for offset in offsets:
+            if deadline and time.time() >= deadline:
+                stats["stop_requested"] = True
+                break
+            if stats["stop_requested"]:
+                break
+            scan_segment(read_block, offset, min(offset + block_size_bytes, scan_end), block_size_bytes,
+                         sector_size, adaptive, stats, lock, on_progress=on_progress)
+            with lock:
+                stats["segments"].pop(offset, None) # Sample reads are not resumable segments
+            sampled += 1
+        round_size = sampled
+    return {"sampled_blocks": sampled, "total_blocks": total_blocks, "rounds": rounds,
+            "time_budget_exhausted": bool(deadline) and time.time() >= deadline}
+
+
+CHECKPOINT_VERSION = 1
+
+def get_default_scan_file_path(device_path, suffix):
+    """Returns a per-device result file name (dsk_scan_<device>.<suffix>) in the current directory."""
+    safe_name = re.sub(r'[^A-Za-z0-9._-]+', '_', device_path).strip('_') or "device"
+    return f"dsk_scan_{safe_name}.{suffix}"
+
+def get_default_checkpoint_path(device_path):
+    """Returns the default checkpoint file name for a device, in the current directory."""
+    return get_default_scan_file_path(device_path, "checkpoint.json")
+
+def get_device_identity(fd, device_path):
+    """Returns a dict identifying the device behind fd, used to validate resumes.
+
+    For block devices the serial number / WWID from sysfs is included when
+    available; for image files the (st_dev, st_ino) pair is used.
+    """
+    st = os.fstat(fd)
+    identity = {"size": os.lseek(fd, 0, os.SEEK_END)}
+    if stat.S_ISBLK(st.st_mode):
+        identity["rdev"] = [os.major(st.st_rdev), os.minor(st.st_rdev)] if hasattr(os, 'major') else st.st_rdev
+        name = os.path.basename(os.path.realpath(device_path))
+        for attribute in ("device/serial", "device/wwid", "wwid", "dm/uuid"):
+            try:
+                with open(f"/sys/class/block/{name}/{attribute}", 'r') as f:
+                    identity["serial"] = f.read().strip()
+                    break
+            except OSError:
+                continue
+    else:
+        identity["inode"] = [st.st_dev, st.st_ino]
+    return identity
+
+def write_scan_checkpoint(checkpoint_path, checkpoint):
+    """Atomically writes a checkpoint dict as JSON (write to temp file, then rename)."""
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, checkpoint_path)
+
+def load_scan_checkpoint(checkpoint_path):
+    """Loads a checkpoint written by write_scan_checkpoint. Returns None if missing or unreadable."""
+    try:
+        with open(checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        print(f"  Error: Checkpoint file '{checkpoint_path}' not found.")
+        return None
+    except (OSError, ValueError) as e:
+        print(f"  Error: Could not read checkpoint '{checkpoint_path}'. {type(e).__name__}: {e}")
+        return None
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        print(f"  Error: Checkpoint '{checkpoint_path}' has an unsupported version ({checkpoint.get('version')}).")
+        return None
+    return checkpoint
+
+
+def scan_disk(device_path, block_size_kb=64, scan_limit_gb=None, direct_io=False, adaptive=False, jobs=1,
+              progress_callback=None, checkpoint=False, checkpoint_path=None, resume=False,
+              checkpoint_interval_s=60, bad_regions_path=None, bad_region_merge_gap=0,
+              slow_threshold_ms=DEFAULT_SLOW_THRESHOLD_MS, slow_regions_path=None,
+              sample_fraction=None, sample_blocks=None, max_seconds=None, sample_seed=None, scan_ranges=None,
+              max_mb_s=None, max_iops=None, adaptive_throttle=False,
+              retries=0, max_skip_kb=None, second_pass=True, read_timeout_s=None, backend=None,
+              fingerprint_region_mb=None, fingerprints_path=None, compare_fingerprints_path=None, skip_holes=None):
+    """Scans a device (or image file) for unreadable blocks.
+
+    With direct_io=True the scan bypasses the page cache: reads use O_DIRECT into
+    a single reused, page-aligned buffer, and the block size and scan limit are
+    aligned to the device's logical sector size.
+
+    With adaptive=True a failing block is bisected down to the logical sector
+    size, so large blocks keep full throughput while the report lists the exact
+    unreadable sectors and the readable remainder of the block is still counted.
+
+    With jobs > 1 the range is split into block-aligned segments that a pool of
+    worker threads reads concurrently with positional reads, raising the queue
+    depth for NVMe and SAN devices. Results are merged into the same report.
+
+    progress_callback(bytes_done, bytes_planned, errors_found), if given, is
+    called at the same (rate-limited) points where progress is printed.
+
+    With checkpoint=True the scan state (device identity, range, block size, the
+    unread ranges and the errors found so far) is written atomically to
+    checkpoint_path (default: get_default_checkpoint_path) every
+    checkpoint_interval_s seconds and on Ctrl-C; it is removed once the scan
+    completes. resume=True continues from that checkpoint, reusing its range and
+    block size, and refuses to run if the device size or identity has changed.
+
+    Unreadable areas are collected in a BadRegionMap (ranges closer than
+    bad_region_merge_gap bytes are coalesced) and, if bad_regions_path is given,
+    saved there as JSON lines when the scan ends.
+
+    Every block read is timed into a LatencyHistogram. Blocks that take at least
+    slow_threshold_ms (but may still succeed) are collected as slow regions,
+    reported with p50/p99/max latency and saved to slow_regions_path if given.
+
+    Quick-scan (sampling) mode is enabled by sample_fraction (0-1], sample_blocks
+    or max_seconds: only a stratified random sample of blocks spread over the
+    whole range is read (see run_sample_scan), and the summary estimates the bad
+    block density with a 95% Wilson confidence interval. Sampling runs with a
+    single job and does not write checkpoints.
+
+    scan_ranges, a list of (start, end) byte ranges, restricts the scan to those
+    ranges (used by rescan_regions); checkpoints are not written in this mode.
+
+    max_mb_s and max_iops cap the scan's read rate; adaptive_throttle backs off
+    while other processes are doing I/O on the same disk (see IOThrottle). Any
+    of these also lowers the process's I/O and CPU priority.
+
+    Error policy for failing disks: each failing block is retried `retries` times.
+    With max_skip_kb set, consecutive errors make the scan skip ahead by a
+    doubling distance capped at max_skip_kb, and a second pass (unless
+    second_pass=False) then reads the skipped areas without skipping. With
+    read_timeout_s set, reads stalled longer than that are abandoned by a
+    ReadWatchdog and recorded as timeouts, so the scan stays time-bounded.
+
+    Sparse targets: with skip_holes=True a full scan of a sparse image file, or
+    of a loop device backed by one, reads only the allocated extents (see
+    find_allocated_scan_ranges); holes are reported but not read. The default
+    (None) is the backend's skip_holes attribute.
+
+    backend (default: FileDeviceBackend) opens the device and provides the block
+    readers; a FaultInjectingBackend simulates bad, slow or hanging ranges and
+    reads holes by default, since its image stands for a whole disk.
+
+    Content fingerprints: with fingerprint_region_mb set, the data read is also
+    hashed (BLAKE2b) per region of that size and the RegionFingerprints are
+    saved to fingerprints_path. compare_fingerprints_path names the fingerprint
+    file of an earlier scan of the same device; it implies fingerprinting with
+    that file's region size, and regions whose content changed or that became
+    unreadable since then are reported. This catches silent corruption that
+    reads without errors. Not available in sampling mode.
+
+    Returns a summary dict, or None if the scan could not be started.
+    """
+    report("start", f"\n--- Disk Scan for {device_path} ---", operation="scan", device_path=device_path,
+           block_size_kb=block_size_kb, jobs=jobs, direct_io=direct_io, adaptive=adaptive)
+    # Image files can be scanned by their owner; raw devices need root.
+    if os.name != 'nt' and os.geteuid() != 0 and not os.path.isfile(device_path):
+        report_message("error", "Disk scanning requires root/administrator privileges. Please run the script using 'sudo'.")
+        return
+
+    block_size_bytes = block_size_kb * 1024
+    backend = backend or FileDeviceBackend()
+    fd = None
+    stats = new_scan_stats() # Initialize here for summary if open fails
+    stats["bad_regions"].merge_gap = bad_region_merge_gap
+    stats["slow_threshold_s"] = slow_threshold_ms / 1000.0
+    stats["retries"] = retries
+    stats["max_skip_bytes"] = max_skip_kb * 1024 if max_skip_kb else 0
+    stats_lock = threading.Lock()
+    sector_size = DEFAULT_LOGICAL_SECTOR_SIZE
+    total_bytes_to_scan_final = bytes_planned = 0 # Initialize for summary
+    allocated_bytes = None # Set for sparse targets whose holes are skipped
+    interrupted = False
+    watchdogs = []
+    sampling = bool(sample_fraction or sample_blocks or max_seconds)
+    sample_summary = None
+    if sampling and resume:
+        report_message("error", "--resume cannot be combined with sampling mode.")
+        return
+    if scan_ranges is not None and resume:
+        report_message("error", "--resume cannot be combined with a targeted rescan.")
+        return
+    previous_fingerprints = None
+    if compare_fingerprints_path:
+        try:
+            previous_fingerprints, _ = RegionFingerprints.load(compare_fingerprints_path)
+        except (OSError, ValueError, KeyError) as e:
+            report_message("error", f"Could not load fingerprints from '{compare_fingerprints_path}': {e}")
+            return
+    fingerprinting = bool(fingerprint_region_mb or previous_fingerprints)
+    if fingerprinting and sampling:
+        report_message("error", "Content fingerprints need a full scan and cannot be combined with sampling mode.")
+        return
+    if scan_ranges is not None:
+        checkpoint = False
+    if sampling:
+        checkpoint = False
+        if jobs > 1:
+            report_message("info", "Sampling mode reads blocks in ascending order with a single job.")
+            jobs = 1
+    if checkpoint or resume:
+        checkpoint_path = checkpoint_path or get_default_checkpoint_path(device_path)
+    else:
+        checkpoint_path = None
+    if jobs > 1 and not hasattr(os, 'pread'):
+        report_message("warning", "Positional reads are not available on this platform. Falling back to a single job.")
+        jobs = 1
+
+    try:
+        report_message("info", f"Opening device: {device_path} (Block Size: {block_size_kb}KB, Limit: {scan_limit_gb or 'Full Disk'}GB)")
+        fd, direct_active = backend.open(device_path, direct_io)
+
+        disk_size_bytes = os.lseek(fd, 0, os.SEEK_END)
+        os.lseek(fd, 0, os.SEEK_SET)
+        report_message("info", f"Device Size: {get_human_readable_size(disk_size_bytes)}")
+
+        if direct_active or adaptive or jobs > 1:
+            sector_size = get_logical_sector_size(fd)
+        if direct_active:
+            try:
+                # Some filesystems accept O_DIRECT at open time but reject the reads.
+                make_block_reader(fd, True, sector_size, sector_size)(0, sector_size)
+            except OSError as e:
+                if e.errno == errno.EINVAL:
+                    report_message("warning", f"Direct read rejected ({e}). Falling back to buffered reads.")
+                    os.close(fd)
+                    fd = None
+                    fd, direct_active = backend.open(device_path, direct_io=False)
+        if adaptive:
+            report_message("info", f"Adaptive mode enabled. Failing blocks will be bisected down to {sector_size}B sectors.")
+        if direct_active:
+            block_size_bytes = max(align_up(block_size_bytes, sector_size), sector_size)
+            report_message("info", f"Direct I/O enabled (Logical Sector Size: {sector_size}B, Aligned Block Size: {get_human_readable_size(block_size_bytes)})")
+
+        total_bytes_to_scan_final = disk_size_bytes
+        if scan_limit_gb is not None and scan_limit_gb > 0:
+            limit_bytes = int(scan_limit_gb * (1024**3))
+            if limit_bytes == 0 and scan_limit_gb > 0: limit_bytes = block_size_bytes
+            if direct_active: limit_bytes = max(align_down(limit_bytes, sector_size), sector_size)
+            total_bytes_to_scan_final = min(disk_size_bytes, limit_bytes)
+            report_message("info", f"Effective Scan Limit: {get_human_readable_size(total_bytes_to_scan_final)}")
+        else:
+            report_message("info", f"Scanning up to: {get_human_readable_size(total_bytes_to_scan_final)}")
+        ranges_to_scan = [(0, total_bytes_to_scan_final)]
+        if checkpoint_path:
+            checkpoint_base = {
+                "version": CHECKPOINT_VERSION,
+                "device_path": device_path,
+                "identity": get_device_identity(fd, device_path),
+                "scan_end": total_bytes_to_scan_final,
+                "block_size_bytes": block_size_bytes,
+            }
+        if resume:
+            saved = load_scan_checkpoint(checkpoint_path)
+            if not saved:
+                report_message("error", "Cannot resume without a valid checkpoint.")
+                return
+            if saved.get("device_path") != device_path or saved.get("identity") != checkpoint_base["identity"]:
+                report_message("error", f"Checkpoint '{checkpoint_path}' was written for a different device, or the device size/identity has changed. Refusing to resume.")
+                report("detail", f"    Checkpoint: {saved.get('device_path')} {saved.get('identity')}\n"
+                                 f"    Current:    {device_path} {checkpoint_base['identity']}")
+                return
+            total_bytes_to_scan_final = checkpoint_base["scan_end"] = saved["scan_end"]
+            block_size_bytes = checkpoint_base["block_size_bytes"] = saved["block_size_bytes"]
+            ranges_to_scan = [tuple(pending_range) for pending_range in saved["pending_ranges"]]
+            for key in ("bytes_done", "errors_found", "bad_sector_count"):
+                stats[key] = saved[key]
+            stats["bad_regions"] = BadRegionMap(saved["bad_regions"], merge_gap=bad_region_merge_gap)
+            stats["latency"] = LatencyHistogram(saved["latency_counts"], saved["latency_max_s"])
+            stats["slow_regions"] = BadRegionMap(saved["slow_regions"])
+            stats["slowest_blocks"] = [tuple(entry) for entry in saved["slowest_blocks"]]
+            heapq.heapify(stats["slowest_blocks"])
+            report_message("info", f"Resuming from checkpoint '{checkpoint_path}': {get_human_readable_size(stats['bytes_done'])} of "
+                  f"{get_human_readable_size(total_bytes_to_scan_final)} already scanned, {stats['errors_found']} errors so far "
+                  f"(Block Size: {get_human_readable_size(block_size_bytes)}).")
+        bytes_planned = total_bytes_to_scan_final
+        if scan_ranges is not None:
+            ranges_to_scan = [(start, min(end, total_bytes_to_scan_final)) for start, end in scan_ranges
+                              if start < total_bytes_to_scan_final]
+            bytes_planned = sum(end - start for start, end in ranges_to_scan)
+            report_message("info", f"Targeted scan of {len(ranges_to_scan)} range(s), {get_human_readable_size(bytes_planned)} in total.")
+        if skip_holes is None:
+            skip_holes = backend.skip_holes
+        if skip_holes and scan_ranges is None and not resume and not sampling:
+            allocated_ranges = find_allocated_scan_ranges(fd, device_path, total_bytes_to_scan_final, block_size_bytes)
+            if allocated_ranges is not None:
+                allocated_bytes = sum(end - start for start, end in allocated_ranges)
+                if allocated_bytes < total_bytes_to_scan_final:
+                    ranges_to_scan, bytes_planned = allocated_ranges, allocated_bytes
+                    report_message("info", f"Sparse target: {get_human_readable_size(allocated_bytes)} allocated in {len(allocated_ranges)} extent(s); "
+                                           f"{get_human_readable_size(total_bytes_to_scan_final - allocated_bytes)} of holes will be skipped.")
+                if allocated_bytes == 0:
+                    report_message("warning", f"{device_path} has no allocated data, so nothing will be read. "
+                                              f"Use --read-holes (skip_holes=False) to read the holes anyway.")
+        if total_bytes_to_scan_final == 0 or bytes_planned == 0:
+            report_message("info", "Nothing to scan (device size or scan limit is zero, or no data is allocated).")
+            return
+
+        if fingerprinting:
+            if previous_fingerprints:
+                region_size = previous_fingerprints.region_size # Regions must line up to be compared
+            else:
+                region_size = max(int(fingerprint_region_mb * 1024**2), block_size_bytes)
+            stats["fingerprints"] = RegionFingerprints(region_size, scan_end=total_bytes_to_scan_final)
+            report_message("info", f"Fingerprinting content per {get_human_readable_size(stats['fingerprints'].region_size)} region ({FINGERPRINT_ALGORITHM})"
+                                   f"{f', comparing with {compare_fingerprints_path!r}' if previous_fingerprints else ''}.")
+            if resume:
+                report_message("warning", "Only the part of the device read after resuming is fingerprinted.")
+
+        if max_mb_s or max_iops or adaptive_throttle:
+            disk_name = os.path.basename(get_parent_disk(device_path)[0]) if adaptive_throttle else None
+            stats["throttle"] = IOThrottle(max_bytes_per_s=max_mb_s * 1024**2 if max_mb_s else None,
+                                           max_iops=max_iops, adaptive=adaptive_throttle, disk_name=disk_name)
+            limits = [f"{max_mb_s} MB/s" if max_mb_s else None, f"{max_iops} IOPS" if max_iops else None,
+                      f"adaptive back-off on {disk_name}" if adaptive_throttle else None]
+            report_message("info", f"Throttling enabled ({', '.join(limit for limit in limits if limit)}). Priority lowered: {lower_io_priority()}.")
+
+        def save_checkpoint():
+            with stats_lock:
+                snapshot = dict(checkpoint_base,
+                                pending_ranges=sorted([[current, end] for current, end in stats["segments"].values() if current < end] +
+                                                      [[start, end] for start, end in stats["skipped_regions"]]),
+                                bytes_done=stats["bytes_done"],
+                                errors_found=stats["errors_found"],
+                                bad_sector_count=stats["bad_sector_count"],
+                                bad_regions=stats["bad_regions"].ranges(),
+                                latency_counts=list(stats["latency"].counts),
+                                latency_max_s=stats["latency"].max_seconds,
+                                slow_regions=stats["slow_regions"].ranges(),
+                                slowest_blocks=list(stats["slowest_blocks"]),
+                                updated_at=time.time())
+            try:
+                write_scan_checkpoint(checkpoint_path, snapshot)
+            except OSError as e:
+                report_message("warning", f"Could not write checkpoint '{checkpoint_path}': {e}", newline=True)
+
+        if read_timeout_s:
+            report_message("info", f"Read watchdog enabled: reads stalled for more than {read_timeout_s:g}s are recorded as timeouts.")
+
+        def new_block_reader():
+            make_reader = lambda: backend.make_reader(fd, direct_active, sector_size, block_size_bytes,
+                                                      return_data=fingerprinting)
+            if not read_timeout_s:
+                return make_reader()
+            watchdog = ReadWatchdog(make_reader, read_timeout_s)
+            with stats_lock:
+                watchdogs.append(watchdog)
+            return watchdog
+
+        start_time = time.time()
+        progress_state = {"last_print_time": start_time, "last_checkpoint_time": start_time}
+
+        def report_progress(force=False):
+            current_time = time.time()
+            if not force and current_time - progress_state["last_print_time"] < 1:
+                return
+            bytes_done = stats["bytes_done"]
+            progress_percent = (bytes_done / bytes_planned) * 100 if bytes_planned > 0 else 0
+            scanned_hr, total_scan_hr = get_human_readable_size(bytes_done), get_human_readable_size(bytes_planned)
+            elapsed_time = current_time - start_time
+            speed_mb_s = (bytes_done / (1024**2)) / elapsed_time if elapsed_time > 0 else 0
+            report("progress", f"\r  Progress: {progress_percent:.2f}% ({scanned_hr}/{total_scan_hr}) | Speed: {speed_mb_s:.2f} MB/s | Errors: {stats['errors_found']}",
+                   end="", final=force, operation="scan", device_path=device_path, bytes_done=bytes_done,
+                   bytes_total=bytes_planned, errors=stats["errors_found"], speed_mb_s=round(speed_mb_s, 2))
+            progress_state["last_print_time"] = current_time
+            if progress_callback:
+                progress_callback(bytes_done, bytes_planned, stats["errors_found"])
+            if checkpoint_path and current_time - progress_state["last_checkpoint_time"] >= checkpoint_interval_s:
+                save_checkpoint()
+                progress_state["last_checkpoint_time"] = current_time
+
+        def plan_segments(ranges):
+            if jobs > 1:
+                alignment = block_size_bytes
+                if fingerprinting:
+                    # Fingerprinted regions must not straddle segments read by different workers, so
+                    # segments must start on absolute multiples of the region size. Allocated ranges of
+                    # sparse images are only block-aligned: cut them at region boundaries first.
+                    region_size = stats["fingerprints"].region_size
+                    alignment = math.lcm(block_size_bytes, region_size)
+                    ranges = [piece for range_start, range_end in ranges
+                              for piece in split_at_region_boundaries(range_start, range_end, region_size)]
+                segments = [segment for range_start, range_end in ranges
+                            for segment in split_scan_range(range_start, range_end, alignment, jobs)]
+            else:
+                segments = list(ranges)
+            for segment_start, segment_end in segments:
+                stats["segments"][segment_start] = [segment_start, segment_end]
+            return segments
+
+        def run_pass(segments):
+            """Scans the segments with the configured jobs; returns True if interrupted."""
+            if jobs > 1:
+                # One reader (and watchdog thread) per worker thread, reused for all its segments.
+                worker_state = threading.local()
+
+                def scan_worker(segment_start, segment_end):
+                    if not hasattr(worker_state, "read_block"):
+                        worker_state.read_block = new_block_reader()
+                    read_block = worker_state.read_block
+                    scan_segment(read_block, segment_start, segment_end, block_size_bytes, sector_size,
+                                 adaptive, stats, stats_lock)
+
+                with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                    pending = {executor.submit(scan_worker, seg_start, seg_end) for seg_start, seg_end in segments}
+                    try:
+                        while pending:
+                            done, pending = concurrent.futures.wait(pending, timeout=1)
+                            for future in done:
+                                future.result() # Re-raise unexpected worker errors
+                            report_progress()
+                    except KeyboardInterrupt:
+                        # Let workers finish their current block instead of leaving the pool hanging.
+                        stats["stop_requested"] = True
+                        return True
+                return False
+            read_block = new_block_reader()
+            try:
+                for segment_start, segment_end in segments:
+                    scan_segment(read_block, segment_start, segment_end, block_size_bytes, sector_size,
+                                 adaptive, stats, stats_lock, on_progress=report_progress)
+            except KeyboardInterrupt:
+                return True
+            return False
+
+        if sampling:
+            total_blocks = -(-total_bytes_to_scan_final // block_size_bytes)
+            target_samples = sample_blocks or (int(math.ceil(total_blocks * sample_fraction)) if sample_fraction else None)
+            budget = f", time budget {max_seconds}s" if max_seconds else ""
+            report_message("info", f"Starting quick scan: sampling {target_samples or 'as many as time allows of'} {total_blocks} blocks "
+                  f"across the whole range{budget}...")
+            read_block = new_block_reader()
+            try:
+                sample_summary = run_sample_scan(read_block, total_bytes_to_scan_final, block_size_bytes, sector_size,
+                                                 adaptive, stats, stats_lock, target_samples=target_samples,
+                                                 max_seconds=max_seconds, seed=sample_seed, on_progress=report_progress)
+            except KeyboardInterrupt:
+                interrupted = True
+                sample_summary = {"sampled_blocks": stats["latency"].count(), "total_blocks": total_blocks,
+                                  "rounds": None, "time_budget_exhausted": False}
+        else:
+            segments = plan_segments(ranges_to_scan)
+            if jobs > 1:
+                report_message("info", f"Starting parallel scan with {jobs} jobs over {len(segments)} segments...")
+            else:
+                report_message("info", "Starting scan...")
+            interrupted = run_pass(segments)
+            if not interrupted and stats["skipped_regions"] and second_pass:
+                with stats_lock:
+                    skipped, stats["skipped_regions"] = stats["skipped_regions"], BadRegionMap()
+                    stats["max_skip_bytes"] = 0 # Read every skipped block this time
+                    stats["segments"] = {}
+                report_progress(force=True)
+                report_message("info", f"Second pass over {len(skipped)} skipped area(s) ({get_human_readable_size(skipped.total_bytes())})...", newline=True)
+                interrupted = run_pass(plan_segments(skipped.ranges()))
+        report_progress(force=True)
+
+        if interrupted:
+            report_message("info", "Scan interrupted by user (KeyboardInterrupt).", newline=True)
+            if checkpoint_path:
+                save_checkpoint()
+                report_message("info", f"Progress saved to '{checkpoint_path}'. Continue later with --resume.")
+        elif checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path) # Scan complete; nothing left to resume
+
+        if stats["eof_offset"] is not None:
+            report_message("warning", f"Unexpected EOF at {get_human_readable_size(stats['eof_offset'])}. Expected {get_human_readable_size(total_bytes_to_scan_final)}.", newline=True)
+        if not interrupted:
+            report_message("info", "Scan finished.", newline=True)
+    except PermissionError: 
+        report_message("error", f"Permission denied when opening or accessing {device_path}. Ensure you are running with sudo/administrator rights.")
+        return 
+    except FileNotFoundError:
+        report_message("error", f"Device {device_path} not found.")
+        return
+    except Exception as e:
+        report_message("error", f"An unexpected issue occurred during scan of {device_path}: {type(e).__name__} - {e}", newline=True)
+    finally:
+        for watchdog in watchdogs:
+            watchdog.close()
+        if fd is not None:
+            try: os.close(fd); report_message("info", f"Device {device_path} closed.")
+            except OSError as e: report_message("error", f"Could not close device {device_path}: {e}")
+
+    errors_found, bad_regions = stats["errors_found"], stats["bad_regions"]
+    summary_lines = ["\n--- Scan Summary ---"]
+    summary_lines.append(f"  Device Scanned: {device_path}")
+    if jobs > 1:
+        summary_lines.append(f"  Parallel Jobs: {jobs}")
+    summary_lines.append(f"  Total Data Processed: {get_human_readable_size(stats['bytes_done'])} of {get_human_readable_size(bytes_planned)} planned")
+    if allocated_bytes is not None and allocated_bytes < total_bytes_to_scan_final:
+        summary_lines.append(f"  Allocated Data: {get_human_readable_size(allocated_bytes)} of {get_human_readable_size(total_bytes_to_scan_final)} "
+                             f"({get_human_readable_size(total_bytes_to_scan_final - allocated_bytes)} of holes skipped)")
+    summary_lines.append(f"  Number of Read Errors Encountered: {errors_found}")
+    if sample_summary:
+        sampled, total_blocks = sample_summary["sampled_blocks"], sample_summary["total_blocks"]
+        low, high = wilson_interval(errors_found, sampled)
+        density = errors_found / sampled if sampled else 0.0
+        summary_lines.append(f"  Sampled Blocks: {sampled} of {total_blocks} ({(sampled / total_blocks * 100) if total_blocks else 0:.3f}% coverage"
+                             f"{', time budget reached' if sample_summary['time_budget_exhausted'] else ''})")
+        summary_lines.append(f"  Estimated Bad Block Density: {density * 100:.4f}% (95% CI: {low * 100:.4f}% - {high * 100:.4f}%)")
+        summary_lines.append(f"  Estimated Unreadable Data: ~{get_human_readable_size(int(density * total_bytes_to_scan_final))} "
+                             f"(up to {get_human_readable_size(int(high * total_bytes_to_scan_final))})")
+    if stats["recovered_by_retry"]:
+        summary_lines.append(f"  Blocks Read After Retrying: {stats['recovered_by_retry']}")
+    if stats["timeouts"]:
+        summary_lines.append(f"  Read Timeouts (> {read_timeout_s:g}s): {stats['timeouts']}")
+    if stats["skipped_regions"]:
+        summary_lines.append(f"  Skipped Areas Not Read: {len(stats['skipped_regions'])} range(s), {get_human_readable_size(stats['skipped_regions'].total_bytes())}")
+    if adaptive:
+        summary_lines.append(f"  Unreadable Sectors Pinpointed: {stats['bad_sector_count']} ({get_human_readable_size(stats['bad_sector_count'] * sector_size)})")
+    if bad_regions:
+        summary_lines.append(f"  Bad Regions: {len(bad_regions)} range(s), {get_human_readable_size(bad_regions.total_bytes())} unreadable")
+        for region in bad_regions.format_summary():
+            summary_lines.append(f"    - {region}")
+    else:
+        summary_lines.append("  Info: No read errors detected during this scan segment.")
+    latency, slow_regions = stats["latency"], stats["slow_regions"]
+    slowest_blocks = sorted(stats["slowest_blocks"], reverse=True)
+    if latency.count():
+        summary_lines.append(f"  Read Latency: p50 {latency.percentile(50) * 1000:.2f} ms | p99 {latency.percentile(99) * 1000:.2f} ms | "
+                             f"max {latency.max_seconds * 1000:.2f} ms ({latency.count()} reads)")
+    if slow_regions:
+        summary_lines.append(f"  Slow Regions (>= {slow_threshold_ms} ms per block): {len(slow_regions)} range(s), {get_human_readable_size(slow_regions.total_bytes())}")
+        for latency_s, offset in slowest_blocks[:10]:
+            summary_lines.append(f"    - Block at {get_human_readable_size(offset)} (offset {offset}): {latency_s * 1000:.1f} ms")
+    if slow_regions_path:
+        try:
+            slow_regions.save(slow_regions_path, device_path=device_path, scan_end=total_bytes_to_scan_final,
+                              slow_threshold_ms=slow_threshold_ms, complete=not interrupted)
+            summary_lines.append(f"  Info: Slow region map saved to '{slow_regions_path}'.")
+        except OSError as e:
+            summary_lines.append(f"  Error: Could not save slow region map to '{slow_regions_path}': {e}")
+    if bad_regions_path:
+        try:
+            bad_regions.save(bad_regions_path, device_path=device_path, scan_end=total_bytes_to_scan_final,
+                             complete=not interrupted)
+            summary_lines.append(f"  Info: Bad region map saved to '{bad_regions_path}'.")
+        except OSError as e:
+            summary_lines.append(f"  Error: Could not save bad region map to '{bad_regions_path}': {e}")
+    fingerprints, fingerprint_changes = stats["fingerprints"], None
+    if fingerprints is not None:
+        summary_lines.append(f"  Content Fingerprints: {len(fingerprints)} region(s) of {get_human_readable_size(fingerprints.region_size)}")
+        if previous_fingerprints:
+            fingerprint_changes = fingerprints.compare(previous_fingerprints)
+            changed, newly_unreadable = fingerprint_changes["changed"], fingerprint_changes["newly_unreadable"]
+            summary_lines.append(f"  Fingerprint Comparison: {fingerprint_changes['compared']} region(s) compared, "
+                                 f"{len(changed)} changed range(s) ({get_human_readable_size(changed.total_bytes())}), "
+                                 f"{len(newly_unreadable)} newly unreadable range(s), {fingerprint_changes['not_comparable']} not comparable")
+            for region in changed.format_summary():
+                summary_lines.append(f"    - Changed: {region}")
+            for region in newly_unreadable.format_summary():
+                summary_lines.append(f"    - Newly unreadable: {region}")
+            if changed:
+                summary_lines.append("  Warning: Content changed since the earlier scan. On a disk that was not written to, this is silent corruption.")
+        if fingerprints_path:
+            try:
+                fingerprints.save(fingerprints_path, device_path=device_path, block_size_bytes=block_size_bytes,
+                                  complete=not interrupted, created_at=time.time())
+                summary_lines.append(f"  Info: Fingerprints saved to '{fingerprints_path}'.")
+            except OSError as e:
+                summary_lines.append(f"  Error: Could not save fingerprints to '{fingerprints_path}': {e}")
+    summary_lines.append("-" * 20)
+    report("summary", "\n".join(summary_lines), operation="scan", device_path=device_path,
+           bytes_scanned=stats["bytes_done"], bytes_planned=bytes_planned, allocated_bytes=allocated_bytes,
+           errors_found=errors_found,
+           bad_region_count=len(bad_regions), bad_bytes=bad_regions.total_bytes(), bad_sector_count=stats["bad_sector_count"],
+           timeouts=stats["timeouts"], skipped_bytes=stats["skipped_regions"].total_bytes(), slow_region_count=len(slow_regions),
+           latency_p50_ms=round(latency.percentile(50) * 1000, 3) if latency.count() else None,
+           latency_p99_ms=round(latency.percentile(99) * 1000, 3) if latency.count() else None,
+           bad_regions_path=bad_regions_path, slow_regions_path=slow_regions_path,
+           fingerprinted_regions=len(fingerprints) if fingerprints is not None else None,
+           changed_regions=fingerprint_changes["changed"].ranges() if fingerprint_changes else None,
+           newly_unreadable_regions=fingerprint_changes["newly_unreadable"].ranges() if fingerprint_changes else None,
+           interrupted=interrupted, sampling=sample_summary)
+    return {
+        "device_path": device_path,
+        "bytes_scanned": stats["bytes_done"],
+        "bytes_planned": bytes_planned,
+        "allocated_bytes": allocated_bytes,
+        "errors_found": errors_found,
+        "bad_regions": bad_regions,
+        "bad_sector_count": stats["bad_sector_count"],
+        "latency": latency,
+        "slow_regions": slow_regions,
+        "slowest_blocks": slowest_blocks,
+        "sector_size": sector_size,
+        "interrupted": interrupted,
+        "sampling": sample_summary,
+        "recovered_by_retry": stats["recovered_by_retry"],
+        "timeouts": stats["timeouts"],
+        "timeout_regions": stats["timeout_regions"],
+        "skipped_regions": stats["skipped_regions"],
+        "fingerprints": fingerprints,
+        "fingerprint_changes": fingerprint_changes,
+    }
+
+
+def expand_regions(regions, margin_bytes, alignment, limit=None):
+    """Returns a new BadRegionMap with every range widened by margin_bytes on both sides.
+
+    Range edges are aligned outwards to `alignment` and clipped to [0, limit).
+    """
+    expanded = BadRegionMap()
+    for start, end in regions:
+        new_start = align_down(max(start - margin_bytes, 0), alignment)
+        new_end = align_up(end + margin_bytes, alignment)
+        if limit is not None:
+            new_end = min(new_end, limit)
+        if new_start < new_end:
+            expanded.add(new_start, new_end - new_start)
+    return expanded
+
+def classify_rescan(previous_regions, current_bad_regions):
+    """Compares a rescan with earlier results.
+
+    Returns a dict with "recovered" (previous ranges that now read cleanly),
+    "still_bad" (previous ranges that still contain unreadable bytes) and
+    "new" (unreadable ranges found outside every previous range).
+    """
+    recovered, still_bad, new = [], [], BadRegionMap()
+    for start, end in previous_regions:
+        (still_bad if current_bad_regions.query(start, end - start) else recovered).append((start, end))
+    for start, end in current_bad_regions:
+        if not previous_regions.query(start, end - start):
+            new.add(start, end - start)
+    return {"recovered": recovered, "still_bad": still_bad, "new": new.ranges()}
+
+def rescan_regions(device_path, region_files, margin_kb=1024, block_size_kb=64, adaptive=True, **scan_kwargs):
+    """Rereads only the regions reported by earlier scans, plus a margin around each.
+
+    region_files are bad/slow region maps saved by scan_disk (JSON lines). The
+    ranges are merged, widened by margin_kb and scanned with scan_disk (by default
+    in adaptive mode, so results are sector-precise). Reports which previously
+    reported regions are now readable, which are still bad and which bad areas are new.
+
+    Returns the classification dict (see classify_rescan), or None on failure.
+    """
+    print(f"\n--- Targeted Rescan of {device_path} ---")
+    previous_regions = BadRegionMap()
+    for region_file in region_files:
+        try:
+            regions, header = BadRegionMap.load(region_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  Error: Could not load region file '{region_file}'. {type(e).__name__}: {e}")
+            return None
+        if header.get("device_path") and header["device_path"] != device_path:
+            print(f"  Warning: '{region_file}' was recorded for {header['device_path']}, not {device_path}.")
+        print(f"  Info: Loaded {len(regions)} region(s) ({get_human_readable_size(regions.total_bytes())}) from '{region_file}'.")
+        previous_regions = previous_regions.union(regions)
+    if not previous_regions:
+        print("  Info: No regions to rescan.")
+        return {"recovered": [], "still_bad": [], "new": []}
+
+    block_size_bytes = block_size_kb * 1024
+    targets = expand_regions(previous_regions, margin_kb * 1024, block_size_bytes)
+    print(f"  Info: Rescanning {len(targets)} range(s) ({get_human_readable_size(targets.total_bytes())}) "
+          f"with a {margin_kb}KB margin around each reported region.")
+    result = scan_disk(device_path, block_size_kb=block_size_kb, adaptive=adaptive, scan_ranges=targets.ranges(), **scan_kwargs)
+    if not result:
+        return None
+
+    classification = classify_rescan(previous_regions, result["bad_regions"])
+    print("\n--- Rescan Comparison ---")
+    print(f"  Previously reported regions now readable: {len(classification['recovered'])}")
+    print(f"  Previously reported regions still bad: {len(classification['still_bad'])}")
+    print(f"  New bad regions (inside the margins): {len(classification['new'])}")
+    for label, ranges in (("Still bad", classification["still_bad"]), ("New", classification["new"])):
+        for start, end in ranges[:10]:
+            print(f"    - {label}: {get_human_readable_size(start)}-{get_human_readable_size(end)} (offsets {start}-{end})")
+        if len(ranges) > 10:
+            print(f"    - {label}: ... and {len(ranges) - 10} more")
+    return classification
+
+
+def get_parent_disk(device_path):
+    """Returns the physical disk(s) a scan target lives on, as a hashable key.
+
+    Partitions map to their parent disk, device-mapper/md devices to the disks
+    behind them (via /sys/class/block/<dev>/slaves), and image files and the
+    loop devices backed by them to the disk holding their filesystem. Targets that share a key contend for the same
+    spindle or controller queue and should not be scanned concurrently.
+    Falls back to the device path itself when sysfs is unavailable.
+    """
+    sys_block = "/sys/class/block"
+    try:
+        st = os.stat(device_path)
+        if stat.S_ISBLK(st.st_mode):
+            name = os.path.basename(os.path.realpath(device_path))
+            loop = get_loop_backing_file(device_path)
+            if loop:
+                return get_parent_disk(loop[0]) # Loop reads land on the disk holding the backing file
+        elif stat.S_ISREG(st.st_mode) and os.path.isdir("/sys/dev/block"):
+            dev_link = f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}"
+            name = os.path.basename(os.path.realpath(dev_link))
+        else:
+            return (device_path,)
+    except (OSError, AttributeError):
+        return (device_path,)
+
+    if not os.path.isdir(sys_block):
+        return (device_path,)
+
+    parents, pending, seen = set(), [name], set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        current_sys_path = os.path.join(sys_block, current)
+        if os.path.exists(os.path.join(current_sys_path, "partition")):
+            pending.append(os.path.basename(os.path.dirname(os.path.realpath(current_sys_path))))
+            continue
+        try:
+            slaves = os.listdir(os.path.join(current_sys_path, "slaves"))
+        except OSError:
+            slaves = []
+        if slaves:
+            pending.extend(slaves)
+        else:
+            parents.add(f"/dev/{current}")
+    return tuple(sorted(parents)) or (device_path,)
+
+def group_devices_by_parent_disk(device_paths):
+    """Groups scan targets so that targets sharing a physical disk end up together.
+
+    Returns a list of device path lists, in the order devices were first given.
+    Groups whose disks overlap (e.g. an LVM volume spanning two disks and a
+    partition on one of them) are merged.
+    """
+    groups = []
+    for device_path in dict.fromkeys(device_paths): # De-duplicate, keep order
+        disks = set(get_parent_disk(device_path))
+        overlapping = [group for group in groups if group["disks"] & disks]
+        merged = {"disks": disks, "devices": []}
+        for group in overlapping:
+            merged["disks"] |= group["disks"]
+            merged["devices"].extend(group["devices"])
+            groups.remove(group)
+        merged["devices"].append(device_path)
+        groups.append(merged)
+    return [group["devices"] for group in groups]
+
+def _scan_device_group(device_paths, scan_kwargs, progress_table, results_dir=None):
+    """Worker: scans the devices of one disk group serially with output captured."""
+    set_reporter(TextReporter()) # Per-device text is captured here and replayed by the parent
+    results = []
+    for device_path in device_paths:
+        def on_progress(bytes_done, bytes_planned, errors_found, device_path=device_path):
+            progress_table[device_path] = (bytes_done, bytes_planned, errors_found, "scanning")
+
+        progress_table[device_path] = (0, 0, 0, "scanning")
+        captured = io.StringIO()
+        with contextlib.redirect_stdout(captured):
+            try:
+                bad_regions_path = slow_regions_path = fingerprints_path = None
+                if results_dir is not None:
+                    bad_regions_path = os.path.join(results_dir, get_default_scan_file_path(device_path, "badregions.jsonl"))
+                    slow_regions_path = os.path.join(results_dir, get_default_scan_file_path(device_path, "slowregions.jsonl"))
+                    if scan_kwargs.get("fingerprint_region_mb"):
+                        fingerprints_path = os.path.join(results_dir, get_default_scan_file_path(device_path, "fingerprints.jsonl"))
+                summary = scan_disk(device_path, progress_callback=on_progress, bad_regions_path=bad_regions_path,
+                                    slow_regions_path=slow_regions_path, fingerprints_path=fingerprints_path, **scan_kwargs)
+            except Exception as e:
+                print(f"  Error: An unexpected issue occurred during scan of {device_path}: {type(e).__name__} - {e}")
+                summary = None
+        if summary:
+            progress_table[device_path] = (summary["bytes_scanned"], summary["bytes_planned"], summary["errors_found"], "done")
+        else:
+            progress_table[device_path] = (0, 0, 0, "failed")
+        results.append((device_path, summary, captured.getvalue()))
+    return results
+
+def scan_devices(device_paths, max_parallel=None, results_dir=None, **scan_kwargs):
+    """Scans several devices in one run, in parallel across physical disks.
+
+    Targets sharing a physical disk (see group_devices_by_parent_disk) are
+    scanned one after another inside the same worker process; different disks
+    are scanned concurrently by up to max_parallel processes (default: one per
+    disk group). A single aggregated status line is shown while the scans run,
+    followed by each device's scan summary. If results_dir is given, each
+    device's bad region map is saved there under its default file name.
+
+    Returns a dict mapping device path to its scan_disk summary (or None).
+    """
+    groups = group_devices_by_parent_disk(device_paths)
+    device_count = sum(len(group) for group in groups)
+    report("start", f"\n--- Multi-Device Scan ({device_count} devices on {len(groups)} physical disk groups) ---\n" +
+           "\n".join(f"  Group: {', '.join(group)}" for group in groups),
+           operation="scan-devices", devices=list(dict.fromkeys(device_paths)), groups=groups)
+    get_reporter().flush() # Nothing buffered may be duplicated into the worker processes
+
+    max_parallel = max_parallel or len(groups)
+    results = {}
+    logs = {}
+    start_time = time.time()
+    with multiprocessing.Manager() as manager:
+        progress_table = manager.dict()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_parallel) as executor:
+            pending = {executor.submit(_scan_device_group, group, scan_kwargs, progress_table, results_dir) for group in groups}
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=1)
+                for future in done:
+                    try:
+                        for device_path, summary, log in future.result():
+                            results[device_path], logs[device_path] = summary, log
+                    except Exception as e:
+                        report_message("error", f"A scan worker failed: {type(e).__name__} - {e}", newline=True)
+                snapshot = dict(progress_table)
+                bytes_done = sum(entry[0] for entry in snapshot.values())
+                bytes_planned = sum(entry[1] for entry in snapshot.values())
+                errors_found = sum(entry[2] for entry in snapshot.values())
+                finished = sum(1 for entry in snapshot.values() if entry[3] != "scanning")
+                active = sum(1 for entry in snapshot.values() if entry[3] == "scanning")
+                elapsed_time = time.time() - start_time
+                speed_mb_s = (bytes_done / (1024**2)) / elapsed_time if elapsed_time > 0 else 0
+                report("progress", f"\r  Devices: {finished}/{device_count} done, {active} active | "
+                                   f"{get_human_readable_size(bytes_done)}/{get_human_readable_size(bytes_planned)} | "
+                                   f"Speed: {speed_mb_s:.2f} MB/s | Errors: {errors_found}",
+                       end="", final=not pending, operation="scan-devices", devices_done=finished, devices_active=active,
+                       bytes_done=bytes_done, bytes_total=bytes_planned, errors=errors_found, speed_mb_s=round(speed_mb_s, 2))
+    report("detail", "")
+
+    for device_path in dict.fromkeys(device_paths):
+        log = logs.get(device_path, "")
+        summary_start = log.find("--- Scan Summary ---")
+        if summary_start >= 0:
+            report("detail", "\n" + log[summary_start:].rstrip())
+        else:
+            error_lines = [line for line in log.splitlines() if "Error" in line]
+            report("detail", "\n".join([f"\n--- Scan Summary ---\n  Device Scanned: {device_path}", *error_lines, "-" * 20]))
+        summary = results.get(device_path)
+        report("summary", operation="scan", device_path=device_path, ok=bool(summary),
+               bytes_scanned=summary["bytes_scanned"] if summary else 0, errors_found=summary["errors_found"] if summary else None,
+               bad_bytes=summary["bad_regions"].total_bytes() if summary else None)
+
+    overview_lines = ["\n--- Multi-Device Overview ---"]
+    for device_path in dict.fromkeys(device_paths):
+        summary = results.get(device_path)
+        if summary:
+            overview_lines.append(f"  {device_path}: {get_human_readable_size(summary['bytes_scanned'])} scanned, {summary['errors_found']} read errors")
+        else:
+            overview_lines.append(f"  {device_path}: scan failed or did not start")
+    report("summary", "\n".join(overview_lines), operation="scan-devices",
+           devices_ok=sum(1 for summary in results.values() if summary), devices=device_count,
+           errors_found=sum(summary["errors_found"] for summary in results.values() if summary))
+    return results
+
+WRITE_TEST_PATTERNS = ("0xaa", "0x55", "0xff", "0x00")
+
+def parse_test_pattern(name):
+    """Parses a write-test pattern name: a byte such as "0xaa" or "random" (seeded pseudo-random data).
+
+    Returns the byte value (0-255) or None for "random". Raises ValueError for anything else.
+    """
+    if name.lower() == "random":
+        return None
+    value = int(name, 16) if name.lower().startswith("0x") else int(name)
+    if not 0 <= value <= 255:
+        raise ValueError(f"pattern byte out of range: {name}")
+    return value
+
+def make_pattern_block(pattern_byte, offset, length, seed=0):
+    """Returns the test data for [offset, offset + length) as bytes.
+
+    Byte patterns repeat one value. For the random pattern (pattern_byte None)
+    every block gets different data derived from the seed and the block's offset,
+    so blocks swapped or aliased by the drive are caught, and the data can be
+    regenerated for verification instead of being kept in memory.
+    """
+    if pattern_byte is not None:
+        return bytes((pattern_byte,)) * length
+    return random.Random(seed * 2**64 + offset).randbytes(length)
+
+def get_active_swaps():
+    """Returns the swap devices and files listed in /proc/swaps (empty where it does not exist)."""
+    try:
+        with open("/proc/swaps") as f:
+            lines = f.read().splitlines()[1:] # Skip the header
+    except OSError:
+        return []
+    return [line.split()[0].replace("\\040", " ") for line in lines if line.strip()]
+
+def find_device_users(device_path):
+    """Returns descriptions of whatever currently uses device_path: mounts, swap and holders.
+
+    Covers filesystems mounted from the device itself, from its partitions or
+    from a loop device backed by it (for image files), active swap on any of
+    those (or a swap file on them), and device-mapper/md devices stacked on
+    top of the device or one of its partitions (/sys/class/block/<dev>/holders).
+    write_verify_device also opens block devices with O_EXCL, so the kernel
+    refuses the test for any other exclusive user this check does not know about.
+    """
+    users = []
+    target = os.path.realpath(device_path)
+    target_name = os.path.basename(target)
+    target_is_block = os.path.exists(target) and stat.S_ISBLK(os.stat(target).st_mode)
+
+    def uses_target(path):
+        path = os.path.realpath(path)
+        loop = get_loop_backing_file(path)
+        backing_file = os.path.realpath(loop[0]) if loop else None
+        return path == target or backing_file == target or (target_is_block and target in get_parent_disk(path))
+
+    try:
+        partitions = psutil.disk_partitions(all=True)
+    except Exception:
+        partitions = []
+    for partition in partitions:
+        if partition.device.startswith("/") and uses_target(partition.device):
+            users.append(f"{partition.device} mounted on {partition.mountpoint}")
+    for swap in get_active_swaps():
+        if uses_target(swap):
+            users.append(f"{swap} (active swap)")
+    sys_dir = f"/sys/class/block/{target_name}"
+    try:
+        partition_names = [entry for entry in os.listdir(sys_dir) if os.path.exists(os.path.join(sys_dir, entry, "partition"))]
+    except OSError:
+        partition_names = []
+    for holders_dir in [os.path.join(sys_dir, "holders")] + [os.path.join(sys_dir, name, "holders") for name in partition_names]:
+        try:
+            for holder in os.listdir(holders_dir):
+                users.append(f"/dev/{holder} (device-mapper/md holder)")
+        except OSError:
+            pass
+    return users
+
+def pwrite_fully(fd, data, offset):
+    """Writes all of data at offset, repeating the write after a short write.
+
+    Raises OSError(EIO) if the device stops accepting data (a write of 0 bytes),
+    so a short write is recorded as a write error instead of going unnoticed.
+    """
+    view = memoryview(data)
+    written = 0
+    while written < len(view):
+        count = os.pwrite(fd, view[written:], offset + written)
+        if count <= 0:
+            raise OSError(errno.EIO, f"Short write: {written} of {len(view)} bytes written at offset {offset}")
+        written += count
+
+def write_verify_device(device_path, patterns=WRITE_TEST_PATTERNS, block_size_kb=1024, limit_gb=None, seed=0,
+                        direct_io=False, confirmed=False, bad_regions_path=None):
+    """Destructive write-read-verify test, in the style of badblocks -w.
+
+    Every pattern (see parse_test_pattern) is written over the whole device (or
+    the first limit_gb), flushed, evicted from the page cache and read back.
+    Each block is compared as a whole buffer against the expected data (a
+    memcmp, not a byte loop); only blocks that differ are compared sector by
+    sector to find the mismatched sectors. Write errors, read errors and
+    mismatches are collected in BadRegionMaps; their union is saved to
+    bad_regions_path if given.
+
+    ALL DATA ON THE DEVICE IS DESTROYED. Refuses to run while the device or one of
+    its partitions is mounted, used as swap or held by another device (see
+    find_device_users), opens block devices with O_EXCL like badblocks -w so the
+    kernel refuses a device that is still in use, and asks the operator to type
+    the device path unless confirmed=True. Works on image files too.
+
+    Returns a summary dict, or None if the test did not run.
+    """
+    report("start", f"\n--- Write-Read-Verify Test for {device_path} ---", operation="write-verify",
+           device_path=device_path, patterns=list(patterns), block_size_kb=block_size_kb)
+    try:
+        pattern_bytes = [parse_test_pattern(pattern) for pattern in patterns]
+    except ValueError as e:
+        report_message("error", f"Invalid test pattern: {e}")
+        return None
+    is_image_file = os.path.isfile(device_path)
+    if os.name != 'nt' and os.geteuid() != 0 and not is_image_file:
+        report_message("error", "The write test requires root/administrator privileges. Please run the script using 'sudo'.")
+        return None
+    if not os.path.exists(device_path):
+        report_message("error", f"Device {device_path} not found.")
+        return None
+    users = find_device_users(device_path)
+    if users:
+        report_message("error", f"Refusing to write to {device_path}: it is in use ({'; '.join(users)}). Unmount it first.")
+        return None
+    if not confirmed:
+        report("detail", f"\nWARNING: This test OVERWRITES EVERY BLOCK of {device_path}"
+                         f"{f' (first {limit_gb} GB)' if limit_gb else ''}. All data on it will be destroyed.")
+        try:
+            answer = input(f"Type the device path ({device_path}) to continue: ").strip()
+        except KeyboardInterrupt:
+            answer = ""
+        if answer != device_path:
+            report_message("info", "Write test cancelled by user.")
+            return None
+
+    block_size_bytes = block_size_kb * 1024
+    write_errors, read_errors, mismatches = BadRegionMap(), BadRegionMap(), BadRegionMap()
+    sector_size = DEFAULT_LOGICAL_SECTOR_SIZE
+    bytes_verified = 0
+    interrupted = False
+    fd = None
+    try:
+        open_flags = os.O_RDWR | getattr(os, 'O_BINARY', 0)
+        if not is_image_file:
+            open_flags |= os.O_EXCL # Block devices: EBUSY while mounted, swapped on or held
+        direct_active = bool(direct_io and hasattr(os, 'O_DIRECT'))
+        try:
+            fd = os.open(device_path, open_flags | (os.O_DIRECT if direct_active else 0))
+        except OSError as e:
+            if e.errno != errno.EBUSY:
+                raise
+            report_message("error", f"Refusing to write to {device_path}: the kernel reports it busy "
+                                    f"(mounted, active swap or held by another device).")
+            return None
+        sector_size = get_logical_sector_size(fd)
+        test_end = os.lseek(fd, 0, os.SEEK_END)
+        if limit_gb:
+            test_end = min(test_end, int(limit_gb * 1024**3))
+        if direct_active:
+            block_size_bytes = max(align_up(block_size_bytes, sector_size), sector_size)
+            test_end = align_down(test_end, sector_size)
+            io_buffer = allocate_aligned_buffer(block_size_bytes)
+        else:
+            io_buffer = bytearray(block_size_bytes)
+        io_view = memoryview(io_buffer)
+        report_message("info", f"Testing {get_human_readable_size(test_end)} with {len(patterns)} pattern(s), "
+                               f"{get_human_readable_size(block_size_bytes)} blocks{', direct I/O' if direct_active else ''}.")
+
+        for pattern, pattern_byte in zip(patterns, pattern_bytes):
+            block_data = make_pattern_block(pattern_byte, 0, block_size_bytes) if pattern_byte is not None else None
+            for phase in ("write", "verify"):
+                start_time = time.time()
+                for offset in range(0, test_end, block_size_bytes):
+                    length = min(block_size_bytes, test_end - offset)
+                    if block_data is not None:
+                        expected = block_data if length == block_size_bytes else block_data[:length]
+                    else:
+                        expected = make_pattern_block(None, offset, length, seed)
+                    if phase == "write":
+                        try:
+                            if direct_active:
+                                io_buffer[:length] = expected
+                                pwrite_fully(fd, io_view[:length], offset)
+                            else:
+                                pwrite_fully(fd, expected, offset)
+                        except OSError as e:
+                            write_errors.add(offset, length)
+                            report_message("error", f"Write error at offset ~{get_human_readable_size(offset)} (pattern {pattern}): {e}",
+                                           newline=True, kind="write", offset=offset, length=length, pattern=pattern)
+                    else:
+                        try:
+                            bytes_read = os.preadv(fd, [io_view[:length]], offset)
+                        except OSError as e:
+                            read_errors.add(offset, length)
+                            report_message("error", f"Read error at offset ~{get_human_readable_size(offset)} (pattern {pattern}): {e}",
+                                           newline=True, kind="read", offset=offset, length=length, pattern=pattern)
+                            continue
+                        actual = io_buffer if bytes_read == block_size_bytes and not direct_active else io_buffer[:bytes_read]
+                        if bytes_read == length and actual == expected:
+                            bytes_verified += length
+                            continue
+                        block_mismatches = mismatched_bytes = 0
+                        for sector_offset in range(0, length, sector_size):
+                            sector_end = min(sector_offset + sector_size, length)
+                            if sector_end > bytes_read or io_buffer[sector_offset:sector_end] != expected[sector_offset:sector_end]:
+                                mismatches.add(offset + sector_offset, sector_end - sector_offset)
+                                block_mismatches += 1
+                                mismatched_bytes += sector_end - sector_offset
+                        bytes_verified += length - mismatched_bytes
+                        report_message("error", f"Data mismatch in {block_mismatches} sector(s) of the block at offset "
+                                                f"~{get_human_readable_size(offset)} (pattern {pattern})",
+                                       newline=True, kind="mismatch", offset=offset, length=length, pattern=pattern)
+                    elapsed_time = time.time() - start_time
+                    done = offset + length
+                    report("progress", f"\r  Pattern {pattern} {phase}: {done / test_end * 100:.2f}% "
+                                       f"({get_human_readable_size(done)}/{get_human_readable_size(test_end)}) | "
+                                       f"Speed: {done / 1024**2 / elapsed_time if elapsed_time > 0 else 0:.2f} MB/s",
+                           end="", final=done == test_end, operation="write-verify", pattern=pattern, phase=phase,
+                           bytes_done=done, bytes_total=test_end)
+                if phase == "write":
+                    os.fsync(fd)
+                    if hasattr(os, 'posix_fadvise'):
+                        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED) # Verify against the media, not the page cache
+                report("detail", "")
+    except KeyboardInterrupt:
+        interrupted = True
+        report_message("info", "Write test interrupted by user (KeyboardInterrupt).", newline=True)
+    except OSError as e:
+        report_message("error", f"Could not test {device_path}: {type(e).__name__} - {e}")
+        return None
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+    bad_regions = write_errors.union(read_errors).union(mismatches)
+    summary_lines = ["\n--- Write Test Summary ---",
+                     f"  Device Tested: {device_path}",
+                     f"  Patterns: {', '.join(patterns)}{' (interrupted)' if interrupted else ''}",
+                     f"  Write Errors: {len(write_errors)} range(s), {get_human_readable_size(write_errors.total_bytes())}",
+                     f"  Read Errors: {len(read_errors)} range(s), {get_human_readable_size(read_errors.total_bytes())}",
+                     f"  Mismatched Data: {len(mismatches)} range(s), {get_human_readable_size(mismatches.total_bytes())}"]
+    for region in bad_regions.format_summary():
+        summary_lines.append(f"    - {region}")
+    if bad_regions_path:
+        try:
+            bad_regions.save(bad_regions_path, device_path=device_path, test="write-verify", patterns=list(patterns),
+                             complete=not interrupted)
+            summary_lines.append(f"  Info: Bad region map saved to '{bad_regions_path}'.")
+        except OSError as e:
+            summary_lines.append(f"  Error: Could not save bad region map to '{bad_regions_path}': {e}")
+    summary_lines.append("-" * 20)
+    report("summary", "\n".join(summary_lines), operation="write-verify", device_path=device_path,
+           write_error_bytes=write_errors.total_bytes(), read_error_bytes=read_errors.total_bytes(),
+           mismatch_bytes=mismatches.total_bytes(), interrupted=interrupted)
+    return {
+        "device_path": device_path,
+        "bytes_verified": bytes_verified,
+        "write_errors": write_errors,
+        "read_errors": read_errors,
+        "mismatches": mismatches,
+        "bad_regions": bad_regions,
+        "sector_size": sector_size,
+        "interrupted": interrupted,
+    }
+
+
+FS_IOC_FIEMAP = 0xC020660B # ioctl: map a file's logical extents to physical device offsets
+FIEMAP_FLAG_SYNC = 0x1 # fm_flags: write out dirty data before mapping
+FIEMAP_EXTENT_LAST = 0x1
+FIEMAP_EXTENT_UNKNOWN = 0x2 # Physical location not known yet (e.g. delayed allocation)
+FIEMAP_EXTENT_DELALLOC = 0x4
+FIEMAP_EXTENT_DATA_INLINE = 0x200 # Data stored inside metadata blocks, no extent of its own
+FIEMAP_HEADER = struct.Struct("=QQIIII") # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved
+FIEMAP_EXTENT = struct.Struct("=QQQQQIIII") # fe_logical, fe_physical, fe_length, 2x reserved, fe_flags, 3x reserved
+FIEMAP_BATCH_EXTENTS = 256
+EXTENT_INDEX_VERSION = 1
+
+def get_file_extents(fd, batch_extents=FIEMAP_BATCH_EXTENTS, fiemap_flags=0):
+    """Returns the physical extents of an open file as (logical, physical, length, flags) tuples.
+
+    Uses the FIEMAP ioctl, fetching batch_extents extents per call until the
+    extent flagged as last. Physical offsets are bytes from the start of the
+    block device holding the filesystem (the partition, not the whole disk).
+    With fiemap_flags=FIEMAP_FLAG_SYNC, dirty data is written out first, so
+    delayed-allocation extents get a physical location.
+    Raises OSError if the platform or filesystem does not support FIEMAP.
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "FIEMAP is not available on this platform")
+    extents = []
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size * batch_extents)
+    next_logical = 0
+    while True:
+        FIEMAP_HEADER.pack_into(request, 0, next_logical, 2**64 - 1 - next_logical, fiemap_flags, 0, batch_extents, 0)
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+        mapped = FIEMAP_HEADER.unpack_from(request, 0)[3]
+        if not mapped:
+            break
+        for index in range(mapped):
+            fields = FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size + index * FIEMAP_EXTENT.size)
+            extents.append((fields[0], fields[1], fields[2], fields[5]))
+        logical, _, length, flags = extents[-1]
+        if flags & FIEMAP_EXTENT_LAST:
+            break
+        next_logical = logical + length
+    return extents
+
+def get_block_device_name(path):
+    """Returns the kernel name (e.g. "sdb1", "dm-0") of the block device holding path, or None."""
+    try:
+        st = os.stat(path)
+        return os.path.basename(os.path.realpath(f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}"))
+    except (OSError, AttributeError):
+        return None
+
+def get_filesystem_offset(scanned_device_path, mount_point):
+    """Returns the byte offset of mount_point's filesystem within scanned_device_path.
+
+    0 if the scan target is the filesystem's own device (or the image file behind
+    its loop device); the partition start from /sys/class/block/<part>/start
+    (in 512-byte units) if the scan target is the partition's parent disk.
+    Returns None if the two are not related in a way sysfs can describe
+    (e.g. a filesystem on LVM or RAID).
+    """
+    fs_device = get_block_device_name(mount_point)
+    if not fs_device:
+        return None
+    fs_sys_path = os.path.join("/sys/class/block", fs_device)
+    scanned_name = os.path.basename(os.path.realpath(scanned_device_path))
+    if scanned_name == fs_device:
+        return 0
+    try:
+        with open(os.path.join(fs_sys_path, "loop", "backing_file")) as f:
+            if os.path.realpath(f.read().strip()) == os.path.realpath(scanned_device_path):
+                return 0
+    except OSError:
+        pass
+    try:
+        parent = os.path.basename(os.path.dirname(os.path.realpath(fs_sys_path)))
+        if os.path.exists(os.path.join(fs_sys_path, "partition")) and parent == scanned_name:
+            with open(os.path.join(fs_sys_path, "start")) as f:
+                return int(f.read().strip()) * 512
+    except (OSError, ValueError):
+        pass
+    return None
+
+def get_filesystem_location(path):
+    """Returns where the filesystem holding path lies: (filesystem_device, disk, partition_offset, sector_size).
+
+    filesystem_device and disk are /dev paths (the same device if the
+    filesystem is not on a partition); partition_offset is the filesystem's
+    byte offset within disk (see get_filesystem_offset) and sector_size the
+    disk's logical sector size, the unit of its LBAs. Unknown values are None
+    (sector_size falls back to DEFAULT_LOGICAL_SECTOR_SIZE).
+    """
+    fs_device = get_block_device_name(path)
+    if not fs_device:
+        return None, None, None, DEFAULT_LOGICAL_SECTOR_SIZE
+    fs_sys_path = os.path.join("/sys/class/block", fs_device)
+    disk = fs_device
+    if os.path.exists(os.path.join(fs_sys_path, "partition")):
+        disk = os.path.basename(os.path.dirname(os.path.realpath(fs_sys_path)))
+    partition_offset = get_filesystem_offset(f"/dev/{disk}", path)
+    sector_size = DEFAULT_LOGICAL_SECTOR_SIZE
+    try:
+        with open(os.path.join("/sys/class/block", disk, "queue", "logical_block_size")) as f:
+            sector_size = int(f.read().strip()) or sector_size
+    except (OSError, ValueError):
+        pass
+    return f"/dev/{fs_device}", f"/dev/{disk}", partition_offset, sector_size
+
+def map_file_ranges_to_physical(extents, file_ranges):
+    """Translates (start, end) file byte ranges to sorted physical (start, end) ranges through FIEMAP extents.
+
+    extents are (logical, physical, length) tuples; parts of file_ranges in
+    holes are dropped.
+    """
+    physical = BadRegionMap()
+    for start, end in file_ranges:
+        for logical, physical_start, length in extents:
+            overlap_start, overlap_end = max(start, logical), min(end, logical + length)
+            if overlap_start < overlap_end:
+                physical.add(physical_start + overlap_start - logical, overlap_end - overlap_start)
+    return physical.ranges()
+
+def record_quarantine_extents(quarantine_dir_path, quarantined):
+    """Records the physical location of quarantined files in the quarantine manifest.
+
+    quarantined is a list of (quarantined_path, original_path, reason,
+    bad_ranges) tuples, bad_ranges being (start, end) file offsets. Each file's
+    extents are read with FIEMAP (FIEMAP_FLAG_SYNC) and stored, together with
+    its bad ranges, as filesystem-relative byte ranges plus LBA ranges of the
+    whole disk (partition offset from sysfs, see get_filesystem_location). All
+    records are appended to QUARANTINE_MANIFEST_NAME with one write, so
+    recording thousands of files costs one open and a few ioctls per file.
+    Files FIEMAP cannot map are skipped. Returns the records written.
+    """
+    fs_device, disk, partition_offset, sector_size = get_filesystem_location(quarantine_dir_path)
+    records = []
+    for quarantined_path, original_path, reason, bad_ranges in quarantined:
+        try:
+            fd = os.open(quarantined_path, os.O_RDONLY)
+            try:
+                extents = [(logical, physical, length) for logical, physical, length, flags
+                           in get_file_extents(fd, fiemap_flags=FIEMAP_FLAG_SYNC)
+                           if not flags & (FIEMAP_EXTENT_UNKNOWN | FIEMAP_EXTENT_DELALLOC | FIEMAP_EXTENT_DATA_INLINE)]
+            finally:
+                os.close(fd)
+        except OSError as e:
+            report_message("warning", f"Could not map the extents of {quarantined_path}: {e}", path=quarantined_path)
+            continue
+        record = {"file": os.path.basename(quarantined_path), "original": os.path.basename(original_path), "reason": reason,
+                  "time": round(time.time(), 3), "filesystem_device": fs_device, "disk": disk,
+                  "partition_offset": partition_offset, "sector_size": sector_size,
+                  "extents": [list(extent) for extent in extents], "bad_ranges": [list(r) for r in bad_ranges],
+                  "bad_physical_ranges": [list(r) for r in map_file_ranges_to_physical(extents, bad_ranges)]}
+        if partition_offset is not None:
+            to_lbas = lambda ranges: [[(partition_offset + start) // sector_size, -(-(partition_offset + end) // sector_size)]
+                                      for start, end in ranges]
+            record["lbas"] = to_lbas((physical, physical + length) for _, physical, length in extents)
+            record["bad_lbas"] = to_lbas(record["bad_physical_ranges"])
+        records.append(record)
+    if records:
+        with open(os.path.join(quarantine_dir_path, QUARANTINE_MANIFEST_NAME), "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+    return records
+
+def load_quarantine_manifest(quarantine_dir_path):
+    """Returns the manifest records of the files still in the quarantine directory, by file name.
+
+    The latest record of a file wins; unreadable lines are skipped.
+    """
+    records = {}
+    try:
+        with open(os.path.join(quarantine_dir_path, QUARANTINE_MANIFEST_NAME)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records[record["file"]] = record
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        return {}
+    return {name: record for name, record in sorted(records.items())
+            if os.path.isfile(os.path.join(quarantine_dir_path, name))}
+
+def find_quarantined_files(quarantine_dir_path, start, end, device_path=None, lba=False, sector_size=None):
+    """Lists the quarantined files whose extents overlap device bytes [start, end).
+
+    Offsets are relative to the whole disk, or to the filesystem's own device
+    when device_path names it (e.g. a scan of /dev/sdb1 rather than /dev/sdb).
+    With lba=True, start and end are LBAs, converted with the logical sector
+    size stored in each record (512 or 4096 bytes) unless sector_size
+    overrides it. Returns a list of (file name, [(start, end), ...] overlapping
+    device byte ranges, record) tuples, in file name order.
+    """
+    device = os.path.realpath(device_path) if device_path else None
+    lba_start, lba_end = start, end
+    matches = []
+    for name, record in load_quarantine_manifest(quarantine_dir_path).items():
+        if lba:
+            unit = sector_size or record.get("sector_size") or DEFAULT_LOGICAL_SECTOR_SIZE
+            start, end = lba_start * unit, lba_end * unit
+        if device and record.get("filesystem_device") and device == os.path.realpath(record["filesystem_device"]):
+            base = 0
+        elif record.get("partition_offset") is not None:
+            base = record["partition_offset"]
+        else:
+            continue # Location within the disk unknown
+        overlaps = [(max(start, base + physical), min(end, base + physical + length))
+                    for _, physical, length in record["extents"]
+                    if base + physical < end and base + physical + length > start]
+        if overlaps:
+            matches.append((name, overlaps, record))
+    return matches
+
+def locate_quarantined_files(quarantine_dir_path, start, end, device_path=None, lba=False, sector_size=None):
+    """Prints which quarantined files cover device bytes [start, end) (see find_quarantined_files).
+
+    With lba=True, start and end are LBAs in each record's sector size, or in
+    sector_size if given.
+    """
+    print(f"\n--- Quarantined Files Covering Device {'LBAs' if lba else 'Bytes'} {start}-{end} ---")
+    if not os.path.exists(quarantine_dir_path):
+        print(f"  Error: Quarantine directory '{quarantine_dir_path}' not found.")
+        return None
+    matches = find_quarantined_files(quarantine_dir_path, start, end, device_path, lba=lba, sector_size=sector_size)
+    if not matches:
+        print("  No quarantined file covers this range.")
+    for name, overlaps, record in matches:
+        unit = record.get("sector_size") or DEFAULT_LOGICAL_SECTOR_SIZE
+        bad = record.get("bad_lbas")
+        print(f"  - {name}: {get_human_readable_size(sum(e - s for s, e in overlaps))} in range "
+              f"(LBAs {', '.join(f'{s // unit}-{-(-e // unit) - 1}' for s, e in overlaps[:5])}{' ...' if len(overlaps) > 5 else ''})"
+              f"{f'; bad LBAs ' + ', '.join(f'{s}-{e - 1}' for s, e in bad[:5]) if bad else ''}. Reason: {record.get('reason')}")
+    return matches
+
+def open_extent_index(index_path):
+    """Opens (creating if needed) the SQLite extent index and returns the connection."""
+    connection = sqlite3.connect(index_path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, inode INTEGER,
+                                          size INTEGER, ctime_ns INTEGER, generation INTEGER);
+        CREATE TABLE IF NOT EXISTS extents (file_id INTEGER, logical INTEGER, physical_start INTEGER, physical_end INTEGER);
+        CREATE INDEX IF NOT EXISTS extents_by_physical ON extents (physical_start);
+        CREATE INDEX IF NOT EXISTS extents_by_file ON extents (file_id);
+    """)
+    return connection
+
+def build_extent_index(mount_point, index_path, batch_size=1000):
+    """Builds or refreshes an on-disk index of the physical extents of every file under mount_point.
+
+    The tree is walked with os.scandir without crossing into other filesystems,
+    and each regular file's extents are read with FIEMAP. Rows are written to a
+    SQLite database in batches, so memory use does not grow with the number of
+    files. A file whose inode, size and ctime are unchanged since the last build
+    keeps its cached extents, which makes refreshing an existing index mostly a
+    directory walk. Files that disappeared are dropped at the end.
+
+    Returns a dict with counters: files, mapped, reused, failed, removed.
+    Raises OSError if mount_point cannot be read.
+    """
+    root_dev = os.stat(mount_point).st_dev
+    connection = open_extent_index(index_path)
+    meta = dict(connection.execute("SELECT key, value FROM meta"))
+    if meta.get("version") != str(EXTENT_INDEX_VERSION) or meta.get("st_dev") != str(root_dev):
+        connection.execute("DELETE FROM extents") # Different filesystem or format: start over
+        connection.execute("DELETE FROM files")
+    generation = int(meta.get("generation", 0)) + 1
+    counters = {"files": 0, "mapped": 0, "reused": 0, "failed": 0, "removed": 0}
+    pending_dirs = [mount_point]
+    try:
+        while pending_dirs:
+            directory = pending_dirs.pop()
+            try:
+                entries = os.scandir(directory)
+            except OSError as e:
+                print(f"  Warning: Could not list '{directory}'. {type(e).__name__}: {e}")
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.stat(follow_symlinks=False).st_dev == root_dev:
+                                pending_dirs.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        counters["failed"] += 1
+                        continue
+                    counters["files"] += 1
+                    row = connection.execute("SELECT id, inode, size, ctime_ns FROM files WHERE path = ?", (entry.path,)).fetchone()
+                    if row and row[1:] == (st.st_ino, st.st_size, st.st_ctime_ns):
+                        connection.execute("UPDATE files SET generation = ? WHERE id = ?", (generation, row[0]))
+                        counters["reused"] += 1
+                    else:
+                        try:
+                            fd = os.open(entry.path, os.O_RDONLY)
+                            try:
+                                extents = get_file_extents(fd)
+                            finally:
+                                os.close(fd)
+                        except OSError:
+                            counters["failed"] += 1
+                            continue
+                        if row:
+                            connection.execute("DELETE FROM extents WHERE file_id = ?", (row[0],))
+                            connection.execute("DELETE FROM files WHERE id = ?", (row[0],))
+                        file_id = connection.execute(
+                            "INSERT INTO files (path, inode, size, ctime_ns, generation) VALUES (?, ?, ?, ?, ?)",
+                            (entry.path, st.st_ino, st.st_size, st.st_ctime_ns, generation)).lastrowid
+                        connection.executemany(
+                            "INSERT INTO extents (file_id, logical, physical_start, physical_end) VALUES (?, ?, ?, ?)",
+                            [(file_id, logical, physical, physical + length) for logical, physical, length, flags in extents
+                             if not flags & (FIEMAP_EXTENT_UNKNOWN | FIEMAP_EXTENT_DELALLOC | FIEMAP_EXTENT_DATA_INLINE)])
+                        counters["mapped"] += 1
+                    if counters["files"] % batch_size == 0:
+                        connection.commit()
+                        print(f"\r  Indexing: {counters['files']} files ({counters['reused']} unchanged)", end="")
+
+        counters["removed"] = connection.execute("SELECT COUNT(*) FROM files WHERE generation != ?", (generation,)).fetchone()[0]
+        connection.execute("DELETE FROM extents WHERE file_id IN (SELECT id FROM files WHERE generation != ?)", (generation,))
+        connection.execute("DELETE FROM files WHERE generation != ?", (generation,))
+        longest_extent = connection.execute("SELECT MAX(physical_end - physical_start) FROM extents").fetchone()[0] or 0
+        connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               [("version", str(EXTENT_INDEX_VERSION)), ("st_dev", str(root_dev)),
+                                ("mount_point", os.path.abspath(mount_point)), ("generation", str(generation)),
+                                ("longest_extent", str(longest_extent)), ("built_at", str(time.time()))])
+        connection.commit()
+    finally:
+        connection.close()
+    if counters["files"] >= batch_size:
+        print()
+    return counters
+
+def find_files_in_ranges(index_path, ranges):
+    """Looks up the files whose extents overlap the given filesystem-relative byte ranges.
+
+    Returns a dict mapping file path to a sorted list of (file_start, file_end)
+    byte ranges of that file which lie inside the given ranges.
+    """
+    connection = sqlite3.connect(index_path)
+    try:
+        row = connection.execute("SELECT value FROM meta WHERE key = 'longest_extent'").fetchone()
+        longest_extent = int(row[0]) if row else 0
+        affected = {}
+        for start, end in ranges:
+            # Extents are indexed by start; no extent starting before start - longest_extent can reach start.
+            for path, logical, physical_start, physical_end in connection.execute(
+                    "SELECT f.path, e.logical, e.physical_start, e.physical_end FROM extents e JOIN files f ON f.id = e.file_id "
+                    "WHERE e.physical_start >= ? AND e.physical_start < ? AND e.physical_end > ?",
+                    (start - longest_extent, end, start)):
+                overlap_start, overlap_end = max(start, physical_start), min(end, physical_end)
+                affected.setdefault(path, []).append((logical + overlap_start - physical_start, logical + overlap_end - physical_start))
+    finally:
+        connection.close()
+    return {path: sorted(file_ranges) for path, file_ranges in sorted(affected.items())}
+
+def map_bad_regions_to_files(region_files, mount_point, index_path=None, device_path=None,
+                             partition_offset=None, refresh_index=True):
+    """Lists the files of a mounted filesystem that occupy the bad regions found by a scan.
+
+    region_files are region maps saved by scan_disk, with offsets relative to the
+    scanned device (device_path, taken from the file header if not given). They
+    are translated to filesystem-relative offsets using partition_offset, or the
+    partition start from sysfs (see get_filesystem_offset), and matched against
+    the extent index at index_path (default: dsk_scan_<mount>.extents.sqlite),
+    which is refreshed first unless refresh_index is False.
+
+    Returns a dict mapping affected file paths to lists of (file_start, file_end)
+    byte ranges, or None if the mapping could not be done.
+    """
+    print(f"\n--- Mapping Bad Regions to Files on {mount_point} ---")
+    regions = BadRegionMap()
+    for region_file in region_files:
+        try:
+            loaded, header = BadRegionMap.load(region_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  Error: Could not load region file '{region_file}'. {type(e).__name__}: {e}")
+            return None
+        device_path = device_path or header.get("device_path")
+        regions = regions.union(loaded)
+    if not regions:
+        print("  Info: No bad regions to map.")
+        return {}
+
+    if partition_offset is None:
+        if not device_path:
+            print("  Error: The scanned device is unknown; pass it explicitly or give a partition offset.")
+            return None
+        partition_offset = get_filesystem_offset(device_path, mount_point)
+        if partition_offset is None:
+            print(f"  Error: Could not find where the filesystem on {mount_point} starts within {device_path}.\n"
+                  f"         Give the partition offset explicitly.")
+            return None
+    print(f"  Info: Filesystem starts at byte {partition_offset} of {device_path or 'the scanned device'}.")
+
+    fs_ranges = []
+    outside_bytes = 0
+    for start, end in regions:
+        if end <= partition_offset:
+            outside_bytes += end - start
+            continue
+        outside_bytes += max(partition_offset - start, 0)
+        fs_ranges.append((max(start, partition_offset) - partition_offset, end - partition_offset))
+    if outside_bytes:
+        print(f"  Info: {get_human_readable_size(outside_bytes)} of bad regions lie before the filesystem start.")
+
+    index_path = index_path or get_default_scan_file_path(mount_point, "extents.sqlite")
+    if refresh_index or not os.path.exists(index_path):
+        print(f"  Info: Refreshing extent index '{index_path}'...")
+        try:
+            counters = build_extent_index(mount_point, index_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"  Error: Could not build the extent index. {type(e).__name__}: {e}")
+            return None
+        print(f"  Info: Indexed {counters['files']} files ({counters['mapped']} mapped, {counters['reused']} unchanged, "
+              f"{counters['removed']} removed, {counters['failed']} unreadable).")
+    try:
+        affected = find_files_in_ranges(index_path, fs_ranges)
+    except sqlite3.Error as e:
+        print(f"  Error: Could not query the extent index '{index_path}'. {type(e).__name__}: {e}")
+        return None
+
+    print(f"\n--- Affected Files ({len(affected)}) ---")
+    if not affected:
+        print("  No file data lies in the bad regions (they are free space or filesystem metadata).")
+    for path, file_ranges in affected.items():
+        bad_bytes = sum(end - start for start, end in file_ranges)
+        print(f"  - {path}: {get_human_readable_size(bad_bytes)} affected, "
+              f"file offsets {', '.join(f'{start}-{end}' for start, end in file_ranges[:5])}"
+              f"{' ...' if len(file_ranges) > 5 else ''}")
+    return affected
+
+
+def main(argv=None):
+    """Main function to parse arguments and dispatch actions."""
+    parser = argparse.ArgumentParser(
+        description="DeadSectorKiller: A utility to list disks, check S.M.A.R.T. status, and scan for bad sectors.",
+        formatter_class=argparse.RawTextHelpFormatter # Allows for better formatting of help text
+    )
+    parser.add_argument('--version', action='version', version='%(prog)s 0.1.0') # Example version
+
+    action_group = parser.add_mutually_exclusive_group()
+    action_group.add_argument("--list-disks", "-l", action="store_true",
+                              help="List available disk partitions and potential raw physical devices.\nProvides an overview of storage devices and their mountpoints.")
     action_group.add_argument("--smart", "-s", metavar="DEVICE_PATH", type=str,
                               help="Retrieve S.M.A.R.T. information for the specified device.\nExample: /dev/sda (Linux), \\\\.\\PhysicalDrive0 (Windows).")
-    action_group.add_argument("--scan", "-c", metavar="DEVICE_PATH", type=str,
-                              help="Scan the specified device for readable sectors. Requires sudo/admin.\nExample: /dev/sda (Linux), \\\\.\\PhysicalDrive0 (Windows).")
+    action_group.add_argument("--scan", "-c", metavar="DEVICE_PATH", type=str, nargs="+",
+                              help="Scan the specified device(s) for readable sectors. Requires sudo/admin.\nSeveral devices (or 'all' for every detected raw device) are scanned in parallel,\nserializing targets that share a physical disk.\nExample: /dev/sda (Linux), \\\\.\\PhysicalDrive0 (Windows).")
     action_group.add_argument("--isolate-sectors", "-is", metavar="TARGET_PATH", type=str,
                               help="Isolate sectors for the target filesystem path.\nExample: /mnt/data (Linux), C:\\ (Windows).")
     action_group.add_argument("--manage-quarantine", "-mq", metavar="TARGET_PATH", type=str,
                               help="Manage files in the quarantine directory for the given target path.\nExample: /mnt/data (Linux), C:\\.")
+    action_group.add_argument("--map-files", metavar="REGIONS_FILE", type=str, nargs="+",
+                              help="List the files on --mountpoint that occupy the bad regions saved by an earlier --scan.\n"
+                                   "Builds (or refreshes) an on-disk extent index of the filesystem with FIEMAP. Linux only.")
+    action_group.add_argument("--write-test", metavar="DEVICE_PATH", type=str,
+                              help="DESTRUCTIVE: write test patterns over the device or image file, read them back and compare\n"
+                                   "(like badblocks -w). Refuses mounted devices and asks you to type the device path.")
 
     # Sub-parsers for --manage-quarantine
     # Note: Keep this after the main parser and action_group are defined.
@@ -670,6 +3866,20 @@ def main(argv=None):
     parser_list_quarantine = subparsers.add_parser("list", help="List files currently in the quarantine directory.")
     # No arguments for list
 
+    # Locate sub-command
+    parser_locate_quarantine = subparsers.add_parser("locate", help="Show which quarantined files cover a range of device offsets.")
+    parser_locate_quarantine.add_argument("start", type=int, help="First byte (or LBA with --lba) of the range on the device.")
+    parser_locate_quarantine.add_argument("end", type=int, nargs="?", default=None,
+                                          help="End of the range (exclusive). Default: just the start byte or LBA.")
+    parser_locate_quarantine.add_argument("--lba", action="store_true",
+                                          help="Interpret start and end as LBAs (e.g. from a SMART error log) instead of bytes.")
+    parser_locate_quarantine.add_argument("--sector-size", type=int, default=None,
+                                          help="LBA size in bytes for --lba. Default: the logical sector size recorded\n"
+                                               "for each quarantined file's disk.")
+    parser_locate_quarantine.add_argument("--device", metavar="DEVICE_PATH", type=str, default=None,
+                                          help="Device the offsets refer to. Default: the whole disk; give the partition\n"
+                                               "(e.g. /dev/sdb1) if the offsets come from a scan of the partition.")
+
     # Delete sub-command
     parser_delete_quarantine = subparsers.add_parser("delete", help="Delete specific or all files from the quarantine directory.")
     delete_group = parser_delete_quarantine.add_mutually_exclusive_group(required=False) # Becomes required if no filename/all logic fails
@@ -682,16 +3892,120 @@ def main(argv=None):
     # Arguments specific to --isolate-sectors
     parser.add_argument("--filler-file-size-mb", metavar="SIZE_MB", type=int, default=100,
                         help="Size of individual filler files in Megabytes for --isolate-sectors. Default: 100 MB.")
+    parser.add_argument("--writers", metavar="N", type=int, default=1,
+                        help="Number of filler files --isolate-sectors writes concurrently. Raise it for RAID arrays\nand NVMe drives that one writer cannot saturate. Default: 1.")
     parser.add_argument("--fill-percentage", metavar="PERCENT", type=int, default=80, choices=range(1, 101),
                         help="Percentage of free space to fill with filler files for --isolate-sectors. Default: 80%% (1-100).")
+    parser.add_argument("--max-unverified-mb", metavar="MB", type=float, default=1024,
+                        help="For --isolate-sectors, pause the fill while this much written data is still waiting\nto be read back. Default: 1024 MB.")
+    parser.add_argument("--cold-read", action="store_true",
+                        help="For --isolate-sectors, read filler files back from the disk itself (O_DIRECT, or\nfdatasync plus dropping the file's cached pages) instead of the page cache.")
+    parser.add_argument("--quarantine-margin-kb", metavar="KB", type=int, default=QUARANTINE_MARGIN_BYTES // 1024,
+                        help="For --isolate-sectors, how much space to keep allocated on each side of a bad range\n"
+                             f"when shrinking a quarantined file. Default: {QUARANTINE_MARGIN_BYTES // 1024} KB.")
+    parser.add_argument("--keep-whole-bad-files", action="store_true",
+                        help="For --isolate-sectors, keep each quarantined filler file at full size instead of\n"
+                             "releasing everything but its bad ranges.")
+    parser.add_argument("--hold-verified", action="store_true",
+                        help="For --isolate-sectors, keep healthy filler files until the fill finishes instead of\ndeleting each one as soon as it verifies, so later files cannot reuse their space.")
 
     parser.add_argument("--block-size", "-bs", type=int, default=64,
                         help="Block size in KB for disk scan. Default: 64 KB.")
     parser.add_argument("--limit-gb", "-lim", type=float, default=None,
                         help="Limit the scan to a certain number of GB from the beginning of the disk.\nDefault: Full disk scan.")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="On a read error, bisect the failing block down to the logical sector size\nto record the exact unreadable sectors. Pair with a large --block-size.")
+    parser.add_argument("--max-parallel-devices", metavar="N", type=int, default=None,
+                        help="With several --scan devices, scan at most N physical disks at once.\nDefault: all disks in parallel.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of concurrent reader threads for --scan (positional reads).\nRaise for NVMe/SAN devices that need queue depth > 1. Default: 1.")
+    parser.add_argument("--checkpoint-file", metavar="PATH", type=str, default=None,
+                        help="Where --scan periodically saves its progress.\nDefault: dsk_scan_<device>.checkpoint.json in the current directory.")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="Do not write scan checkpoint files.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume an interrupted --scan from its checkpoint file. Refuses to run if the\ndevice size or identity changed since the checkpoint was written.")
+    parser.add_argument("--bad-regions-file", metavar="PATH", type=str, default=None,
+                        help="Where --scan saves its bad region map (JSON lines).\nDefault: dsk_scan_<device>.badregions.jsonl in the current directory.")
+    parser.add_argument("--slow-regions-file", metavar="PATH", type=str, default=None,
+                        help="Where --scan saves its slow region map (JSON lines).\nDefault: dsk_scan_<device>.slowregions.jsonl next to\n--bad-regions-file, or in the current directory.")
+    parser.add_argument("--merge-gap-kb", metavar="KB", type=int, default=0,
+                        help="Coalesce bad regions separated by less than this many KB. Default: 0 (adjacent only).")
+    parser.add_argument("--slow-ms", metavar="MS", type=int, default=DEFAULT_SLOW_THRESHOLD_MS,
+                        help=f"Report blocks whose read takes at least MS milliseconds as slow regions.\nDefault: {DEFAULT_SLOW_THRESHOLD_MS} ms.")
+    parser.add_argument("--sample", metavar="FRACTION_OR_BLOCKS", type=float, default=None,
+                        help="Quick scan: read only a stratified random sample of blocks spread over the whole device.\n"
+                             "A value <= 1 is a fraction of all blocks (e.g. 0.01), a larger value a block count.\n"
+                             "Reports the estimated bad block density with a 95%% confidence interval.")
+    parser.add_argument("--max-seconds", metavar="SECONDS", type=float, default=None,
+                        help="Time budget for a quick scan. Sampling refines coverage in passes until time runs out.\nImplies quick-scan mode.")
+    parser.add_argument("--rescan", metavar="REGIONS_FILE", type=str, nargs="+", default=None,
+                        help="With --scan DEVICE: reread only the regions listed in earlier bad/slow region files\n"
+                             "(plus --margin-kb around each) and report which are now readable, still bad or new.")
+    parser.add_argument("--margin-kb", metavar="KB", type=int, default=1024,
+                        help="Margin around each region for --rescan. Default: 1024 KB.")
+    parser.add_argument("--max-mb-s", metavar="MB_S", type=float, default=None,
+                        help="Cap the scan's read bandwidth in MB/s (lowers the scan's I/O priority too).")
+    parser.add_argument("--max-iops", metavar="IOPS", type=float, default=None,
+                        help="Cap the scan's read operations per second.")
+    parser.add_argument("--adaptive-throttle", action="store_true",
+                        help="Slow down or pause the scan while other processes load the same disk\n(watches system-wide latency and utilisation via psutil).")
+    parser.add_argument("--retries", metavar="N", type=int, default=0,
+                        help="Retry a failing block N times before recording it as bad. Default: 0.")
+    parser.add_argument("--max-skip-mb", metavar="MB", type=float, default=None,
+                        help="Skip ahead after consecutive read errors, doubling the distance each time up to MB,\n"
+                             "then read the skipped areas in a second pass. Crosses dead zones quickly.")
+    parser.add_argument("--no-second-pass", action="store_true",
+                        help="With --max-skip-mb, leave the skipped areas unread (they are listed in the summary).")
+    parser.add_argument("--read-timeout", metavar="SECONDS", type=float, default=None,
+                        help="Give up on reads stalled longer than SECONDS and record them as timeouts,\n"
+                             "so a scan of dying hardware stays time-bounded.")
+    parser.add_argument("--read-holes", action="store_true",
+                        help="Read the holes of sparse image files (and of loop devices backed by them) too.\n"
+                             "By default --scan reads only their allocated extents.")
+    parser.add_argument("--fingerprint", action="store_true",
+                        help="Also hash the data read by --scan per region (BLAKE2b) and save the fingerprints\n"
+                             "(default file: dsk_scan_<device>.fingerprints.jsonl in the current directory).")
+    parser.add_argument("--fingerprint-file", metavar="PATH", type=str, default=None,
+                        help="Where --fingerprint saves the fingerprints of a single-device scan.")
+    parser.add_argument("--fingerprint-region-mb", metavar="MB", type=float, default=DEFAULT_FINGERPRINT_REGION_MB,
+                        help=f"Region size for --fingerprint. Default: {DEFAULT_FINGERPRINT_REGION_MB} MB.")
+    parser.add_argument("--compare-fingerprints", metavar="PATH", type=str, default=None,
+                        help="Fingerprint the --scan and report regions whose content changed since the scan that\n"
+                             "saved PATH (silent corruption on disks that were not written to). PATH is not overwritten.")
+    parser.add_argument("--mountpoint", metavar="PATH", type=str, default=None,
+                        help="Mounted filesystem on the scanned device, for --map-files.")
+    parser.add_argument("--extent-index", metavar="PATH", type=str, default=None,
+                        help="Extent index file for --map-files.\nDefault: dsk_scan_<mountpoint>.extents.sqlite in the current directory.")
+    parser.add_argument("--reuse-index", action="store_true",
+                        help="With --map-files, query an existing extent index without refreshing it first.")
+    parser.add_argument("--partition-offset", metavar="BYTES", type=int, default=None,
+                        help="Byte offset of the filesystem within the scanned device, for --map-files.\nDefault: read the partition start from sysfs.")
+    parser.add_argument("--patterns", metavar="PATTERN", type=str, nargs="+", default=list(WRITE_TEST_PATTERNS),
+                        help="Patterns for --write-test: byte values such as 0xaa, or 'random' for seeded pseudo-random data.\n"
+                             f"Default: {' '.join(WRITE_TEST_PATTERNS)}.")
+    parser.add_argument("--pattern-seed", metavar="SEED", type=int, default=None,
+                        help="Seed for the 'random' --write-test pattern (default: 0) and for the content of\n"
+                             "--isolate-sectors filler files (default: a new random seed each run).")
+    parser.add_argument("--confirm-device", metavar="DEVICE_PATH", type=str, default=None,
+                        help="Skip the --write-test confirmation prompt. Must repeat the --write-test device path exactly.")
+    parser.add_argument("--output", choices=("text", "jsonl"), default="text",
+                        help="Output format. 'jsonl' writes one JSON event per line to stdout (start, progress, error,\n"
+                             "file-created, file-checked, file-quarantined, summary, ...); other messages go to stderr.\nDefault: text.")
+    parser.add_argument("--direct-io", action="store_true",
+                        help="Scan with O_DIRECT reads into a reused aligned buffer, bypassing the page cache.\nBlock size and limit are aligned to the logical sector size. Linux only; falls back to buffered reads.\n"
+                             "With --isolate-sectors, filler files are written with O_DIRECT so every write reaches the disk.")
+    parser.add_argument("--sync-every-mb", metavar="MB", type=float, default=None,
+                        help="With --isolate-sectors, fdatasync each filler file every MB megabytes and when it is complete,\n"
+                             "so write errors surface during the fill. Default: no explicit syncs.")
 
     args = parser.parse_args(argv)
 
+    reporter_stdout, previous_reporter = sys.stdout, get_reporter()
+    if args.output == "jsonl":
+        # Structured events go to stdout; anything still printed directly goes to stderr.
+        set_reporter(JsonlReporter(reporter_stdout))
+        sys.stdout = sys.stderr
     try:
         if args.list_disks:
             list_disk_partitions_and_devices()
@@ -706,7 +4020,65 @@ def main(argv=None):
                 print("Error: --scan option requires a device path.")
                 parser.print_help()
                 sys.exit(1)
-            scan_disk(args.scan, args.block_size, args.limit_gb)
+            scan_kwargs = dict(block_size_kb=args.block_size, scan_limit_gb=args.limit_gb, direct_io=args.direct_io,
+                               adaptive=args.adaptive, jobs=args.jobs, checkpoint=not args.no_checkpoint,
+                               resume=args.resume, bad_region_merge_gap=args.merge_gap_kb * 1024,
+                               slow_threshold_ms=args.slow_ms, max_seconds=args.max_seconds,
+                               sample_fraction=args.sample if args.sample is not None and args.sample <= 1 else None,
+                               sample_blocks=int(args.sample) if args.sample is not None and args.sample > 1 else None,
+                               max_mb_s=args.max_mb_s, max_iops=args.max_iops, adaptive_throttle=args.adaptive_throttle,
+                               retries=args.retries, max_skip_kb=int(args.max_skip_mb * 1024) if args.max_skip_mb else None,
+                               second_pass=not args.no_second_pass, read_timeout_s=args.read_timeout,
+                               fingerprint_region_mb=args.fingerprint_region_mb if args.fingerprint or args.compare_fingerprints else None,
+                               skip_holes=False if args.read_holes else None)
+            device_paths = args.scan
+            if device_paths == ["all"]:
+                device_paths = identify_raw_devices()
+                if not device_paths:
+                    print("Error: No raw physical devices identified for '--scan all'. Specify device paths manually.")
+                    sys.exit(1)
+            if args.rescan:
+                if len(device_paths) != 1:
+                    print("Error: --rescan works on a single --scan device.")
+                    sys.exit(1)
+                for key in ("checkpoint", "resume", "block_size_kb", "adaptive", "max_seconds", "sample_fraction", "sample_blocks",
+                            "fingerprint_region_mb"):
+                    scan_kwargs.pop(key)
+                rescan_regions(device_paths[0], args.rescan, margin_kb=args.margin_kb, block_size_kb=args.block_size,
+                               bad_regions_path=args.bad_regions_file or get_default_scan_file_path(device_paths[0], "rescan.badregions.jsonl"),
+                               **scan_kwargs)
+            elif len(device_paths) == 1:
+                fingerprints_path = None
+                if scan_kwargs["fingerprint_region_mb"]:
+                    fingerprints_path = args.fingerprint_file or get_default_scan_file_path(device_paths[0], "fingerprints.jsonl")
+                    if args.compare_fingerprints and os.path.abspath(fingerprints_path) == os.path.abspath(args.compare_fingerprints):
+                        fingerprints_path = None # Keep the baseline
+                scan_disk(device_paths[0], checkpoint_path=args.checkpoint_file,
+                          fingerprints_path=fingerprints_path, compare_fingerprints_path=args.compare_fingerprints,
+                          bad_regions_path=args.bad_regions_file or get_default_scan_file_path(device_paths[0], "badregions.jsonl"),
+                          slow_regions_path=args.slow_regions_file or os.path.join(os.path.dirname(args.bad_regions_file or ""),
+                                                                                   get_default_scan_file_path(device_paths[0], "slowregions.jsonl")),
+                          **scan_kwargs)
+            elif args.checkpoint_file or args.bad_regions_file or args.slow_regions_file or args.fingerprint_file or args.compare_fingerprints:
+                print("Error: --checkpoint-file, --bad-regions-file, --slow-regions-file, --fingerprint-file and --compare-fingerprints "
+                      "can only be used when scanning a single device.")
+                sys.exit(1)
+            else:
+                scan_devices(device_paths, max_parallel=args.max_parallel_devices, results_dir=".", **scan_kwargs)
+        elif args.map_files:
+            if not args.mountpoint:
+                print("Error: --map-files requires --mountpoint.")
+                sys.exit(1)
+            if map_bad_regions_to_files(args.map_files, args.mountpoint, index_path=args.extent_index,
+                                        partition_offset=args.partition_offset, refresh_index=not args.reuse_index) is None:
+                sys.exit(1)
+        elif args.write_test:
+            summary = write_verify_device(args.write_test, patterns=args.patterns, block_size_kb=args.block_size,
+                                          limit_gb=args.limit_gb, seed=args.pattern_seed or 0, direct_io=args.direct_io,
+                                          confirmed=args.confirm_device == args.write_test,
+                                          bad_regions_path=args.bad_regions_file or get_default_scan_file_path(args.write_test, "writetest.badregions.jsonl"))
+            if summary is None:
+                sys.exit(1)
         elif args.manage_quarantine:
             # This block will be chosen if -mq is present.
             # args.manage_quarantine will hold the TARGET_PATH for -mq.
@@ -719,6 +4091,10 @@ def main(argv=None):
 
             if args.quarantine_action == "list":
                 list_quarantine_files(quarantine_dir_path)
+            elif args.quarantine_action == "locate":
+                end = args.end if args.end is not None else args.start + 1
+                locate_quarantined_files(quarantine_dir_path, args.start, end, device_path=args.device,
+                                         lba=args.lba, sector_size=args.sector_size)
             elif args.quarantine_action == "delete":
                 if not args.filename and not args.all:
                     print("Error: For 'delete' action, you must specify --filename or --all.")
@@ -731,7 +4107,7 @@ def main(argv=None):
                 # This case should ideally be handled by argparse if subparsers are required.
                 # If -mq is given but no sub-command (list/delete), argparse might error or print help.
                 # If it reaches here, it means -mq was given but no valid sub-command.
-                print(f"Error: No valid action (list, delete) specified for --manage-quarantine.")
+                print(f"Error: No valid action (list, locate, delete) specified for --manage-quarantine.")
                 # Attempt to print help for the main parser, which should show subcommands.
                 parser.print_help()
                 sys.exit(1)
@@ -783,77 +4159,79 @@ def main(argv=None):
                 sys.exit(0)
             # ---- End of Confirmation ----
 
-            created_files, write_errors = fill_free_space(
+            pattern_seed = args.pattern_seed if args.pattern_seed is not None else random.getrandbits(32)
+            healthy_files, bad_files_with_errors, released_files = fill_and_verify(
                 filesystem_path=args.isolate_sectors,
                 quarantine_dir_path=quarantine_dir,
-                    filler_file_size_mb=args.filler_file_size_mb,
-                    fill_percentage=args.fill_percentage
-                )
-
-            # Initialize lists for integrity check results
-            healthy_files = []
-            bad_files_with_errors = []
-
-            # Add files that had write errors directly to bad_files_with_errors
-            for err_file, err_msg in write_errors:
-                bad_files_with_errors.append((err_file, f"Failed during creation: {err_msg}"))
-
-            if created_files:
-                print("\n--- Starting Integrity Check for Successfully Created Filler Files ---")
-                for f_path in created_files:
-                    # Skip check if file was already marked bad due to write error, though
-                    # `created_files` should ideally not contain them if `fill_free_space`
-                    # excludes them from its `created_files_list` upon error.
-                    # Assuming `created_files` are those believed to be successfully written.
-                    is_ok, message = check_file_integrity(f_path)
-                    if is_ok:
-                        healthy_files.append(f_path)
-                    else:
-                        bad_files_with_errors.append((f_path, message))
-            
-            print("\n--- Integrity Check Summary ---")
+                filler_file_size_mb=args.filler_file_size_mb,
+                fill_percentage=args.fill_percentage,
+                max_unverified_mb=args.max_unverified_mb,
+                release_healthy=not args.hold_verified,
+                cold_read=args.cold_read,
+                pattern_seed=pattern_seed,
+                direct_io=args.direct_io,
+                sync_interval_mb=args.sync_every_mb,
+                writers=args.writers
+            )
+
+            summary_lines = ["\n--- Integrity Check Summary ---"]
             if healthy_files:
-                print(f"  Healthy files ({len(healthy_files)}):")
-                for f_path in healthy_files:
-                    print(f"    - {f_path}")
+                summary_lines.append(f"  Healthy files ({len(healthy_files)}):")
+                summary_lines.extend(f"    - {f_path}" for f_path in healthy_files)
             else:
-                print("  No healthy filler files found or created.")
+                summary_lines.append("  No healthy filler files found or created.")
 
+            mismatched_files = [f_path for f_path, err_msg in bad_files_with_errors if err_msg.startswith(MISMATCH_MESSAGE_PREFIX)]
             if bad_files_with_errors:
-                print(f"\n  Bad or Errored files ({len(bad_files_with_errors)}):")
-                for f_path, err_msg in bad_files_with_errors:
-                    print(f"    - File: {f_path}, Error: {err_msg}")
+                summary_lines.append(f"\n  Bad or Errored files ({len(bad_files_with_errors)}):")
+                summary_lines.extend(f"    - File: {f_path}, Error: {err_msg}" for f_path, err_msg in bad_files_with_errors)
+                summary_lines.append(f"  Read or write errors: {len(bad_files_with_errors) - len(mismatched_files)}, "
+                                     f"data mismatches (read back without errors, but wrong): {len(mismatched_files)}")
             else:
-                print("  No bad or errored files identified (this includes files that failed during creation).")
+                summary_lines.append("  No bad or errored files identified (this includes files that failed during creation).")
+            # Per-file results were already reported as file-checked events.
+            report("summary", "\n".join(summary_lines), operation="check", healthy_files=len(healthy_files),
+                   bad_files=len(bad_files_with_errors), mismatched_files=len(mismatched_files))
 
             # --- Process Filler Files (Retention/Deletion) ---
-            print("\n--- Processing Filler Files (Retention/Deletion) ---") # Added explicit print here
+            # Healthy files released by the pipeline are already gone.
+            released = set(released_files)
             retained_info, deleted_count = process_filler_files(
                 quarantine_dir_path=quarantine_dir, 
-                healthy_files=healthy_files,
-                bad_files_with_errors=bad_files_with_errors
+                healthy_files=[f_path for f_path in healthy_files if f_path not in released],
+                bad_files_with_errors=bad_files_with_errors,
+                shrink=not args.keep_whole_bad_files,
+                margin_bytes=args.quarantine_margin_kb * 1024,
+                pattern=FillerPattern(pattern_seed),
+                record_extents=True
             )
+            deleted_count += len(released_files)
 
             # --- Retention/Deletion Summary ---
-            print("\n--- Retention/Deletion Summary ---")
-            print(f"  Number of healthy files deleted: {deleted_count}")
+            summary_lines = ["\n--- Retention/Deletion Summary ---", f"  Number of healthy files deleted: {deleted_count}"]
             if retained_info:
-                print("  Files retained in quarantine due to errors:")
-                for f_path, err_msg in retained_info:
-                    print(f"    - {f_path}: Reason: {err_msg}")
+                summary_lines.append("  Files retained in quarantine due to errors:")
+                summary_lines.extend(f"    - {f_path}: Reason: {err_msg}" for f_path, err_msg in retained_info)
             else:
-                print("  No files were quarantined.")
-            print(f"  Quarantine directory: {quarantine_dir}")
+                summary_lines.append("  No files were quarantined.")
+            summary_lines.append(f"  Quarantine directory: {quarantine_dir}")
+            report("summary", "\n".join(summary_lines), operation="isolate", deleted_files=deleted_count,
+                   quarantined_files=len(retained_info), quarantine_dir=quarantine_dir)
         else:
             parser.print_help()
             # print("\nDefaulting to listing disks as no specific action was chosen:")
             # list_disk_partitions_and_devices()
     except Exception as e:
+        report("error", None, message=f"{type(e).__name__} - {e}", fatal=True)
         print(f"\nError: An unexpected critical error occurred in the application: {type(e).__name__} - {e}", file=sys.stderr)
         # Consider adding traceback print here for debugging development versions
         # import traceback
         # traceback.print_exc()
         sys.exit(1)
+    finally:
+        get_reporter().flush()
+        set_reporter(previous_reporter)
+        sys.stdout = reporter_stdout
 
 
 if __name__ == "__main__":
@@ -5,20 +5,80 @@ import sys
 import io
 import errno
 import uuid # For predictable UUIDs in tests
+import tempfile
+import time
+import threading
+import json
 
 # Assuming dead_sector_killer.py is in the same directory or accessible in PYTHONPATH
 from dead_sector_killer import (
     get_filesystem_info,
     prepare_quarantine_directory,
     fill_free_space,
+    fill_and_verify,
+    find_bad_file_ranges,
+    map_file_ranges_to_physical,
+    load_quarantine_manifest,
+    find_quarantined_files,
+    locate_quarantined_files,
+    FillerPattern,
+    open_filler_file,
     check_file_integrity,
     process_filler_files,
     list_quarantine_files,
     delete_quarantine_files,
     get_human_readable_size, # Helper, might be useful
+    get_default_scan_file_path,
+    scan_disk,
+    get_logical_sector_size,
+    align_up,
+    align_down,
+    locate_bad_sectors,
+    split_scan_range,
+    group_devices_by_parent_disk,
+    scan_devices,
+    BadRegionMap,
+    LatencyHistogram,
+    wilson_interval,
+    rescan_regions,
+    IOThrottle,
+    get_file_extents,
+    build_extent_index,
+    map_bad_regions_to_files,
+    Reporter,
+    JsonlReporter,
+    FaultInjectingBackend,
+    write_verify_device,
+    find_device_users,
+    RegionFingerprints,
+    get_allocated_ranges,
+    main,
     QUARANTINE_DIR_NAME
 )
 
+
+class TempFilesMixin:
+    """Per-test temporary directory for tests that do real file I/O, removed with addCleanup."""
+
+    def make_temp_dir(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        return self.tmp_dir
+
+    def make_image(self, size, random=False, name='disk.img'):
+        """Creates a file of size bytes in the temporary directory: sparse, or random data with random=True."""
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            if random:
+                f.write(os.urandom(size))
+            else:
+                f.truncate(size)
+        return path
+
+    def filler_path(self, index):
+        return os.path.join(self.tmp_dir, f"filler_{index:04d}.tmp")
+
 class TestGetFilesystemInfo(unittest.TestCase):
 
     @patch('psutil.disk_usage')
@@ -82,54 +142,71 @@ class TestPrepareQuarantineDirectory(unittest.TestCase):
         self.assertIn(f"Error: Could not create quarantine directory at '{expected_quarantine_path}'. OSError: Creation failed", mock_stdout.getvalue())
 
 
-class TestFillFreeSpace(unittest.TestCase):
+class TestFillFreeSpace(TempFilesMixin, unittest.TestCase):
     def setUp(self):
         # Default mocks for most tests in this class
-        self.mock_fs_info = {'free_space': 200 * 1024 * 1024, 'total_space': 500 * 1024 * 1024, 'used_space': 300 * 1024 * 1024}
+        self.mock_fs_info = {'free_space': 20 * 1024 * 1024, 'total_space': 50 * 1024 * 1024, 'used_space': 30 * 1024 * 1024}
+        self.quarantine_dir = self.make_temp_dir()
 
     @patch('dead_sector_killer.get_filesystem_info')
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('os.path.join', side_effect=lambda *args: "/".join(args)) # Simple join for testing
     @patch('sys.stdout', new_callable=io.StringIO)
-    def test_fill_free_space_success_partial_fill(self, mock_stdout, mock_os_join, mock_open_func, mock_get_fs_info):
+    def test_fill_free_space_success_partial_fill(self, mock_stdout, mock_get_fs_info):
         mock_get_fs_info.return_value = self.mock_fs_info
-        
-        # Target 50% of 200MB free space = 100MB. Filler file size 40MB. Expect 3 files (40, 40, 20)
-        created_files, write_errors = fill_free_space(
-            filesystem_path='/fake/fs',
-            quarantine_dir_path='/fake/fs/.quarantine_files',
-            filler_file_size_mb=40,
-            fill_percentage=50
-        )
-        
-        self.assertEqual(len(created_files), 3)
-        self.assertEqual(created_files[0], '/fake/fs/.quarantine_files/filler_0001.tmp')
-        self.assertEqual(created_files[1], '/fake/fs/.quarantine_files/filler_0002.tmp')
-        self.assertEqual(created_files[2], '/fake/fs/.quarantine_files/filler_0003.tmp')
+        real_write = os.write
+
+        # Target 50% of 20MB free space = 10MB. Filler file size 4MB. Expect 3 files (4, 4, 2)
+        with patch('os.write', side_effect=real_write) as mock_write:
+            created_files, write_errors = fill_free_space(
+                filesystem_path='/fake/fs',
+                quarantine_dir_path=self.quarantine_dir,
+                filler_file_size_mb=4,
+                fill_percentage=50
+            )
+
+        self.assertEqual(created_files, [self.filler_path(1), self.filler_path(2), self.filler_path(3)])
         self.assertEqual(len(write_errors), 0)
+        self.assertEqual([os.path.getsize(path) for path in created_files], [4 * 1024**2, 4 * 1024**2, 2 * 1024**2])
+        with open(created_files[2], 'rb') as f:
+            self.assertEqual(f.read(), bytes(2 * 1024**2)) # Null bytes
+        # Every write reuses the same 1MB buffer
+        self.assertEqual(mock_write.call_count, 4 + 4 + 2)
+        self.assertEqual(len({id(call.args[1].obj) for call in mock_write.call_args_list}), 1)
 
-        # Check open calls: file path and mode
-        self.assertEqual(mock_open_func.call_count, 3)
-        mock_open_func.assert_any_call('/fake/fs/.quarantine_files/filler_0001.tmp', 'wb')
-        mock_open_func.assert_any_call('/fake/fs/.quarantine_files/filler_0002.tmp', 'wb')
-        mock_open_func.assert_any_call('/fake/fs/.quarantine_files/filler_0003.tmp', 'wb')
-
-        # Check write calls (bytes written)
-        # File 1: 40MB
-        # File 2: 40MB
-        # File 3: 20MB (to reach 100MB total)
-        # Each write is 1MB chunk
-        total_write_calls = (40) + (40) + (20) 
-        self.assertEqual(mock_open_func().write.call_count, total_write_calls)
-        
         output = mock_stdout.getvalue()
         self.assertIn("Targeting 50% of free space.", output)
-        self.assertIn("Target space to fill: 100.00MB", output)
-        self.assertIn("Creating filler file: filler_0001.tmp (Size: 40.00MB)", output)
-        self.assertIn("Creating filler file: filler_0002.tmp (Size: 40.00MB)", output)
-        self.assertIn("Creating filler file: filler_0003.tmp (Size: 20.00MB)", output)
-        self.assertIn("Actually filled: 100.00MB across 3 files.", output)
+        self.assertIn("Target space to fill: 10.00MB", output)
+        self.assertIn("Creating filler file: filler_0001.tmp (Size: 4.00MB)", output)
+        self.assertIn("Creating filler file: filler_0002.tmp (Size: 4.00MB)", output)
+        self.assertIn("Creating filler file: filler_0003.tmp (Size: 2.00MB)", output)
+        self.assertRegex(output, r"Successfully wrote filler_0001.tmp at [0-9.]+ MB/s")
+        self.assertIn("Actually filled: 10.00MB across 3 files.", output)
+        self.assertIn("Write throughput:", output)
+
+    @patch('dead_sector_killer.get_filesystem_info')
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fill_free_space_direct_io_and_sync(self, mock_stdout, mock_get_fs_info):
+        mock_get_fs_info.return_value = self.mock_fs_info
+        real_fdatasync = os.fdatasync
+        with patch('os.fdatasync', side_effect=real_fdatasync) as mock_fdatasync:
+            created_files, write_errors = fill_free_space('/fake/fs', self.quarantine_dir, filler_file_size_mb=3,
+                                                          fill_percentage=30, direct_io=True, sync_interval_mb=1)
+        self.assertEqual(len(write_errors), 0)
+        self.assertEqual([os.path.getsize(path) for path in created_files], [3 * 1024**2, 3 * 1024**2])
+        self.assertEqual(mock_fdatasync.call_count, 2 * (3 + 1)) # Every MB, plus once per completed file
 
+    @patch('dead_sector_killer.get_filesystem_info')
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fill_free_space_sync_without_fdatasync(self, mock_stdout, mock_get_fs_info):
+        mock_get_fs_info.return_value = self.mock_fs_info
+        real_fsync = os.fsync
+        self.addCleanup(setattr, os, 'fdatasync', os.fdatasync)
+        del os.fdatasync # Platforms such as macOS have no fdatasync
+        with patch('os.fsync', side_effect=real_fsync) as mock_fsync:
+            created_files, write_errors = fill_free_space('/fake/fs', self.quarantine_dir, filler_file_size_mb=3,
+                                                          fill_percentage=30, sync_interval_mb=1)
+        self.assertEqual(len(write_errors), 0)
+        self.assertEqual(len(created_files), 2)
+        self.assertEqual(mock_fsync.call_count, 2 * (3 + 1))
 
     @patch('dead_sector_killer.get_filesystem_info')
     @patch('sys.stdout', new_callable=io.StringIO)
@@ -175,83 +252,137 @@ class TestFillFreeSpace(unittest.TestCase):
         self.assertIn("Error: Filler file size cannot be 0 MB.", mock_stdout.getvalue())
 
     @patch('dead_sector_killer.get_filesystem_info')
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('os.path.join', side_effect=lambda *args: "/".join(args))
     @patch('sys.stdout', new_callable=io.StringIO)
-    def test_fill_free_space_write_error_enospc(self, mock_stdout, mock_os_join, mock_open_func, mock_get_fs_info):
-        mock_get_fs_info.return_value = self.mock_fs_info # 200MB free
-        
+    def test_fill_free_space_write_error_enospc(self, mock_stdout, mock_get_fs_info):
+        mock_get_fs_info.return_value = self.mock_fs_info # 20MB free
+        real_write = os.write
+
         # Make write fail on the second chunk of the first file
-        mock_file_handle = mock_open_func.return_value
-        mock_file_handle.write.side_effect = [
-            None, # First 1MB chunk succeeds
-            IOError(errno.ENOSPC, "No space left on device"), # Second 1MB chunk fails
-            # Subsequent writes for other files should not happen
-        ]
+        write_results = iter([None, OSError(errno.ENOSPC, "No space left on device")])
+        def write_side_effect(fd, data):
+            result = next(write_results, None)
+            if isinstance(result, Exception):
+                raise result
+            return real_write(fd, data)
+
+        with patch('os.write', side_effect=write_side_effect) as mock_write:
+            created_files, write_errors = fill_free_space(
+                filesystem_path='/fake/fs',
+                quarantine_dir_path=self.quarantine_dir,
+                filler_file_size_mb=10, # Try to write 10MB files
+                fill_percentage=80 # Target 16MB
+            )
 
-        created_files, write_errors = fill_free_space(
-            filesystem_path='/fake/fs',
-            quarantine_dir_path='/fake/fs/.quarantine_files',
-            filler_file_size_mb=100, # Try to write one 100MB file
-            fill_percentage=80 # Target 160MB
-        )
-        
         self.assertEqual(len(created_files), 0) # File creation failed
         self.assertEqual(len(write_errors), 1)
-        self.assertEqual(write_errors[0][0], '/fake/fs/.quarantine_files/filler_0001.tmp')
+        self.assertEqual(write_errors[0][0], self.filler_path(1))
         self.assertIn("No space left on device", write_errors[0][1])
-        
+        self.assertEqual(mock_write.call_count, 2)
+
         output = mock_stdout.getvalue()
         self.assertIn("Creating filler file: filler_0001.tmp", output)
-        self.assertIn("IOError writing to /fake/fs/.quarantine_files/filler_0001.tmp", output)
+        self.assertIn(f"IOError writing to {self.filler_path(1)}", output)
         self.assertIn("Warning: Disk ran out of space. Stopping filler file creation.", output)
         # Ensure it doesn't try to create more files
         self.assertNotIn("Creating filler file: filler_0002.tmp", output)
 
     @patch('dead_sector_killer.get_filesystem_info')
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('os.path.join', side_effect=lambda *args: "/".join(args))
     @patch('sys.stdout', new_callable=io.StringIO)
-    def test_fill_free_space_write_error_other(self, mock_stdout, mock_os_join, mock_open_func, mock_get_fs_info):
-        mock_get_fs_info.return_value = self.mock_fs_info # 200MB free
-        
-        mock_file_handle = mock_open_func.return_value
-        generic_io_error = IOError("Some other disk error")
-
-        # Fail on first file, succeed on second
-        def write_side_effect(*args, **kwargs):
-            # Allow inspecting which file is being written, not straightforward with just mock_open
-            # This is a simplified check; real check is on created_files / write_errors
-            current_call_count = mock_open_func().write.call_count
-            if mock_open_func.call_count == 1 and current_call_count == 1: # First write of first file
-                 raise generic_io_error
-            return None # Success for other writes
-
-        mock_file_handle.write.side_effect = write_side_effect
-        
-        created_files, write_errors = fill_free_space(
-            filesystem_path='/fake/fs',
-            quarantine_dir_path='/fake/fs/.quarantine_files',
-            filler_file_size_mb=10, # Small files, attempt to create multiple
-            fill_percentage=15 # Target 30MB -> try for 3 files
-        )
-        
+    def test_fill_free_space_preallocation_enospc_stops_before_writing(self, mock_stdout, mock_get_fs_info):
+        mock_get_fs_info.return_value = self.mock_fs_info
+        with patch('os.posix_fallocate', side_effect=OSError(errno.ENOSPC, "No space left on device"), create=True), \
+             patch('os.write') as mock_write:
+            created_files, write_errors = fill_free_space('/fake/fs', self.quarantine_dir, filler_file_size_mb=4, fill_percentage=50)
+        self.assertEqual((created_files, len(write_errors)), ([], 1))
+        mock_write.assert_not_called()
+        self.assertIn("Disk ran out of space", mock_stdout.getvalue())
+
+    @patch('dead_sector_killer.get_filesystem_info')
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fill_free_space_write_error_other(self, mock_stdout, mock_get_fs_info):
+        mock_get_fs_info.return_value = self.mock_fs_info # 20MB free
+        real_write = os.write
+        generic_io_error = IOError(errno.EIO, "Some other disk error")
+
+        # Fail on first write of the first file, succeed on the rest
+        def write_side_effect(fd, data):
+            if mock_write.call_count == 1:
+                raise generic_io_error
+            return real_write(fd, data)
+
+        with patch('os.write', side_effect=write_side_effect) as mock_write:
+            created_files, write_errors = fill_free_space(
+                filesystem_path='/fake/fs',
+                quarantine_dir_path=self.quarantine_dir,
+                filler_file_size_mb=2, # Small files, attempt to create multiple
+                fill_percentage=30 # Target 6MB -> try for 3 files
+            )
+
         # First file should be in errors, second and third should be created
-        self.assertEqual(len(created_files), 2) # filler_0002.tmp, filler_0003.tmp
-        self.assertEqual(created_files[0], '/fake/fs/.quarantine_files/filler_0002.tmp')
-        self.assertEqual(created_files[1], '/fake/fs/.quarantine_files/filler_0003.tmp')
-        
+        self.assertEqual(created_files, [self.filler_path(2), self.filler_path(3)])
+
         self.assertEqual(len(write_errors), 1)
-        self.assertEqual(write_errors[0][0], '/fake/fs/.quarantine_files/filler_0001.tmp')
+        self.assertEqual(write_errors[0][0], self.filler_path(1))
         self.assertIn("Some other disk error", write_errors[0][1])
-        
+
         output = mock_stdout.getvalue()
         self.assertIn("Creating filler file: filler_0001.tmp", output)
-        self.assertIn("IOError writing to /fake/fs/.quarantine_files/filler_0001.tmp", output)
+        self.assertIn(f"IOError writing to {self.filler_path(1)}", output)
         self.assertNotIn("Warning: Disk ran out of space", output) # Should not stop for generic error
         self.assertIn("Creating filler file: filler_0002.tmp", output) # Attempted next file
         self.assertIn("Creating filler file: filler_0003.tmp", output)
+        self.assertNotIn("filler_0004.tmp", output) # A failed file is not retried as an extra file
+
+    @patch('dead_sector_killer.get_filesystem_info')
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fill_free_space_parallel_writers_are_deterministic(self, mock_stdout, mock_get_fs_info):
+        mock_get_fs_info.return_value = self.mock_fs_info
+        real_write, real_open_filler_file = os.write, open_filler_file
+        open_files = {} # fd -> file name; fds are reused once a file is closed
+
+        def open_side_effect(file_path, direct_io=False):
+            fd, direct_active = real_open_filler_file(file_path, direct_io)
+            open_files[fd] = os.path.basename(file_path)
+            return fd, direct_active
+
+        def write_side_effect(fd, data):
+            if open_files.get(fd) == "filler_0003.tmp":
+                raise OSError(errno.EIO, "Injected write error")
+            return real_write(fd, data)
+
+        with patch('dead_sector_killer.open_filler_file', side_effect=open_side_effect), \
+             patch('os.write', side_effect=write_side_effect):
+            created_files, write_errors = fill_free_space('/fake/fs', self.quarantine_dir, filler_file_size_mb=1,
+                                                          fill_percentage=50, writers=4)
+        self.assertEqual(created_files, [self.filler_path(index) for index in (1, 2, 4, 5, 6, 7, 8, 9, 10)])
+        self.assertEqual([path for path, _ in write_errors], [self.filler_path(3)])
+        self.assertIn("Injected write error", write_errors[0][1])
+        self.assertEqual(sum(os.path.getsize(path) for path in created_files), 9 * 1024**2)
+        self.assertIn("Writing up to 4 filler files concurrently", mock_stdout.getvalue())
+
+    @patch('dead_sector_killer.get_filesystem_info')
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fill_free_space_parallel_enospc_stops_all_writers(self, mock_stdout, mock_get_fs_info):
+        mock_get_fs_info.return_value = self.mock_fs_info
+        lock = threading.Lock()
+        calls = []
 
+        def fallocate_side_effect(fd, offset, length):
+            with lock:
+                calls.append(fd)
+                if len(calls) > 5:
+                    raise OSError(errno.ENOSPC, "No space left on device")
+
+        with patch('os.posix_fallocate', side_effect=fallocate_side_effect, create=True):
+            created_files, write_errors = fill_free_space('/fake/fs', self.quarantine_dir, filler_file_size_mb=1,
+                                                          fill_percentage=100, writers=3)
+        # Which files got space first depends on scheduling; how many did does not.
+        self.assertEqual(len(created_files), 5)
+        self.assertEqual(created_files, sorted(created_files))
+        self.assertTrue(1 <= len(write_errors) <= 3) # Only files already in flight can fail
+        self.assertTrue(all("No space left on device" in message for _, message in write_errors))
+        self.assertLessEqual(len(calls), 8)
+        self.assertEqual(mock_stdout.getvalue().count("Disk ran out of space"), 1)
 
 class TestCheckFileIntegrity(unittest.TestCase):
 
@@ -311,6 +442,87 @@ class TestCheckFileIntegrity(unittest.TestCase):
         self.assertIn("Integrity check PASSED for: /fake/file.tmp (Zero-byte file)", mock_stdout.getvalue())
 
 
+class TestColdReadIntegrity(TempFilesMixin, unittest.TestCase):
+    def setUp(self):
+        self.make_temp_dir()
+        self.file_path = self.make_image(3 * 1024 * 1024, random=True, name="filler_0001.tmp")
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_cold_read_reports_mode_and_throughput(self, mock_stdout):
+        is_ok, message = check_file_integrity(self.file_path, cold=True)
+        self.assertTrue(is_ok, message)
+        self.assertRegex(mock_stdout.getvalue(),
+                         r"Integrity check PASSED for: .*filler_0001.tmp \(3.00MB read at [0-9.]+ MB/s, (O_DIRECT|cache dropped|page cache)\)")
+
+    @unittest.skipUnless(hasattr(os, 'O_DIRECT') and hasattr(os, 'posix_fadvise'), "needs O_DIRECT and posix_fadvise")
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_cold_read_drops_cache_when_o_direct_is_rejected(self, mock_stdout):
+        real_open = os.open
+        def open_without_direct(path, flags, *args):
+            if flags & os.O_DIRECT:
+                raise OSError(errno.EINVAL, "Invalid argument")
+            return real_open(path, flags, *args)
+
+        with patch('os.open', side_effect=open_without_direct), \
+             patch('os.posix_fadvise') as mock_fadvise, patch('os.fdatasync') as mock_fdatasync:
+            is_ok, message = check_file_integrity(self.file_path, cold=True)
+        self.assertTrue(is_ok, message)
+        mock_fdatasync.assert_called_once()
+        mock_fadvise.assert_called_once_with(mock_fdatasync.call_args.args[0], 0, 0, os.POSIX_FADV_DONTNEED)
+        self.assertIn("cache dropped)", mock_stdout.getvalue())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_cold_read_with_injected_fault(self, mock_stdout):
+        backend = FaultInjectingBackend(bad_ranges=[(2 * 1024 * 1024, 2 * 1024 * 1024 + 4096)])
+        is_ok, message = check_file_integrity(self.file_path, backend=backend, cold=True)
+        self.assertFalse(is_ok)
+        self.assertIn("Read error", message)
+        self.assertEqual(backend.reads[-1][0], 2 * 1024 * 1024)
+
+class TestFillerPatternVerification(TempFilesMixin, unittest.TestCase):
+    def setUp(self):
+        self.make_temp_dir()
+        self.pattern = FillerPattern(seed=7)
+        patcher = patch('dead_sector_killer.get_filesystem_info', return_value={'free_space': 4 * 1024 * 1024})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pattern_is_reproducible_and_position_dependent(self):
+        block = bytearray(64 * 1024)
+        self.pattern.fill(block, 1, 4096)
+        unaligned = bytearray(1000)
+        self.pattern.fill(unaligned, 1, 4096 + 300)
+        self.assertEqual(unaligned, block[300:1300])
+        self.assertNotEqual(block.count(0), len(block))
+        self.assertEqual(self.pattern.find_mismatches(bytes(block), 1, 4096), [])
+        self.assertEqual(self.pattern.find_mismatches(bytes(block), 2, 4096), [(4096, 4096 + len(block))])
+        # The same data one sector further along (a misdirected write) does not match either
+        self.assertEqual(len(self.pattern.find_mismatches(bytes(block[512:]), 1, 4096)), 1)
+
+    def test_find_mismatches_narrows_to_sectors(self):
+        block = bytearray(64 * 1024)
+        self.pattern.fill(block, 1, 0)
+        block[5000:6000] = bytes(1000)
+        block[40000] ^= 0xFF
+        self.assertEqual(self.pattern.find_mismatches(bytes(block), 1, 0), [(4608, 6144), (39936, 40448)])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_check_detects_silently_corrupted_sector(self, mock_stdout):
+        created_files, write_errors = fill_free_space('/fake/fs', self.tmp_dir, filler_file_size_mb=2,
+                                                      fill_percentage=100, pattern=self.pattern)
+        self.assertEqual(write_errors, [])
+        self.assertEqual(check_file_integrity(created_files[0], pattern=self.pattern), (True, "File read successfully"))
+
+        with open(created_files[1], 'r+b') as f:
+            f.seek(1024 * 1024 + 512)
+            f.write(bytes(512)) # A sector that reads back as zeroes
+        is_ok, message = check_file_integrity(created_files[1], pattern=self.pattern, cold=True)
+        self.assertFalse(is_ok)
+        self.assertTrue(message.startswith("Data mismatch: 512.00B in 1 range(s)"), message)
+        self.assertIn(f"first at offset {1024 * 1024 + 512}", message)
+        # Swapping the two files' contents is caught through the file index
+        self.assertFalse(check_file_integrity(created_files[0], pattern=self.pattern, file_index=2)[0])
+
 class TestProcessFillerFiles(unittest.TestCase):
 
     @patch('os.remove')
@@ -362,7 +574,7 @@ class TestProcessFillerFiles(unittest.TestCase):
 
     @patch('uuid.uuid4')
     @patch('os.rename', side_effect=OSError("Cannot rename"))
-    @patch('os.path.exists', return_value=True) # Original file exists
+    @patch('os.path.exists', side_effect=lambda path: path == '/q/b1.tmp') # Original file exists, new name is free
     @patch('sys.stdout', new_callable=io.StringIO)
     def test_process_bad_files_rename_error(self, mock_stdout, mock_path_exists, mock_os_rename, mock_uuid):
         mock_uuid.return_value = MagicMock(hex='testuuid')
@@ -379,6 +591,18 @@ class TestProcessFillerFiles(unittest.TestCase):
         self.assertIn("Rename failed: Cannot rename", retained[0][1])
         self.assertIn("Error renaming bad file /q/b1.tmp", mock_stdout.getvalue())
 
+    @patch('uuid.uuid4')
+    @patch('os.rename') # Should not be called
+    @patch('os.path.exists', return_value=True) # Every candidate name is taken
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_process_bad_files_no_unique_name(self, mock_stdout, mock_path_exists, mock_os_rename, mock_uuid):
+        mock_uuid.return_value = MagicMock(hex='testuuid')
+        retained, deleted_count = process_filler_files('/q', [], [('/q/b1.tmp', "Disk error"), ('/q/b2.tmp', "Disk error")])
+
+        self.assertEqual([path for path, _ in retained], ['/q/b1.tmp', '/q/b2.tmp'])
+        self.assertIn("Critical: Failed to generate unique rename path.", retained[0][1])
+        mock_os_rename.assert_not_called()
+
     @patch('uuid.uuid4')
     @patch('os.rename') # Should not be called
     @patch('os.path.exists', return_value=False) # Original file does NOT exist
@@ -398,6 +622,176 @@ class TestProcessFillerFiles(unittest.TestCase):
         self.assertIn("Warning: Original bad file /q/b1_nonexistent.tmp not found for renaming.", mock_stdout.getvalue())
 
 
+class TestFillAndVerify(TempFilesMixin, unittest.TestCase):
+    def setUp(self):
+        self.quarantine_dir = self.make_temp_dir()
+        patcher = patch('dead_sector_killer.get_filesystem_info', return_value={'free_space': 20 * 1024 * 1024})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_healthy_files_released_as_they_verify(self, mock_stdout):
+        def check(file_path):
+            if file_path == self.filler_path(2):
+                return False, "Read error at offset 0"
+            return True, "OK"
+
+        healthy, bad, released = fill_and_verify('/fake/fs', self.quarantine_dir, filler_file_size_mb=4,
+                                                 fill_percentage=50, check=check)
+        self.assertEqual(healthy, [self.filler_path(1), self.filler_path(3)])
+        self.assertEqual(released, healthy)
+        self.assertEqual(bad, [(self.filler_path(2), "Read error at offset 0")])
+        self.assertEqual(os.listdir(self.quarantine_dir), ["filler_0002.tmp"])
+        self.assertIn("Deleting healthy file: " + self.filler_path(1), mock_stdout.getvalue())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fill_waits_for_verification(self, mock_stdout):
+        files_on_disk = []
+        def slow_check(file_path):
+            time.sleep(0.05)
+            files_on_disk.append(len(os.listdir(self.quarantine_dir)))
+            return True, "OK"
+
+        healthy, bad, released = fill_and_verify('/fake/fs', self.quarantine_dir, filler_file_size_mb=2,
+                                                 fill_percentage=50, max_unverified_mb=2, check=slow_check)
+        self.assertEqual(len(healthy), 5)
+        self.assertEqual(bad, [])
+        # One file is being verified while at most the next one is written
+        self.assertLessEqual(max(files_on_disk), 2)
+        self.assertEqual(os.listdir(self.quarantine_dir), [])
+        self.assertIn("peak 2.00MB unverified", mock_stdout.getvalue())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_hold_verified_keeps_healthy_files(self, mock_stdout):
+        healthy, bad, released = fill_and_verify('/fake/fs', self.quarantine_dir, filler_file_size_mb=4,
+                                                 fill_percentage=50, release_healthy=False)
+        self.assertEqual(healthy, [self.filler_path(1), self.filler_path(2), self.filler_path(3)])
+        self.assertEqual((bad, released), ([], []))
+        self.assertEqual(sorted(os.listdir(self.quarantine_dir)), ["filler_0001.tmp", "filler_0002.tmp", "filler_0003.tmp"])
+
+class TestShrinkQuarantinedFiles(TempFilesMixin, unittest.TestCase):
+    MB = 1024 * 1024
+
+    def setUp(self):
+        self.quarantine_dir = self.make_temp_dir()
+        self.pattern = FillerPattern(seed=3)
+        self.file_path = self.filler_path(1)
+        data = bytearray(8 * self.MB)
+        self.pattern.fill(data, 1, 0)
+        with open(self.file_path, 'wb') as f:
+            f.write(data)
+            os.fsync(f.fileno())
+
+    def quarantined_file(self, retained):
+        self.assertEqual(len(retained), 1)
+        self.assertRegex(os.path.basename(retained[0][0]), r"^filler_0001\.quarantined\.[0-9a-f]+\.bad$")
+        return retained[0][0]
+
+    def allocated_bytes(self, path):
+        return os.stat(path).st_blocks * 512
+
+    @unittest.skipUnless(hasattr(os.stat_result, 'st_blocks'), "needs st_blocks")
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_shrink_keeps_only_bad_range_and_margin(self, mock_stdout):
+        backend = FaultInjectingBackend(bad_ranges=[(3 * self.MB + 4096, 3 * self.MB + 8192)])
+        retained, _ = process_filler_files(self.quarantine_dir, [], [(self.file_path, "Read error")], shrink=True,
+                                           margin_bytes=256 * 1024, pattern=self.pattern, backend=backend)
+        path = self.quarantined_file(retained)
+        self.assertEqual(find_bad_file_ranges(path, backend=backend).ranges()[0][0], 3 * self.MB + 4096)
+        if "(punch-hole)" in mock_stdout.getvalue():
+            self.assertEqual(os.path.getsize(path), 8 * self.MB)
+            self.assertLessEqual(self.allocated_bytes(path), 1 * self.MB)
+        else: # No hole punching here: only the tail after the kept range is released
+            self.assertEqual(os.path.getsize(path), 3 * self.MB + 8192 + 256 * 1024)
+        self.assertRegex(mock_stdout.getvalue(), r"Shrunk .*filler_0001.quarantined.* to 1 bad range\(s\)")
+        self.assertRegex(mock_stdout.getvalue(), r"Shrinking quarantined files reclaimed [1-9]")
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_shrink_falls_back_to_truncate(self, mock_stdout):
+        with open(self.file_path, 'r+b') as f: # A sector that silently reads back wrong
+            f.seek(2 * self.MB)
+            f.write(bytes(512))
+        with patch('dead_sector_killer.punch_hole', side_effect=OSError(errno.EOPNOTSUPP, "Operation not supported")):
+            retained, _ = process_filler_files(self.quarantine_dir, [], [(self.file_path, "Data mismatch")], shrink=True,
+                                               margin_bytes=64 * 1024, pattern=self.pattern)
+        path = self.quarantined_file(retained)
+        self.assertEqual(os.path.getsize(path), align_up(2 * self.MB + 512 + 64 * 1024, os.stat(path).st_blksize))
+        self.assertIn("(truncate)", mock_stdout.getvalue())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_unreproducible_failure_keeps_whole_file(self, mock_stdout):
+        retained, _ = process_filler_files(self.quarantine_dir, [], [(self.file_path, "Read error")], shrink=True,
+                                           pattern=self.pattern)
+        path = self.quarantined_file(retained)
+        self.assertEqual(os.path.getsize(path), 8 * self.MB)
+        self.assertIn("Could not reproduce the failure", mock_stdout.getvalue())
+
+class TestQuarantineManifest(TempFilesMixin, unittest.TestCase):
+    MB = 1024 * 1024
+
+    def setUp(self):
+        self.quarantine_dir = self.make_temp_dir()
+        self.file_path = self.make_image(4 * self.MB, random=True, name="filler_0001.tmp")
+        try:
+            fd = os.open(self.file_path, os.O_RDONLY)
+            try:
+                get_file_extents(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            self.skipTest("FIEMAP is not supported here")
+
+    def test_map_file_ranges_to_physical(self):
+        extents = [(0, 1000, 100), (100, 5000, 100)]
+        self.assertEqual(map_file_ranges_to_physical(extents, [(50, 150), (300, 400)]), [(1050, 1100), (5000, 5050)])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_quarantined_file_extents_are_recorded_and_queryable(self, mock_stdout):
+        backend = FaultInjectingBackend(bad_ranges=[(2 * self.MB, 2 * self.MB + 4096)])
+        retained, _ = process_filler_files(self.quarantine_dir, [], [(self.file_path, "Read error")], shrink=True,
+                                           margin_bytes=0, backend=backend, record_extents=True)
+        quarantined_name = os.path.basename(retained[0][0])
+        records = load_quarantine_manifest(self.quarantine_dir)
+        self.assertEqual(list(records), [quarantined_name])
+        record = records[quarantined_name]
+        self.assertEqual(record["original"], "filler_0001.tmp")
+        self.assertEqual(record["bad_ranges"], [[2 * self.MB, 2 * self.MB + 4096]])
+        self.assertTrue(record["extents"])
+        self.assertEqual(sum(r[1] - r[0] for r in record["bad_physical_ranges"]), 4096)
+        self.assertIn("Recorded the physical location of 1 quarantined file(s)", mock_stdout.getvalue())
+
+        # Query in the filesystem device's own offsets around the bad block
+        bad_start = record["bad_physical_ranges"][0][0]
+        if record["filesystem_device"]:
+            matches = find_quarantined_files(self.quarantine_dir, bad_start, bad_start + 1, device_path=record["filesystem_device"])
+            self.assertEqual([(name, overlaps) for name, overlaps, _ in matches], [(quarantined_name, [(bad_start, bad_start + 1)])])
+        if record["partition_offset"] is not None:
+            base = record["partition_offset"]
+            self.assertEqual(len(find_quarantined_files(self.quarantine_dir, base + bad_start, base + bad_start + 1)), 1)
+            self.assertEqual(find_quarantined_files(self.quarantine_dir, base + bad_start - 8192, base + bad_start - 4096), [])
+            self.assertEqual(record["bad_lbas"][0][0], (base + bad_start) // record["sector_size"])
+
+        # Deleted files drop out of the manifest; the manifest itself is not a quarantined file
+        mock_stdout.truncate(0)
+        list_quarantine_files(self.quarantine_dir)
+        self.assertIn(f"- {quarantined_name}", mock_stdout.getvalue())
+        self.assertNotIn("quarantine_manifest.jsonl", mock_stdout.getvalue())
+        os.remove(retained[0][0])
+        self.assertEqual(load_quarantine_manifest(self.quarantine_dir), {})
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_lbas_use_the_recorded_sector_size(self, mock_stdout):
+        record = {"file": "filler_0001.tmp", "reason": "Read error", "filesystem_device": None, "partition_offset": self.MB,
+                  "sector_size": 4096, "extents": [[0, 4 * self.MB, self.MB]]}
+        with open(os.path.join(self.quarantine_dir, "quarantine_manifest.jsonl"), "w") as f:
+            f.write(json.dumps(record) + "\n")
+        lba = (self.MB + 4 * self.MB) // 4096 # First 4 KB LBA of the file on the disk
+        self.assertEqual(len(find_quarantined_files(self.quarantine_dir, lba, lba + 1, lba=True)), 1)
+        self.assertEqual(find_quarantined_files(self.quarantine_dir, lba, lba + 1, lba=True, sector_size=512), [])
+        self.assertEqual(locate_quarantined_files(self.quarantine_dir, lba, lba + 1, lba=True)[0][1],
+                         [(5 * self.MB, 5 * self.MB + 4096)])
+        self.assertIn(f"LBAs {lba}-{lba}", mock_stdout.getvalue())
+
 class TestListQuarantineFiles(unittest.TestCase):
 
     @patch('os.path.isfile', return_value=True)
@@ -483,5 +877,808 @@ class TestDeleteQuarantineFiles(unittest.TestCase):
         self.assertIn("Error: Specify a filename with --filename or use --all to delete all files.", mock_stdout.getvalue())
 
 
+class TestScanDisk(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.make_temp_dir()
+        self.image_path = self.make_image(1024 * 1024 + 4096, random=True)
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_buffered_reads_whole_image(self, mock_stdout, mock_geteuid):
+        result = scan_disk(self.image_path, block_size_kb=64)
+        self.assertEqual(result['bytes_scanned'], 1024 * 1024 + 4096)
+        self.assertEqual(result['errors_found'], 0)
+        self.assertIn("No read errors detected", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_direct_io_reads_whole_image(self, mock_stdout, mock_geteuid):
+        # Deliberately unaligned block size: must be rounded up to the sector size.
+        result = scan_disk(self.image_path, block_size_kb=3, direct_io=True)
+        self.assertEqual(result['bytes_scanned'], 1024 * 1024 + 4096)
+        self.assertEqual(result['errors_found'], 0)
+
+    @patch('os.open', side_effect=[OSError(errno.EINVAL, "Invalid argument"), 99])
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_open_scan_device_falls_back_without_o_direct(self, mock_stdout, mock_os_open):
+        from dead_sector_killer import open_scan_device
+        if not hasattr(os, 'O_DIRECT'):
+            self.skipTest("O_DIRECT not available on this platform")
+        fd, direct_active = open_scan_device('/fake/dev', direct_io=True)
+        self.assertEqual(fd, 99)
+        self.assertFalse(direct_active)
+        self.assertIn("does not support O_DIRECT", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_parallel_jobs_merge_errors(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        bad_offsets = {128 * 1024, 768 * 1024}
+        def failing_pread(fd, length, offset):
+            if offset in bad_offsets:
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=failing_pread):
+            result = scan_disk(self.image_path, block_size_kb=64, jobs=4)
+        self.assertEqual(result['bytes_scanned'], 1024 * 1024 + 4096)
+        self.assertEqual(result['errors_found'], 2)
+        self.assertEqual(result['bad_regions'].ranges(), [(offset, offset + 64 * 1024) for offset in sorted(bad_offsets)])
+        self.assertIn("Parallel Jobs: 4", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_interrupt_then_resume_from_checkpoint(self, mock_stdout, mock_geteuid):
+        checkpoint_path = os.path.join(self.tmp_dir, 'scan.checkpoint.json')
+        real_pread = os.pread
+        def interrupting_pread(fd, length, offset):
+            if offset == 512 * 1024:
+                raise KeyboardInterrupt
+            if offset == 128 * 1024:
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=interrupting_pread):
+            first = scan_disk(self.image_path, block_size_kb=64, checkpoint=True, checkpoint_path=checkpoint_path)
+        self.assertTrue(first['interrupted'])
+        self.assertEqual(first['bytes_scanned'], 512 * 1024)
+        self.assertTrue(os.path.exists(checkpoint_path))
+
+        resumed = scan_disk(self.image_path, block_size_kb=256, checkpoint_path=checkpoint_path, resume=True)
+        self.assertFalse(resumed['interrupted'])
+        self.assertEqual(resumed['bytes_scanned'], 1024 * 1024 + 4096)
+        self.assertEqual(resumed['bad_regions'].ranges(), [(128 * 1024, 192 * 1024)]) # Errors carried over
+        self.assertFalse(os.path.exists(checkpoint_path)) # Removed once the scan completes
+        self.assertIn("Resuming from checkpoint", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_resume_refuses_changed_device(self, mock_stdout, mock_geteuid):
+        checkpoint_path = os.path.join(self.tmp_dir, 'scan.checkpoint.json')
+        with patch('os.pread', side_effect=KeyboardInterrupt):
+            scan_disk(self.image_path, checkpoint=True, checkpoint_path=checkpoint_path)
+        with open(self.image_path, 'ab') as f:
+            f.write(b'\0' * 4096) # Device size changed
+        self.assertIsNone(scan_disk(self.image_path, checkpoint_path=checkpoint_path, resume=True))
+        self.assertIn("Refusing to resume", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_reports_slow_blocks(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        def slow_pread(fd, length, offset):
+            if offset == 256 * 1024:
+                time.sleep(0.05)
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=slow_pread):
+            result = scan_disk(self.image_path, block_size_kb=64, slow_threshold_ms=40)
+        self.assertEqual(result['errors_found'], 0)
+        self.assertEqual(result['slow_regions'].ranges(), [(256 * 1024, 320 * 1024)])
+        self.assertEqual(result['slowest_blocks'][0][1], 256 * 1024)
+        self.assertGreaterEqual(result['latency'].max_seconds, 0.05)
+        self.assertEqual(result['latency'].count(), 17)
+        self.assertIn("Slow Regions (>= 40 ms per block): 1 range(s)", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_sampling_is_stratified_and_ascending(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        offsets_read = []
+        def recording_pread(fd, length, offset):
+            offsets_read.append(offset)
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=recording_pread):
+            result = scan_disk(self.image_path, block_size_kb=4, sample_blocks=32, sample_seed=7)
+        self.assertEqual(result['sampling']['sampled_blocks'], 32)
+        self.assertEqual(offsets_read, sorted(offsets_read)) # Single pass, forward seeks only
+        total_blocks = (1024 * 1024 + 4096) // 4096
+        for zone in range(32):
+            zone_start, zone_end = zone * total_blocks // 32 * 4096, (zone + 1) * total_blocks // 32 * 4096
+            self.assertTrue(any(zone_start <= offset < zone_end for offset in offsets_read), f"zone {zone} not sampled")
+        self.assertIn("Estimated Bad Block Density: 0.0000%", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_sampling_estimates_density_of_bad_blocks(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        def failing_pread(fd, length, offset):
+            if (offset // 4096) % 4 == 0: # Every 4th block is bad
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=failing_pread):
+            result = scan_disk(self.image_path, block_size_kb=4, sample_fraction=0.5, sample_seed=1)
+        sampled = result['sampling']['sampled_blocks']
+        self.assertEqual(sampled, 129) # ceil(257 * 0.5)
+        low, high = wilson_interval(result['errors_found'], sampled)
+        self.assertLess(low, 0.25)
+        self.assertGreater(high, 0.25)
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_rescan_regions_reads_only_targets_and_classifies(self, mock_stdout, mock_geteuid):
+        regions_path = os.path.join(self.tmp_dir, 'previous.badregions.jsonl')
+        BadRegionMap([(64 * 1024, 128 * 1024), (512 * 1024, 576 * 1024)]).save(regions_path, device_path=self.image_path)
+        real_pread = os.pread
+        offsets_read = []
+        def failing_pread(fd, length, offset):
+            offsets_read.append(offset)
+            if offset <= 520 * 1024 < offset + length or offset <= 600 * 1024 < offset + length:
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=failing_pread):
+            result = rescan_regions(self.image_path, [regions_path], margin_kb=64, block_size_kb=64)
+        self.assertEqual(result['recovered'], [(64 * 1024, 128 * 1024)])
+        self.assertEqual(result['still_bad'], [(512 * 1024, 576 * 1024)])
+        self.assertEqual(len(result['new']), 1)
+        self.assertTrue(all(0 <= offset < 640 * 1024 for offset in offsets_read)) # Nothing outside targets + margin
+        self.assertIn("Previously reported regions now readable: 1", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_skips_ahead_in_dead_zone_then_fills_in(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        block = 64 * 1024
+        offsets_read = []
+        def dead_zone_pread(fd, length, offset):
+            offsets_read.append(offset)
+            if 4 * block <= offset < 12 * block:
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=dead_zone_pread):
+            result = scan_disk(self.image_path, block_size_kb=64, max_skip_kb=256)
+        # First pass: errors at 4, 5 (skip 1 block), 7 (skip 2), 10 (skip 4) and on to the end.
+        self.assertLess(offsets_read.index(15 * block), offsets_read.index(6 * block))
+        self.assertEqual(result['bad_regions'].ranges(), [(4 * block, 12 * block)])
+        self.assertEqual(result['errors_found'], 8)
+        self.assertEqual(result['bytes_scanned'], 1024 * 1024 + 4096)
+        self.assertFalse(result['skipped_regions'])
+        self.assertIn("Second pass over 3 skipped area(s)", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_without_second_pass_reports_skipped_areas(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        block = 64 * 1024
+        def dead_zone_pread(fd, length, offset):
+            if 4 * block <= offset < 12 * block:
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=dead_zone_pread):
+            result = scan_disk(self.image_path, block_size_kb=64, max_skip_kb=256, second_pass=False)
+        self.assertEqual(result['skipped_regions'].ranges(), [(6 * block, 7 * block), (8 * block, 10 * block), (11 * block, 15 * block)])
+        self.assertEqual(result['bytes_scanned'], 1024 * 1024 + 4096 - 7 * block)
+        self.assertIn("Skipped Areas Not Read: 3 range(s)", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_retries_failing_block(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        failures = {192 * 1024: 2}
+        def flaky_pread(fd, length, offset):
+            if failures.get(offset):
+                failures[offset] -= 1
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=flaky_pread):
+            result = scan_disk(self.image_path, block_size_kb=64, retries=2)
+        self.assertEqual(result['errors_found'], 0)
+        self.assertEqual(result['recovered_by_retry'], 1)
+        self.assertIn("Blocks Read After Retrying: 1", mock_stdout.getvalue())
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_disk_watchdog_records_stalled_read_as_timeout(self, mock_stdout, mock_geteuid):
+        real_pread = os.pread
+        def stalling_pread(fd, length, offset):
+            if offset == 128 * 1024:
+                time.sleep(0.5)
+            return real_pread(fd, length, offset)
+        with patch('os.pread', side_effect=stalling_pread):
+            started = time.monotonic()
+            result = scan_disk(self.image_path, block_size_kb=64, read_timeout_s=0.1, adaptive=True)
+            self.assertLess(time.monotonic() - started, 0.45)
+        self.assertEqual(result['timeouts'], 1)
+        self.assertEqual(result['timeout_regions'].ranges(), [(128 * 1024, 192 * 1024)])
+        self.assertEqual(result['bad_regions'].ranges(), [(128 * 1024, 192 * 1024)])
+        self.assertEqual(result['bytes_scanned'], 1024 * 1024 + 4096)
+        self.assertIn("Read Timeouts (> 0.1s): 1", mock_stdout.getvalue())
+
+    def test_split_scan_range_covers_range_with_aligned_segments(self):
+        segments = split_scan_range(0, 10 * 1024 * 1024 + 512, 64 * 1024, 4)
+        self.assertEqual(segments[0][0], 0)
+        self.assertEqual(segments[-1][1], 10 * 1024 * 1024 + 512)
+        for (start, end), (next_start, _) in zip(segments, segments[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(start % (64 * 1024), 0)
+
+    def test_alignment_helpers(self):
+        self.assertEqual(align_up(3 * 1024, 4096), 4096)
+        self.assertEqual(align_down(5000, 512), 4608)
+        fd = os.open(self.image_path, os.O_RDONLY)
+        try:
+            self.assertEqual(get_logical_sector_size(fd) % 512, 0)
+        finally:
+            os.close(fd)
+
+
+class TestLocateBadSectors(unittest.TestCase):
+
+    def make_reader(self, bad_offsets, sector_size=512):
+        calls = []
+        def read_block(offset, length):
+            calls.append((offset, length))
+            for bad in bad_offsets:
+                if offset <= bad < offset + length:
+                    raise OSError(errno.EIO, "Input/output error")
+            return length
+        return read_block, calls
+
+    def test_single_bad_sector_is_pinpointed(self):
+        read_block, calls = self.make_reader([64 * 1024 + 3 * 512])
+        readable, bad = locate_bad_sectors(read_block, 64 * 1024, 64 * 1024, 512)
+        self.assertEqual(bad, [64 * 1024 + 3 * 512])
+        self.assertEqual(readable, 64 * 1024 - 512)
+        # Bisection, not a sector-by-sector sweep of the 128 sectors.
+        self.assertLess(len(calls), 2 * 8 + 2)
+
+    def test_multiple_bad_sectors_reported_in_ascending_order(self):
+        read_block, _ = self.make_reader([7 * 512, 0, 100 * 512])
+        readable, bad = locate_bad_sectors(read_block, 0, 128 * 512, 512)
+        self.assertEqual(bad, [0, 7 * 512, 100 * 512])
+        self.assertEqual(readable, 125 * 512)
+
+
+class TestScanDevices(TempFilesMixin, unittest.TestCase):
+
+    @patch('dead_sector_killer.get_parent_disk')
+    def test_group_devices_serializes_partitions_of_same_disk(self, mock_parent):
+        parents = {
+            '/dev/sda1': ('/dev/sda',), '/dev/sda2': ('/dev/sda',), '/dev/sdb': ('/dev/sdb',),
+            '/dev/dm-0': ('/dev/sdb', '/dev/sdc'), '/dev/sdd': ('/dev/sdd',),
+        }
+        mock_parent.side_effect = lambda path: parents[path]
+        groups = group_devices_by_parent_disk(['/dev/sda1', '/dev/sdb', '/dev/sda2', '/dev/dm-0', '/dev/sdd', '/dev/sdb'])
+        self.assertEqual(groups, [['/dev/sda1', '/dev/sda2'], ['/dev/sdb', '/dev/dm-0'], ['/dev/sdd']])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_devices_reports_each_device(self, mock_stdout):
+        self.make_temp_dir()
+        paths = [self.make_image(256 * 1024, random=True, name=name) for name in ('a.img', 'b.img')]
+        results = scan_devices(paths, block_size_kb=64)
+        self.assertEqual(set(results), set(paths))
+        for path in paths:
+            self.assertEqual(results[path]['bytes_scanned'], 256 * 1024)
+        output = mock_stdout.getvalue()
+        self.assertIn("--- Multi-Device Overview ---", output)
+        self.assertEqual(output.count("--- Scan Summary ---"), 2)
+
+
+class TestBadRegionMap(unittest.TestCase):
+
+    def test_add_coalesces_adjacent_and_overlapping_ranges(self):
+        regions = BadRegionMap()
+        for offset in (0, 4096, 8192, 65536, 61440):
+            regions.add(offset, 4096)
+        regions.add(2048, 100) # Inside an existing range
+        self.assertEqual(regions.ranges(), [(0, 12288), (61440, 69632)])
+        self.assertEqual(regions.total_bytes(), 12288 + 8192)
+
+    def test_merge_gap_joins_nearby_ranges(self):
+        regions = BadRegionMap(merge_gap=4096)
+        regions.add(0, 512)
+        regions.add(4096, 512)
+        regions.add(100000, 512)
+        self.assertEqual(regions.ranges(), [(0, 4608), (100000, 100512)])
+
+    def test_query_contains_union_intersection(self):
+        a = BadRegionMap([(0, 100), (200, 300), (1000, 1100)])
+        b = BadRegionMap([(50, 250), (2000, 2100)])
+        self.assertTrue(a.contains(250))
+        self.assertFalse(a.contains(300))
+        self.assertEqual(a.query(90, 120), [(0, 100), (200, 300)])
+        self.assertEqual(a.union(b).ranges(), [(0, 300), (1000, 1100), (2000, 2100)])
+        self.assertEqual(a.intersection(b).ranges(), [(50, 100), (200, 250)])
+
+    def test_save_and_load_round_trip(self):
+        regions = BadRegionMap([(512, 1024), (1 << 40, (1 << 40) + 4096)])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'regions.jsonl')
+            regions.save(path, device_path='/dev/sdx')
+            loaded, header = BadRegionMap.load(path)
+        self.assertEqual(loaded, regions)
+        self.assertEqual(header['device_path'], '/dev/sdx')
+        self.assertEqual(header['bad_bytes'], 512 + 4096)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_and_max(self):
+        histogram = LatencyHistogram()
+        for _ in range(98):
+            histogram.record(0.001) # 1 ms
+        histogram.record(0.5)
+        histogram.record(1.5)
+        self.assertEqual(histogram.count(), 100)
+        self.assertAlmostEqual(histogram.percentile(50), 0.001, delta=0.0003)
+        self.assertAlmostEqual(histogram.percentile(99), 0.5, delta=0.1)
+        self.assertEqual(histogram.percentile(100), 1.5)
+        self.assertEqual(histogram.max_seconds, 1.5)
+
+    def test_merge_and_fixed_size(self):
+        a, b = LatencyHistogram(), LatencyHistogram()
+        a.record(0.002)
+        b.record(3600.0 * 10) # Far beyond the last bucket
+        a.merge(b)
+        self.assertEqual(a.count(), 2)
+        self.assertEqual(len(a.counts), LatencyHistogram.BUCKET_COUNT)
+        self.assertEqual(a.max_seconds, 36000.0)
+
+
+class TestWilsonInterval(unittest.TestCase):
+
+    def test_interval_brackets_proportion_and_narrows(self):
+        low_small, high_small = wilson_interval(1, 100)
+        low_large, high_large = wilson_interval(100, 10000)
+        self.assertLess(low_small, 0.01)
+        self.assertGreater(high_small, 0.01)
+        self.assertLess(high_large - low_large, high_small - low_small)
+        self.assertEqual(wilson_interval(0, 0), (0.0, 1.0))
+        self.assertEqual(wilson_interval(0, 50)[0], 0.0)
+
+
+class TestIOThrottle(unittest.TestCase):
+
+    def test_bandwidth_cap(self):
+        throttle = IOThrottle(max_bytes_per_s=1024 * 1024)
+        start = time.monotonic()
+        for _ in range(5):
+            throttle.acquire(100 * 1024)
+        # The first read goes immediately, the next four wait ~0.1s each.
+        self.assertGreaterEqual(time.monotonic() - start, 0.35)
+
+    def test_iops_cap(self):
+        throttle = IOThrottle(max_iops=50)
+        start = time.monotonic()
+        for _ in range(6):
+            throttle.acquire(4096)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    @patch('psutil.disk_io_counters')
+    def test_adaptive_backs_off_under_foreground_load_and_recovers(self, mock_counters):
+        def counters(ios, io_time_ms):
+            return {'sdz': MagicMock(read_count=ios, write_count=0, read_time=io_time_ms, write_time=0, busy_time=0)}
+        mock_counters.return_value = counters(0, 0)
+        throttle = IOThrottle(adaptive=True, disk_name='sdz', target_latency_ms=20)
+        now = time.monotonic()
+        # 200 foreground I/Os at 100 ms each within ~1 s: heavy pressure.
+        mock_counters.return_value = counters(200, 20000)
+        throttle._update_pressure(now + 1)
+        mock_counters.return_value = counters(400, 40000)
+        throttle._update_pressure(now + 2)
+        self.assertTrue(throttle.under_pressure)
+        self.assertGreater(throttle.delay_s, 0)
+        # Foreground load gone: delay decays back to zero.
+        for step in range(3, 30):
+            throttle._update_pressure(now + step)
+        self.assertFalse(throttle.under_pressure)
+        self.assertEqual(throttle.delay_s, 0.0)
+
+
+class TestMapBadRegionsToFiles(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.make_temp_dir()
+        self.mount_point = os.path.join(self.tmp_dir, "fs")
+        os.makedirs(os.path.join(self.mount_point, "sub"))
+        self.index_path = os.path.join(self.tmp_dir, "extents.sqlite")
+        self.files = {}
+        for name in ("a.bin", os.path.join("sub", "b.bin")):
+            path = os.path.join(self.mount_point, name)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(64 * 1024))
+                f.flush()
+                os.fsync(f.fileno())
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self.files[path] = get_file_extents(fd)
+            except OSError as e:
+                self.skipTest(f"FIEMAP not supported here: {e}")
+            finally:
+                os.close(fd)
+            if not self.files[path]:
+                self.skipTest("Filesystem reported no extents")
+
+    def write_regions(self, ranges):
+        regions_path = os.path.join(self.tmp_dir, "bad.jsonl")
+        BadRegionMap(ranges).save(regions_path, device_path="/dev/fake")
+        return regions_path
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_build_extent_index_reuses_unchanged_files(self, mock_stdout):
+        counters = build_extent_index(self.mount_point, self.index_path)
+        self.assertEqual((counters['files'], counters['mapped'], counters['reused']), (2, 2, 0))
+        os.remove(os.path.join(self.mount_point, "a.bin"))
+        counters = build_extent_index(self.mount_point, self.index_path)
+        self.assertEqual((counters['files'], counters['mapped'], counters['reused'], counters['removed']), (1, 0, 1, 1))
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_map_translates_device_offsets_to_files(self, mock_stdout):
+        target = os.path.join(self.mount_point, "sub", "b.bin")
+        logical, physical, length, _ = self.files[target][0]
+        partition_offset = 1024 * 1024
+        # One bad 4 KiB region, 8 KiB into the file, given as whole-disk offsets.
+        regions_path = self.write_regions([(partition_offset + physical + 8192, partition_offset + physical + 12288)])
+        affected = map_bad_regions_to_files([regions_path], self.mount_point, index_path=self.index_path,
+                                            partition_offset=partition_offset)
+        self.assertEqual(affected, {target: [(logical + 8192, logical + 12288)]})
+        self.assertIn("--- Affected Files (1) ---", mock_stdout.getvalue())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_map_ignores_regions_before_filesystem_start(self, mock_stdout):
+        regions_path = self.write_regions([(0, 4096)])
+        affected = map_bad_regions_to_files([regions_path], self.mount_point, index_path=self.index_path,
+                                            partition_offset=1024 * 1024)
+        self.assertEqual(affected, {})
+        self.assertIn("lie before the filesystem start", mock_stdout.getvalue())
+
+    @patch('dead_sector_killer.get_filesystem_offset', return_value=None)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_map_fails_without_partition_offset(self, mock_stdout, mock_offset):
+        regions_path = self.write_regions([(0, 4096)])
+        self.assertIsNone(map_bad_regions_to_files([regions_path], self.mount_point, index_path=self.index_path))
+        mock_offset.assert_called_once_with("/dev/fake", self.mount_point)
+        self.assertIn("Error: Could not find where the filesystem", mock_stdout.getvalue())
+
+
+class TestReporter(TempFilesMixin, unittest.TestCase):
+
+    def test_jsonl_reporter_rate_limits_progress_and_buffers(self):
+        stream = io.StringIO()
+        reporter = JsonlReporter(stream, progress_interval_s=60, flush_interval_s=60)
+        reporter.emit("start", "text is ignored", operation="scan")
+        for done in range(100):
+            reporter.emit("progress", bytes_done=done)
+        reporter.emit("detail", "  per-file chatter")
+        self.assertEqual(stream.getvalue(), "") # Still buffered
+        reporter.emit("progress", bytes_done=100, final=True)
+        reporter.emit("summary", errors_found=0) # Summaries flush
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([event["event"] for event in events], ["start", "progress", "progress", "summary"])
+        self.assertEqual([event.get("bytes_done") for event in events[1:3]], [0, 100])
+        self.assertEqual(events[0]["operation"], "scan")
+
+    def test_reporter_without_render_cannot_be_created(self):
+        class IncompleteReporter(Reporter):
+            pass
+        with self.assertRaises(TypeError):
+            IncompleteReporter()
+        with self.assertRaises(TypeError):
+            Reporter()
+
+    @patch('os.geteuid', return_value=0, create=True)
+    def test_main_jsonl_output_emits_only_events_on_stdout(self, mock_geteuid):
+        self.make_temp_dir()
+        image_path = self.make_image(256 * 1024, random=True)
+        real_pread = os.pread
+        def failing_pread(fd, length, offset):
+            if offset == 64 * 1024:
+                raise OSError(errno.EIO, "Input/output error")
+            return real_pread(fd, length, offset)
+        with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout, \
+             patch('sys.stderr', new_callable=io.StringIO), patch('os.pread', side_effect=failing_pread):
+            main(['--scan', image_path, '--output', 'jsonl', '--no-checkpoint',
+                  '--bad-regions-file', os.path.join(self.tmp_dir, 'bad.jsonl')])
+            output = mock_stdout.getvalue()
+        events = [json.loads(line) for line in output.splitlines()]
+        kinds = [event["event"] for event in events]
+        self.assertEqual(kinds[0], "start")
+        self.assertEqual(kinds[-1], "summary")
+        self.assertIn("progress", kinds)
+        error = next(event for event in events if event["event"] == "error")
+        self.assertEqual((error["kind"], error["offset"]), ("read", 64 * 1024))
+        self.assertEqual((events[-1]["errors_found"], events[-1]["bytes_scanned"]), (1, 256 * 1024))
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main_saves_slow_regions_next_to_bad_regions(self, mock_stdout, mock_geteuid):
+        self.make_temp_dir()
+        image_path = self.make_image(256 * 1024, random=True)
+        bad_path, slow_path = os.path.join(self.tmp_dir, 'bad.jsonl'), os.path.join(self.tmp_dir, 'slow.jsonl')
+        main(['--scan', image_path, '--no-checkpoint', '--bad-regions-file', bad_path])
+        self.assertEqual(sorted(name for name in os.listdir(self.tmp_dir) if name.endswith('.jsonl')),
+                         ['bad.jsonl', get_default_scan_file_path(image_path, 'slowregions.jsonl')])
+        main(['--scan', image_path, '--no-checkpoint', '--bad-regions-file', bad_path, '--slow-regions-file', slow_path])
+        self.assertTrue(os.path.exists(slow_path))
+
+
+class TestFaultInjectingBackend(TempFilesMixin, unittest.TestCase):
+    """Real reads of a sparse image through a backend that simulates a failing disk.
+
+    The backend reads holes by default, so the whole (unallocated) image is scanned.
+    """
+
+    def setUp(self):
+        self.make_temp_dir()
+        self.image_path = self.make_image(8 * 1024 * 1024, name='sparse.img')
+
+    def make_backend(self, **faults):
+        backend = FaultInjectingBackend(**faults)
+        self.addCleanup(backend.release)
+        return backend
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_adaptive_scan_pinpoints_injected_bad_sectors(self, mock_stdout, mock_geteuid):
+        backend = self.make_backend(bad_ranges=[(1000000, 1000100), (5 * 1024 * 1024, 5 * 1024 * 1024 + 512)])
+        result = scan_disk(self.image_path, block_size_kb=1024, adaptive=True, backend=backend)
+        sector = result['sector_size'] # Logical sector size the image file reports (512 or 4096)
+        self.assertEqual(result['bad_regions'].ranges(), [(align_down(1000000, sector), align_up(1000100, sector)),
+                                                          (5 * 1024 * 1024, 5 * 1024 * 1024 + sector)])
+        self.assertEqual(result['bad_sector_count'], 2)
+        self.assertEqual(result['bytes_scanned'], 8 * 1024 * 1024)
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_parallel_scan_reports_injected_errors_and_latency(self, mock_stdout, mock_geteuid):
+        backend = self.make_backend(bad_ranges=[(3 * 1024 * 1024, 3 * 1024 * 1024 + 1)],
+                                    slow_ranges=[(6 * 1024 * 1024, 6 * 1024 * 1024 + 1, 0.05)])
+        result = scan_disk(self.image_path, block_size_kb=256, jobs=4, slow_threshold_ms=40, backend=backend)
+        self.assertEqual(result['bad_regions'].ranges(), [(3 * 1024 * 1024, 3 * 1024 * 1024 + 256 * 1024)])
+        self.assertEqual(result['slow_regions'].ranges(), [(6 * 1024 * 1024, 6 * 1024 * 1024 + 256 * 1024)])
+        self.assertEqual(len(backend.reads), 32)
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_hanging_range_is_bounded_by_watchdog(self, mock_stdout, mock_geteuid):
+        backend = self.make_backend(hang_ranges=[(2 * 1024 * 1024, 2 * 1024 * 1024 + 1)])
+        result = scan_disk(self.image_path, block_size_kb=1024, read_timeout_s=0.1, backend=backend)
+        self.assertEqual(result['timeout_regions'].ranges(), [(2 * 1024 * 1024, 3 * 1024 * 1024)])
+        self.assertEqual(result['bytes_scanned'], 8 * 1024 * 1024)
+
+    @patch('os.geteuid', return_value=0, create=True)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_parallel_watchdogs_are_per_worker(self, mock_stdout, mock_geteuid):
+        import dead_sector_killer
+        created = []
+        real_watchdog = dead_sector_killer.ReadWatchdog
+        def counting_watchdog(*args, **kwargs):
+            created.append(real_watchdog(*args, **kwargs))
+            return created[-1]
+
+        backend = self.make_backend()
+        with patch('dead_sector_killer.ReadWatchdog', side_effect=counting_watchdog):
+            result = scan_disk(self.image_path, block_size_kb=64, jobs=2, read_timeout_s=5, backend=backend)
+        self.assertEqual(result['bytes_scanned'], 8 * 1024 * 1024)
+        self.assertLessEqual(len(created), 2) # 16 segments, one watchdog per worker thread
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_check_file_integrity_reports_injected_error(self, mock_stdout):
+        backend = self.make_backend(bad_ranges=[(3 * 1024 * 1024, 3 * 1024 * 1024 + 1)])
+        is_ok, message = check_file_integrity(self.image_path, read_chunk_size_kb=1024, backend=backend)
+        self.assertFalse(is_ok)
+        self.assertIn("Injected I/O error at offset 3145728", message)
+        self.assertIn("Read error in", mock_stdout.getvalue())
+
+
+class TestWriteVerifyDevice(TempFilesMixin, unittest.TestCase):
+    """Destructive pattern test against a small image file."""
+
+    def setUp(self):
+        self.make_temp_dir()
+        self.image_path = self.make_image(2 * 1024 * 1024)
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_clean_image_passes_all_patterns(self, mock_stdout):
+        regions_path = os.path.join(self.tmp_dir, 'write.jsonl')
+        result = write_verify_device(self.image_path, patterns=["0xaa", "random"], block_size_kb=256, seed=7,
+                                     confirmed=True, bad_regions_path=regions_path)
+        self.assertEqual(result['bytes_verified'], 2 * 2 * 1024 * 1024)
+        self.assertEqual(len(result['bad_regions']), 0)
+        self.assertFalse(result['interrupted'])
+        with open(self.image_path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(len(data), 2 * 1024 * 1024)
+        self.assertNotEqual(data[:256 * 1024], data[256 * 1024:512 * 1024]) # Random data differs per block
+        self.assertIn("--- Write Test Summary ---", mock_stdout.getvalue())
+        self.assertTrue(os.path.exists(regions_path))
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_corrupted_read_back_records_mismatched_sector(self, mock_stdout):
+        real_preadv = os.preadv
+
+        def corrupting_preadv(fd, buffers, offset):
+            bytes_read = real_preadv(fd, buffers, offset)
+            if offset == 512 * 1024:
+                buffers[0][1000] ^= 0xFF # Flip one byte inside the block's first 4 KB
+            return bytes_read
+
+        with patch('os.preadv', side_effect=corrupting_preadv):
+            result = write_verify_device(self.image_path, patterns=["0x55"], block_size_kb=256, confirmed=True)
+        sector = result['sector_size']
+        self.assertEqual(result['mismatches'].ranges(), [(512 * 1024 + align_down(1000, sector), 512 * 1024 + align_up(1001, sector))])
+        self.assertEqual(len(result['read_errors']), 0)
+        self.assertIn("Data mismatch in 1 sector(s)", mock_stdout.getvalue())
+
+    @patch('dead_sector_killer.find_device_users', return_value=["/dev/loop0 mounted on /mnt/test"])
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_refuses_device_in_use(self, mock_stdout, mock_users):
+        self.assertIsNone(write_verify_device(self.image_path, confirmed=True))
+        self.assertIn("Refusing to write", mock_stdout.getvalue())
+
+    @patch('dead_sector_killer.get_active_swaps')
+    @patch('psutil.disk_partitions', return_value=[])
+    def test_active_swap_file_counts_as_user(self, mock_partitions, mock_swaps):
+        mock_swaps.return_value = [self.image_path]
+        self.assertEqual(find_device_users(self.image_path), [f"{self.image_path} (active swap)"])
+        mock_swaps.return_value = ["/dev/zram0"]
+        self.assertEqual(find_device_users(self.image_path), [])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_busy_block_device_is_refused(self, mock_stdout):
+        with patch('dead_sector_killer.find_device_users', return_value=[]), \
+             patch('os.path.isfile', return_value=False), patch('os.geteuid', return_value=0, create=True), \
+             patch('os.open', side_effect=OSError(errno.EBUSY, "Device or resource busy")) as mock_open:
+            self.assertIsNone(write_verify_device(self.image_path, confirmed=True))
+        self.assertTrue(mock_open.call_args[0][1] & os.O_EXCL)
+        self.assertIn("the kernel reports it busy", mock_stdout.getvalue())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_short_writes_are_completed_or_recorded(self, mock_stdout):
+        real_pwrite = os.pwrite
+
+        def short_pwrite(fd, data, offset):
+            if offset == 256 * 1024:
+                return real_pwrite(fd, data[:1000], offset) # Short write, the rest is retried
+            if offset == 1024 * 1024:
+                return 0 # The device stopped accepting data
+            return real_pwrite(fd, data, offset)
+
+        with patch('os.pwrite', side_effect=short_pwrite):
+            result = write_verify_device(self.image_path, patterns=["0xaa"], block_size_kb=256, confirmed=True)
+        self.assertEqual(result['write_errors'].ranges(), [(1024 * 1024, 1024 * 1024 + 256 * 1024)])
+        self.assertEqual(result['mismatches'].ranges(), [(1024 * 1024, 1024 * 1024 + 256 * 1024)])
+        with open(self.image_path, 'rb') as f:
+            f.seek(256 * 1024)
+            self.assertEqual(f.read(256 * 1024), b"\xaa" * 256 * 1024)
+        self.assertIn("Short write", mock_stdout.getvalue())
+
+    @patch('builtins.input', return_value='/dev/wrong')
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_wrong_confirmation_cancels_without_writing(self, mock_stdout, mock_input):
+        self.assertIsNone(write_verify_device(self.image_path, patterns=["0xff"]))
+        self.assertIn("Write test cancelled", mock_stdout.getvalue())
+        with open(self.image_path, 'rb') as f:
+            self.assertEqual(f.read(4096), bytes(4096))
+
+
+class TestRegionFingerprints(TempFilesMixin, unittest.TestCase):
+    """Per-region content fingerprints taken during a scan, and comparison with an earlier scan."""
+
+    def setUp(self):
+        self.make_temp_dir()
+        self.image_path = self.make_image(3 * 1024 * 1024 + 4096, random=True) # Last region is short
+        self.baseline_path = os.path.join(self.tmp_dir, 'baseline.jsonl')
+
+    def scan(self, **kwargs):
+        with patch('sys.stdout', new_callable=io.StringIO):
+            return scan_disk(self.image_path, block_size_kb=128, fingerprint_region_mb=1, **kwargs)
+
+    def test_fingerprints_are_independent_of_jobs_and_saved(self):
+        serial = self.scan(fingerprints_path=self.baseline_path)['fingerprints']
+        parallel = self.scan(jobs=4)['fingerprints']
+        self.assertEqual(serial.regions, parallel.regions)
+        self.assertEqual(sorted(serial.regions), [0, 1024**2, 2 * 1024**2, 3 * 1024**2])
+        self.assertEqual(serial.regions[3 * 1024**2][0], 4096)
+        loaded, header = RegionFingerprints.load(self.baseline_path)
+        self.assertEqual(loaded.regions, serial.regions)
+        self.assertEqual(header["region_size"], 1024**2)
+
+    def test_compare_reports_changed_region(self):
+        self.scan(fingerprints_path=self.baseline_path)
+        with open(self.image_path, 'r+b') as f:
+            f.seek(2 * 1024**2 + 12345)
+            f.write(b'\x00\xff')
+        result = self.scan(compare_fingerprints_path=self.baseline_path, jobs=2)
+        changes = result['fingerprint_changes']
+        self.assertEqual(changes['changed'].ranges(), [(2 * 1024**2, 3 * 1024**2)])
+        self.assertEqual((changes['compared'], changes['not_comparable']), (4, 0))
+        self.assertEqual(len(changes['newly_unreadable']), 0)
+
+    def test_compare_reports_newly_unreadable_region(self):
+        self.scan(fingerprints_path=self.baseline_path)
+        backend = FaultInjectingBackend(bad_ranges=[(1024**2 + 500, 1024**2 + 501)])
+        with patch('os.geteuid', return_value=0, create=True):
+            result = self.scan(compare_fingerprints_path=self.baseline_path, backend=backend, adaptive=True)
+        changes = result['fingerprint_changes']
+        self.assertEqual(changes['newly_unreadable'].ranges(), [(1024**2, 2 * 1024**2)])
+        self.assertEqual(len(changes['changed']), 0)
+        self.assertIsNone(result['fingerprints'].regions[1024**2][1])
+
+    def test_sampling_cannot_fingerprint(self):
+        with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            self.assertIsNone(scan_disk(self.image_path, fingerprint_region_mb=1, sample_fraction=0.5))
+        self.assertIn("cannot be combined with sampling", mock_stdout.getvalue())
+
+
+class TestSparseScan(TempFilesMixin, unittest.TestCase):
+    """Scanning only the allocated extents of sparse image files."""
+
+    def setUp(self):
+        self.make_temp_dir()
+        self.image_path = self.make_image(64 * 1024 * 1024, name='thin.img')
+        with open(self.image_path, 'r+b') as f:
+            f.seek(1024 * 1024)
+            f.write(os.urandom(256 * 1024))
+            f.seek(40 * 1024 * 1024 + 4096)
+            f.write(os.urandom(4096))
+        with open(self.image_path, 'rb') as f:
+            ranges = get_allocated_ranges(f.fileno(), 64 * 1024 * 1024, 4096)
+        if ranges is None or sum(end - start for start, end in ranges) >= 64 * 1024 * 1024:
+            self.skipTest("File system does not report holes")
+
+    def test_allocated_ranges_are_aligned_and_merged(self):
+        with open(self.image_path, 'rb') as f:
+            ranges = get_allocated_ranges(f.fileno(), 64 * 1024 * 1024, 64 * 1024)
+        self.assertEqual(ranges, [(1024 * 1024, 1024 * 1024 + 256 * 1024), (40 * 1024 * 1024, 40 * 1024 * 1024 + 64 * 1024)])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_scan_reads_only_allocated_extents(self, mock_stdout):
+        backend = FaultInjectingBackend(bad_ranges=[(40 * 1024 * 1024 + 5000, 40 * 1024 * 1024 + 5001)])
+        result = scan_disk(self.image_path, block_size_kb=64, jobs=2, backend=backend, skip_holes=True)
+        self.assertEqual(result['allocated_bytes'], 320 * 1024)
+        self.assertEqual(result['bytes_scanned'], 320 * 1024)
+        self.assertEqual(result['bad_regions'].ranges(), [(40 * 1024 * 1024, 40 * 1024 * 1024 + 64 * 1024)])
+        self.assertTrue(all(1024 * 1024 <= offset < 41 * 1024 * 1024 for offset, _ in backend.reads))
+        self.assertIn("Allocated Data: 320.00KB of 64.00MB", mock_stdout.getvalue())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_parallel_fingerprints_match_sequential_on_sparse_image(self, mock_stdout):
+        with open(self.image_path, 'r+b') as f: # Data from 1 MB to 40 MB, not aligned to the 4 MB regions
+            f.seek(1024 * 1024)
+            f.write(os.urandom(39 * 1024 * 1024))
+        sequential = scan_disk(self.image_path, block_size_kb=64, fingerprint_region_mb=4, jobs=1)['fingerprints']
+        parallel = scan_disk(self.image_path, block_size_kb=64, fingerprint_region_mb=4, jobs=4)['fingerprints']
+        self.assertEqual(len(sequential), 9) # The whole regions from 4 MB to 40 MB
+        self.assertEqual(parallel.regions, sequential.regions)
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_skip_holes_false_reads_everything(self, mock_stdout):
+        result = scan_disk(self.image_path, block_size_kb=1024, skip_holes=False)
+        self.assertEqual(result['bytes_scanned'], 64 * 1024 * 1024)
+        self.assertIsNone(result['allocated_bytes'])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fault_injecting_backend_reads_holes_by_default(self, mock_stdout):
+        backend = FaultInjectingBackend(bad_ranges=[(20 * 1024 * 1024, 20 * 1024 * 1024 + 1)])
+        result = scan_disk(self.image_path, block_size_kb=1024, backend=backend)
+        self.assertEqual(result['bytes_scanned'], 64 * 1024 * 1024)
+        self.assertEqual(result['bad_regions'].ranges(), [(20 * 1024 * 1024, 21 * 1024 * 1024)])
+
+    def test_warns_when_nothing_is_allocated(self):
+        empty_path = self.make_image(8 * 1024 * 1024, name='empty.img')
+        with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            scan_disk(empty_path, block_size_kb=1024)
+        self.assertIn("  Warning: " + empty_path + " has no allocated data", mock_stdout.getvalue())
+
+
 if __name__ == '__main__':
     unittest.main(argv=['first-arg-is-ignored'], exit=False)